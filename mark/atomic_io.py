@@ -0,0 +1,79 @@
+# atomic_io.py
+"""
+多個行程（daemon、常駐 worker、CLI、行程池）共用同一批快取檔時用的小工具：
+
+  tmp_path(path)          同目錄、帶 pid + 隨機碼的暫存檔名（並行寫入不會互相蓋掉暫存檔）
+  atomic_write_bytes      寫暫存檔再 os.replace，讀的人只會看到舊檔或完整的新檔
+  atomic_savez            同上，給 np.savez
+  file_lock(path)         跨行程互斥鎖（Windows: msvcrt，其他: fcntl），with 區塊結束自動釋放
+"""
+import os
+import time
+import uuid
+import contextlib
+from pathlib import Path
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+def tmp_path(path) -> Path:
+    p = Path(path)
+    return p.with_name(f"{p.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def atomic_write_bytes(path, data: bytes):
+    tmp = tmp_path(path)
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+
+def atomic_savez(path, **arrays):
+    """np.savez 給路徑時會自動補 .npz，所以開檔案物件寫"""
+    import numpy as np
+    tmp = tmp_path(path)
+    try:
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(path, poll: float = 0.05):
+    """path 是鎖檔（不存在會建立，內容不用）；同一時間只有一個行程進得了 with 區塊"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    f = open(path, "a+b")
+    try:
+        if os.name == "nt":
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(poll)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+    finally:
+        try:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        except OSError:
+            pass
+        f.close()
@@ -0,0 +1,325 @@
+# auto_daemon.py
+"""
+auto_process 常駐模式（取代 autoRunner 每個新檔就 spawn 一次 auto_process.py）：
+
+事件來源
+  - 監看資料夾（預設 E:\\ParkSavvy\\uploads，輪詢；檔案大小連續兩次相同才算寫完）
+  - 本機 TCP 127.0.0.1:<port>，一行一個檔名（或 {"filename": ...}），回 "ok"
+  - 啟動時把 DB 裡還沒處理的補進來（daemon 沒在跑的期間上傳的也不會漏）
+
+流程
+  事件 → 佇列 → 查 image_uploads 對應列（檔案比 DB 列早到就稍後重試）
+  → 依 location 合併（該 location 安靜 DAEMON_COALESCE_SEC 秒或最舊的等了 DAEMON_MAX_WAIT_SEC 秒才送）
+  → 同一時間只處理一批（背景執行緒；auto_process 有模組層級的快取狀態，不在同一行程並行）
+  → auto_process.process_images
+  處理中才到的事件留在佇列，該 location 這批一結束就接著送；整批失敗就放回重試。
+
+每張圖結束時在 DAEMON_EVENTS（jsonl，預設 mark/downloads/_daemon_events.jsonl，與 load_generator 相同）寫一行，stdout 也印 '@event {...}'（autoRunner 用來通知前端）。
+"""
+import os
+import sys
+import json
+import time
+import queue
+import socketserver
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from auto_process import (STAGE1_WORKERS, USE_WORKER, WORKER_CMD,
+                          get_unprocessed_images_raw, process_images, supabase)
+from infer_location import make_pool
+
+WATCH_DIR = os.environ.get("DAEMON_WATCH_DIR", r"E:\ParkSavvy\uploads")
+PORT = int(os.environ.get("DAEMON_PORT", "8765"))                       # 0 = 不開 TCP
+COALESCE_SEC = float(os.environ.get("DAEMON_COALESCE_SEC", "1.0"))
+MAX_WAIT_SEC = float(os.environ.get("DAEMON_MAX_WAIT_SEC", "5.0"))
+POLL_SEC = float(os.environ.get("DAEMON_POLL_SEC", "0.5"))
+ROW_TIMEOUT_SEC = float(os.environ.get("DAEMON_ROW_TIMEOUT_SEC", "120"))  # 等 DB 列出現的上限
+MAX_RETRIES = int(os.environ.get("DAEMON_MAX_RETRIES", "3"))
+# 以本檔位置為準（autoRunner 從 repo 根目錄啟動，DOWNLOAD_DIR 是相對路徑）；load_generator 用同一個預設
+EVENTS_PATH = os.environ.get("DAEMON_EVENTS", str(Path(__file__).resolve().parent / "downloads" / "_daemon_events.jsonl"))
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+ROW_COLS = "id, filename, created_at, inferred_area, processed, location"
+
+
+class Daemon:
+    def __init__(self, watch_dir=WATCH_DIR, port=PORT, events_path=EVENTS_PATH, backlog=True):
+        self.watch_dir = watch_dir
+        self.port = port
+        self.events_path = events_path
+        self.backlog = backlog
+
+        self.inbox: "queue.Queue[tuple]" = queue.Queue()   # (filename, 事件時間)
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.waiting = {}                    # filename -> {"seen", "tries", "next"}：還沒查到 DB 列
+        self.ready = defaultdict(dict)       # location -> {image_id: row}
+        self.arrived = {}                    # location -> 最後一次有新圖的時間
+        self.oldest = {}                     # location -> 佇列中最舊的圖進來的時間
+        self.first_seen = {}                 # filename -> 事件時間（算延遲用）
+        self.retries = defaultdict(int)      # image_id -> 失敗次數
+        self.inflight = set()                # 正在處理的 location
+
+        # 一個批次執行緒：主迴圈照常收事件，process_images 一次只跑一批
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="auto")
+        # 建池時還不知道會來哪些 location；每批由 infer_many 在主行程先同步 store / 索引，worker 只讀
+        self.pool = make_pool([], STAGE1_WORKERS) if STAGE1_WORKERS > 1 else None
+        self.workers: "queue.Queue" = queue.Queue()     # 批次執行緒用的 WorkerClient（第一批才建立）
+        self.workers.put(None)
+        self._events_lock = threading.Lock()
+        self._server = None
+
+    # ---------- 事件輸出 ----------
+    def emit(self, **event):
+        event.setdefault("ts", time.time())
+        line = json.dumps(event, ensure_ascii=False)
+        with self._events_lock:
+            with open(self.events_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            print("@event " + line, flush=True)
+
+    # ---------- 事件來源 ----------
+    def submit(self, filename: str, ts: float = None):
+        name = os.path.basename((filename or "").strip())
+        if name.lower().endswith(IMAGE_EXTS):
+            self.inbox.put((name, ts or time.time()))
+
+    def _watch(self):
+        """輪詢資料夾；啟動時已存在的檔案交給 DB backlog"""
+        try:
+            known = {e.name for e in os.scandir(self.watch_dir)}
+        except OSError as e:
+            print(f"⚠️ 無法監看 {self.watch_dir}：{e}")
+            return
+        sizes, first = {}, {}
+        while not self.stop.wait(POLL_SEC):
+            try:
+                entries = list(os.scandir(self.watch_dir))
+            except OSError:
+                continue
+            now = time.time()
+            for e in entries:
+                if e.name in known or not e.name.lower().endswith(IMAGE_EXTS):
+                    continue
+                try:
+                    size = e.stat().st_size
+                except OSError:
+                    continue
+                first.setdefault(e.name, now)
+                if sizes.get(e.name) == size and size > 0:     # 連續兩次大小相同 → 寫完了
+                    known.add(e.name)
+                    self.submit(e.name, first.pop(e.name))
+                    sizes.pop(e.name, None)
+                else:
+                    sizes[e.name] = size
+
+    def _serve_tcp(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for raw in self.rfile:
+                    line = raw.decode("utf-8", "replace").strip()
+                    if not line:
+                        continue
+                    if line.startswith("{"):
+                        try:
+                            line = json.loads(line).get("filename", "")
+                        except ValueError:
+                            line = ""
+                    daemon.submit(line)
+                    self.wfile.write(b"ok\n")
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", self.port), Handler)
+        self._server.daemon_threads = True
+        print(f"🔌 daemon 接收 127.0.0.1:{self.port}")
+        self._server.serve_forever()
+
+    # ---------- 佇列 ----------
+    def _add_rows(self, rows, now):
+        for row in rows:
+            loc = (row.get("location") or "").strip()
+            self.ready[loc][row["id"]] = row
+            self.arrived[loc] = now
+            self.oldest.setdefault(loc, self.first_seen.get(row["filename"], now))
+
+    def _drain_inbox(self):
+        try:
+            item = self.inbox.get(timeout=POLL_SEC)
+        except queue.Empty:
+            return
+        while True:
+            name, ts = item
+            with self.lock:
+                self.first_seen.setdefault(name, ts)
+                self.waiting.setdefault(name, {"seen": ts, "tries": 0, "next": 0.0})
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+
+    def _resolve_rows(self):
+        """把 waiting 的檔名換成 image_uploads 列；查不到的退避重試，逾時才放棄"""
+        now = time.time()
+        with self.lock:
+            due = [n for n, w in self.waiting.items() if w["next"] <= now]
+        if not due:
+            return
+        found = {}
+        try:
+            for i in range(0, len(due), 200):
+                for row in (supabase.table("image_uploads").select(ROW_COLS)
+                            .in_("filename", due[i:i + 200]).execute().data or []):
+                    found[row["filename"]] = row
+        except Exception as e:
+            print(f"⚠️ 查詢 image_uploads 失敗，稍後重試：{e}")
+            return
+
+        with self.lock:
+            rows = []
+            for name in due:
+                w = self.waiting[name]
+                row = found.get(name)
+                if row is not None:
+                    del self.waiting[name]
+                    if row.get("processed"):
+                        self.emit(event="skipped", filename=name, reason="already processed")
+                        self.first_seen.pop(name, None)
+                    else:
+                        rows.append(row)
+                elif now - w["seen"] > ROW_TIMEOUT_SEC:
+                    del self.waiting[name]
+                    self.first_seen.pop(name, None)
+                    self.emit(event="skipped", filename=name, reason="no image_uploads row")
+                else:
+                    w["tries"] += 1
+                    w["next"] = now + min(2 ** w["tries"] * 0.25, 10.0)
+            self._add_rows(rows, now)
+
+    def _dispatch(self):
+        now = time.time()
+        with self.lock:
+            for loc in sorted(self.ready, key=lambda l: self.oldest.get(l, now)):
+                if self.inflight:       # 一次一批
+                    break
+                if not self.ready[loc]:
+                    continue
+                quiet = now - self.arrived.get(loc, 0) >= COALESCE_SEC
+                overdue = now - self.oldest.get(loc, now) >= MAX_WAIT_SEC
+                if not (quiet or overdue):
+                    continue
+                rows = list(self.ready.pop(loc).values())
+                self.oldest.pop(loc, None)
+                self.inflight.add(loc)
+                self.executor.submit(self._run_batch, loc, rows)
+
+    def _take_worker(self):
+        w = self.workers.get()
+        if w is None and USE_WORKER:
+            from inference_worker import WorkerClient
+            try:
+                w = WorkerClient(WORKER_CMD)
+            except Exception as e:
+                print(f"⚠️ inference worker 啟動失敗，改用 conda run：{e}")
+        return w
+
+    def _run_batch(self, loc, rows):
+        t0 = time.time()
+        worker = self._take_worker()
+        ok, areas = False, []
+        try:
+            print(f"\n🚚 [{loc or '(無 location)'}] 處理 {len(rows)} 張")
+            areas = process_images(rows, pool=self.pool, worker=worker) or []
+            ok = True
+        except Exception as e:
+            print(f"❌ [{loc}] 批次失敗：{e}")
+        finally:
+            self.workers.put(worker)
+
+        done = time.time()
+        with self.lock:
+            self.inflight.discard(loc)
+            for row in rows:
+                name = row["filename"]
+                if ok:
+                    self.retries.pop(row["id"], None)
+                    self.emit(event="done", filename=name, image_id=row["id"], location=loc,
+                              latency_ms=round((done - self.first_seen.pop(name, t0)) * 1000, 1))
+                elif self.retries[row["id"]] < MAX_RETRIES:
+                    self.retries[row["id"]] += 1
+                    self.ready[loc].setdefault(row["id"], row)       # 放回佇列，不丟
+                    self.arrived[loc] = done                         # 隔一個 COALESCE_SEC 再試
+                    self.oldest.setdefault(loc, self.first_seen.get(name, t0))
+                else:
+                    self.retries.pop(row["id"], None)
+                    self.first_seen.pop(name, None)
+                    self.emit(event="failed", filename=name, image_id=row["id"], location=loc)
+            if ok:
+                self.emit(event="batch", location=loc, images=len(rows), areas=sorted(set(areas)),
+                          batch_ms=round((done - t0) * 1000, 1))
+
+    # ---------- 主迴圈 ----------
+    def run(self):
+        Path(self.events_path).parent.mkdir(parents=True, exist_ok=True)
+        threads = [threading.Thread(target=self._watch, daemon=True)] if self.watch_dir else []
+        if self.port:
+            threads.append(threading.Thread(target=self._serve_tcp, daemon=True))
+        for t in threads:
+            t.start()
+
+        if self.backlog:
+            try:
+                rows = get_unprocessed_images_raw(limit=1000)
+                for row in rows:
+                    self.first_seen.setdefault(row["filename"], time.time())
+                with self.lock:
+                    self._add_rows(rows, time.time())
+                print(f"📥 啟動時補進未處理 {len(rows)} 張")
+            except Exception as e:
+                print(f"⚠️ 讀取未處理清單失敗：{e}")
+
+        print(f"👂 auto_process daemon 就緒（監看 {self.watch_dir or '-'}）", flush=True)
+        try:
+            while not self.stop.is_set():
+                self._drain_inbox()
+                self._resolve_rows()
+                self._dispatch()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self.stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+        self.executor.shutdown(wait=True)
+        if self.pool is not None:
+            self.pool.shutdown()
+        while not self.workers.empty():
+            w = self.workers.get_nowait()
+            if w is not None:
+                w.close()
+
+
+def main(argv) -> int:
+    """auto_daemon.py [--watch DIR] [--port N] [--no-backlog]"""
+    flags = {"--no-backlog"}
+    opts = {}
+    it = iter(argv)
+    for a in it:
+        opts[a] = True if a in flags else next(it, None)
+    Daemon(
+        watch_dir=opts.get("--watch", WATCH_DIR),
+        port=int(opts.get("--port", PORT)),
+        backlog="--no-backlog" not in opts,
+    ).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
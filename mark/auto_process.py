@@ -10,8 +10,17 @@ import numpy as np
 from supabase import create_client
 # from infer_location import infer_location_clip
 from pathlib import Path
-from infer_location import infer_area_by_kp
+from infer_location import infer_many, list_areas, make_pool, predict_area
+from projection import (MOTOR_UID_TOL_PX, align_points_to_centerline, latlng_to_base_px, motor_uids,
+                        pixel_to_latlng_arr, reorder_box_points)
+from base_config_cache import BaseConfigCache, cache_key
+from atomic_io import atomic_write_bytes, file_lock
+from capture_ts import filename_capture_time
+from pg_errors import is_missing_column
+from collections import defaultdict
 import math
+import hashlib
+import threading
 
 
 SUPABASE_URL = "https://polqjhuklxclnvgpjckf.supabase.co"
@@ -24,61 +33,31 @@ DOWNLOAD_DIR = "downloads"
 os.makedirs(BASE_CONFIG_DIR, exist_ok=True)
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-# ----------------- 幾何函式 -----------------
-def reorder_box_points(points):
-    """把 4 點排序成順時針"""
-    pts = np.array(points, dtype=float)
-    center = np.mean(pts, axis=0)
-    angles = np.arctan2(pts[:,1]-center[1], pts[:,0]-center[0])
-    pts = pts[np.argsort(angles)]
-    return pts
-
-def align_points_to_centerline(points, box_points, padding_ratio=0.1, smooth_factor=0.3):
-    """
-    紅點沿著停車位中心線排列，帶原始距離權重的平滑分布
-    """
-    box_points = reorder_box_points(box_points)
+# 第 1 階段區域推論的行程數（infer_location 每個行程只用 1 執行緒）
+STAGE1_WORKERS = int(os.environ.get("AUTO_INFER_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# 推論前先用詞袋 top-1 粗分類（infer_location.predict_area），預測的區已由較新的上傳判定就排到最後推論
+PRECLASSIFY = os.environ.get("AUTO_PRECLASSIFY", "1") != "0"
 
-    # 計算邊長
-    edges = [(box_points[i], box_points[(i+1)%4]) for i in range(4)]
-    lengths = [np.linalg.norm(e[1]-e[0]) for e in edges]
-
-    # 找最短邊（停車位頭尾）
-    short_idx = int(np.argmin(lengths))
-    short_edge = edges[short_idx]
-    opp_edge   = edges[(short_idx+2)%4]
-
-    # 中心線
-    center_start = (short_edge[0]+short_edge[1])/2
-    center_end   = (opp_edge[0]+opp_edge[1])/2
-    dir_vec = center_end - center_start
-    dir_len = np.linalg.norm(dir_vec)
-    dir_vec /= dir_len
-
-    # 1️⃣ 原始投影距離
-    proj = [np.dot(pt-center_start, dir_vec) for pt in points]
-    sorted_idx = np.argsort(proj)
-    proj = np.array(proj)[sorted_idx]
-
-    # 2️⃣ 原始距離正規化
-    min_proj, max_proj = proj.min(), proj.max()
-    proj_range = max_proj - min_proj if max_proj>min_proj else 1.0
-    norm_proj = (proj - min_proj) / proj_range
-
-    # 3️⃣ 線性等距 + 原始距離混合
-    n = len(points)
-    linear = np.linspace(0, 1, n)
-    mixed = (1-smooth_factor)*linear + smooth_factor*norm_proj
-
-    # 4️⃣ 加 padding
-    start_pos = dir_len * padding_ratio
-    end_pos   = dir_len * (1 - padding_ratio)
-    usable_len = end_pos - start_pos
-    aligned_proj = start_pos + mixed * usable_len
-
-    # 5️⃣ 還原空間座標
-    aligned_points = [center_start + dir_vec*p for p in aligned_proj]
-    return np.array(aligned_points)
+# OCR_MODE=crops：OCR 交給 based_mark 只辨識車牌框，第 2 階段不再跑整張 OCR
+OCR_MODE = os.environ.get("OCR_MODE", "full").lower()
+
+# 單一階段（預設）：based_mark.analyze_images 解碼一次、偵測 + OCR 都在同一行程，結果不經 _ocr.json
+# 只有在 yolo_paddle（或 worker）載入不了 OCR 時才退回 ocr.py（ocr_env）→ based_mark.py 兩段；
+# AUTO_SINGLE_STAGE=0 則一律走兩段
+SINGLE_STAGE = os.environ.get("AUTO_SINGLE_STAGE", "1") == "1"
+PIPELINE_NO_OCR_EXIT = 2   # based_mark.py --pipeline 載入不了 OCR 時的結束碼
+
+# 常駐 worker：OCR + YOLO 只載入一次（需要同時裝 paddleocr 與 ultralytics 的環境）
+USE_WORKER = os.environ.get("PARKSAVVY_WORKER", "0") == "1"
+WORKER_CMD = [
+    "conda", "run", "--no-capture-output", "-n", "yolo_paddle",
+    "python", "-u", r"E:\ParkSavvy\mark\inference_worker.py", "--preload", "ocr,detect",
+]
+
+_MAIN_THREAD = threading.get_ident()
+
+# ----------------- 幾何函式 -----------------
+# reorder_box_points / align_points_to_centerline 已改為陣列版，放在 projection.py
 
 def pixel_to_latlng(x, y, cfg):
     """底圖像素轉經緯度"""
@@ -117,40 +96,184 @@ def download_image(filename):
     print(f" 已複製圖片：{filename}")
     return save_path
 
+def capture_time(row) -> datetime:
+    """拍攝時間：優先取檔名 <location>_YYYY-MM-DD-HH-MM[-SS]，否則用 created_at"""
+    ts = filename_capture_time(row.get("filename") or "")
+    if ts is not None:
+        return ts
+    try:
+        ts = datetime.fromisoformat((row.get("created_at") or "").replace("Z", "+00:00"))
+        return ts.astimezone().replace(tzinfo=None) if ts.tzinfo else ts
+    except ValueError:
+        return datetime.min
+
 def mark_as_processed(image_id):
     supabase.table("image_uploads").update({"processed": True}).eq("id", image_id).execute()
 
-def upload_motor_records(result_path, area_key, filename):
-    """清空該【區鍵(=inferred_area)】的 motor_records，插入最新偵測結果"""
-    with open(result_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    # 先清掉同區鍵的舊資料
-    supabase.table("motor_records").delete().eq("location", area_key).execute()
-    print(f"🧹 已清除 {area_key} 先前紀錄")
+def mark_many_processed(image_ids):
+    if image_ids:
+        supabase.table("image_uploads").update({"processed": True}).in_("id", list(image_ids)).execute()
+
+def bulk_update_inferred_area(assignments):
+    """assignments: {image_id: inferred_area 或 None}；同值的一次 update（請求數 = 不同區鍵數）"""
+    by_value = defaultdict(list)
+    for image_id, value in assignments.items():
+        by_value[value].append(image_id)
+    for value, ids in by_value.items():
+        supabase.table("image_uploads")\
+            .update({"inferred_area": value})\
+            .in_("id", ids)\
+            .execute()
 
+# motor_records 差異更新（需要 motor_uid 欄位）：
+#   alter table motor_records add column if not exists motor_uid text;
+#   create unique index if not exists motor_records_location_uid on motor_records (location, motor_uid);
+# 新舊紀錄依底圖座標距離（MOTOR_UID_TOL_PX 內）配對，不比 uid 字串：同一台車換張照片位置會抖動。
+# motor_uid 只在新增時決定，之後當識別碼沿用；配到的列照樣更新成最新照片的內容（image_filename 等）。
+# 表上還沒有 motor_uid 時自動退回舊的「整區刪除再插入」。
+MOTOR_SELECT_COLS = "id,motor_uid,real_x,real_y,plate_text,image_filename,motor_index"
+MOTOR_COMPARE_COLS = ("plate_text", "image_filename", "motor_index")   # 任一欄不同就更新該列
+WRITE_CHUNK = 500
+
+def _records_from_results(data, area_key, filename):
+    """結果 list → 紀錄 list（同車牌同格的多台車各自保留）"""
+    now = datetime.now().isoformat()
+    uids = motor_uids([it["plate_text"] for it in data],
+                      [(it["real_x"], it["real_y"]) for it in data])   # 舊 _result.json 沒有 uid 時用
     records = []
-    for item in data:
+    for item, fallback_uid in zip(data, uids):
         md = item.get("match_distance")
         if not isinstance(md, (int, float)) or not math.isfinite(md):
             md = None
-
         records.append({
             "image_filename": filename,
             "motor_index": item["motor_index"],
             "location": area_key,                 # ★ 用 inferred_area（如 ib_H01 / tr_A02）
+            "motor_uid": item.get("motor_uid") or fallback_uid,
             "real_x": item["real_x"],
             "real_y": item["real_y"],
             "plate_text": item["plate_text"],
             "match_distance": md,
-            "created_at": datetime.now().isoformat(),
+            "created_at": now,
         })
+    return records
 
-    if records:
-        supabase.table("motor_records").insert(records).execute()
-        print(f"已上傳 {len(records)} 筆配對資料")
+def _match_existing(existing, records, tol: float = MOTOR_UID_TOL_PX):
+    """
+    既有列 ↔ 新紀錄，距離 tol 以內才配；同車牌優先，其次由近到遠（貪婪）
+    候選邊由 KD-tree 一次找出（只有 tol 內的），不做全部兩兩比對
+    回傳 {新紀錄索引: 既有列}
+    """
+    from scipy.spatial import cKDTree
+
+    valid = [j for j, row in enumerate(existing)
+             if isinstance(row.get("real_x"), (int, float)) and isinstance(row.get("real_y"), (int, float))]
+    if not valid or not records:
+        return {}
+    E = np.array([[existing[j]["real_x"], existing[j]["real_y"]] for j in valid], dtype=np.float64)
+    R = np.array([[r["real_x"], r["real_y"]] for r in records], dtype=np.float64)
+    cand = cKDTree(R).sparse_distance_matrix(cKDTree(E), tol, output_type="ndarray")
+    if not len(cand):
+        return {}
+    ri, ej, d = cand["i"], np.asarray(valid)[cand["j"]], cand["v"]
+    diff = np.array([records[i]["plate_text"] != existing[j].get("plate_text") for i, j in zip(ri, ej)])
+    order = np.lexsort((ej, ri, d, diff))    # 與 (車牌不同, 距離, i, j) 排序相同
+    matched, used = {}, set()
+    for i, j in zip(ri[order].tolist(), ej[order].tolist()):
+        if i not in matched and j not in used:
+            matched[i] = existing[j]
+            used.add(j)
+    return matched
+
+def _chunks(rows, n=WRITE_CHUNK):
+    for i in range(0, len(rows), n):
+        yield rows[i:i + n]
+
+def _replace_motor_records(records, area_key, client=None):
+    """舊做法：整區刪除再插入；回傳寫入列數（刪 + 插）"""
+    client = client or supabase
+    old = client.table("motor_records").delete().eq("location", area_key).execute().data or []
+    print(f"🧹 已清除 {area_key} 先前紀錄")
+    rows = [{k: v for k, v in r.items() if k != "motor_uid"} for r in records]
+    if rows:
+        client.table("motor_records").insert(rows).execute()
+        print(f"已上傳 {len(rows)} 筆配對資料")
     else:
         print(" 沒有配對資料可上傳")
+    return len(old) + len(rows)
+
+def upload_motor_records(result, area_key, filename, client=None):
+    """
+    讓該【區鍵(=inferred_area)】的 motor_records 等於最新偵測結果：
+    新舊紀錄依底圖座標配對（_match_existing）：配不到的新增 / 刪除；配到的沿用 id 與 motor_uid，
+    車牌 / image_filename / motor_index 有任一不同就以最新紀錄更新（一次批次 upsert），完全相同才不寫。
+    result 可為 _result.json 路徑，或單一階段管線直接回傳的結果 list。
+    回傳 (實際寫入列數, 舊做法會寫入的列數)
+    """
+    client = client or supabase
+    if isinstance(result, (str, os.PathLike)):
+        with open(result, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        data = result
+    records = _records_from_results(data, area_key, filename)
+
+    try:
+        existing = (
+            client.table("motor_records")
+            .select(MOTOR_SELECT_COLS)
+            .eq("location", area_key)
+            .execute()
+            .data
+        ) or []
+    except Exception as e:
+        # 只有「motor_uid 欄位不存在」才走整區刪除再插入；網路 / 5xx / RLS 照樣丟出去，不清空該區
+        if not is_missing_column(e, "motor_uid"):
+            raise
+        print(f"⚠️ motor_records 無 motor_uid 欄位，改用刪除再插入：{e}")
+        n = _replace_motor_records(records, area_key, client)
+        return n, n
+
+    matched = _match_existing(existing, records)
+    kept_ids = {row["id"] for row in matched.values()}
+    deletes = [row["id"] for row in existing if row["id"] not in kept_ids]
+
+    # 留下來的列沿用原本的 uid；新增的 uid 撞到留下來的就加尾碼（唯一索引）
+    taken = {row.get("motor_uid") for row in matched.values()}
+
+    def free_uid(uid):
+        base, n = uid, 1
+        while uid in taken:
+            n += 1
+            uid = f"{base}#{n}"
+        taken.add(uid)
+        return uid
+
+    inserts, updates = [], []
+    for i, rec in enumerate(records):
+        row = matched.get(i)
+        if row is None:
+            inserts.append({**rec, "motor_uid": free_uid(rec["motor_uid"])})
+        elif not row.get("motor_uid"):        # 舊資料沒有 uid：補上
+            updates.append({**rec, "id": row["id"], "motor_uid": free_uid(rec["motor_uid"])})
+        elif any(row.get(c) != rec[c] for c in MOTOR_COMPARE_COLS):
+            updates.append({**rec, "id": row["id"], "motor_uid": row["motor_uid"]})
+
+    for ids in _chunks(deletes):
+        client.table("motor_records").delete().in_("id", ids).execute()
+    for rows in _chunks(inserts):
+        client.table("motor_records").insert(rows).execute()
+    for rows in _chunks(updates):
+        client.table("motor_records").upsert(rows, on_conflict="id").execute()
+
+    written = len(deletes) + len(inserts) + len(updates)
+    before = len(existing) + len(records)
+    if written:
+        print(f"已同步 {area_key}：新增 {len(inserts)}、更新 {len(updates)}、刪除 {len(deletes)}"
+              f"（寫入 {written} 列；舊做法 {before} 列）")
+    else:
+        print(f"⏸️ {area_key} 紀錄與目前內容相同，motor_records 不寫入（舊做法 {before} 列）")
+    return written, before
 
 def upsert_current_count(route_key: str, area_id: str, count: int, src_id: str | None = None):
     """把最新數量寫進 current_status（複合主鍵 route_key+area_id）"""
@@ -207,10 +330,23 @@ def split_inferred_area(s: str):
     return route_key, area_id, group_key
 
 # ----------------- JSON 產出 -----------------
+_BASE_CFG_CACHE = None
+
+def base_config_cache():
+    """base_configs 本機快取（同一個 supabase client，整個行程共用）"""
+    global _BASE_CFG_CACHE
+    if _BASE_CFG_CACHE is None:
+        _BASE_CFG_CACHE = BaseConfigCache(supabase)
+    return _BASE_CFG_CACHE
+
 def generate_json_for_location(inferred_area: str):
     """產生前端可用 JSON，紅點沿中心線整齊化，含經緯度"""
     # 1) 解析 inferred_area -> route_key / area_id / group_key
     route_key, area_id, default_group = split_inferred_area(inferred_area)
+    if not (route_key and area_id):
+        # 解析不出來就沒有地圖檔可寫：不能用 "_" / "_A01" 之類的鍵寫 JSON 與總清單
+        print(f"⚠️ 略過：inferred_area='{inferred_area}' 無法解析到 route_key/area_id")
+        return
 
     # 2) 最新圖片（用 inferred_area 查）
     uploads = (
@@ -226,11 +362,11 @@ def generate_json_for_location(inferred_area: str):
         return
     latest_filename = uploads.data[0]["filename"]
 
-    # 3) 讀同一張圖的 motor_records
+    # 3) 讀該區的 motor_records（差異更新後，一區的資料就是目前畫面）
     records = (
         supabase.table("motor_records")
         .select("*")
-        .eq("image_filename", latest_filename)
+        .eq("location", inferred_area)
         .execute()
         .data
     )
@@ -238,44 +374,15 @@ def generate_json_for_location(inferred_area: str):
         print(f"⚠️ {inferred_area} 沒有 motor_records")
         return
 
-    # 4) 讀取底圖設定：route_key + area_id（大小寫不敏感，含 fallback）
+    # 4) 讀取底圖設定：route_key + area_id（大小寫不敏感，含 fallback；走本機快取，只查版本欄位）
     rk = (route_key or "").strip().lower()   # DB 可能存 ib/tr（小寫）
     aid = (area_id or "").strip().upper()    # area 一律用大寫比對
+    try:
+        cfg = base_config_cache().get(aid, rk)
+    except ValueError:
+        cfg = None
 
-    # 4-1：優先雙鍵（route_key 不分大小寫）
-    res = (
-        supabase.table("base_configs")
-        .select("*")
-        .ilike("route_key", rk if rk else "%")
-        .eq("area_id", aid)
-        .limit(1)
-        .execute()
-    )
-    box_data = res.data
-
-    # 4-2：fallback：只用 area_id（相容沒填 route_key 的舊資料）
-    if not box_data:
-        res = (
-            supabase.table("base_configs")
-            .select("*")
-            .eq("area_id", aid)
-            .limit(1)
-            .execute()
-        )
-        box_data = res.data
-
-    # 4-3：fallback：有人把 area_id 存成 'ib_H01' 這種 → 模糊比對
-    if not box_data:
-        res = (
-            supabase.table("base_configs")
-            .select("*")
-            .ilike("area_id", f"%{aid}")
-            .limit(1)
-            .execute()
-        )
-        box_data = res.data
-
-    if not box_data:
+    if not cfg:
         print(f"⚠️ 找不到底圖：route_key='{rk}', area_id='{aid}'")
         try:
             cand_area = supabase.table("base_configs").select("route_key,area_id")\
@@ -288,40 +395,47 @@ def generate_json_for_location(inferred_area: str):
             pass
         return
 
-    cfg = box_data[0]
-    coords = json.loads(cfg["coords"])
+    markers = build_markers(inferred_area, records, cfg)
+
+    # 8) 輸出 JSON；內容與上次相同就不寫檔、也不更新狀態表
+    changed, digest = write_map_json(route_key, area_id, markers)
+    if not changed:
+        return
+
+    # 7) 狀態表：用 route_key + area_id 當主鍵；寫成功才記下雜湊（失敗會丟例外，下一輪重試）
+    latest_count = len(markers)
+    upsert_current_count(route_key, area_id, latest_count, src_id=latest_filename)
+    print(f"🟢 current_status 更新：({route_key}, {area_id}) = {latest_count}")
+    commit_map_outputs({f"{route_key}_{area_id}": (digest, latest_count)})
+
+def build_markers(inferred_area: str, records, cfg):
+    """motor_records + 底圖設定 → 前端 markers（第 5、6 步）"""
+    route_key, _, default_group = split_inferred_area(inferred_area)
+    coords = cfg["coords"]
     # 將藍框轉為像素座標
-    box_points = np.array([
-        [
-            (c["lng"] - cfg["lng_min"]) / (cfg["lng_max"] - cfg["lng_min"]) * cfg["img_width"],
-            (cfg["lat_max"] - c["lat"]) / (cfg["lat_max"] - cfg["lat_min"]) * cfg["img_height"],
-        ]
-        for c in coords
-    ], dtype=float)
+    box_points = latlng_to_base_px([c["lat"] for c in coords], [c["lng"] for c in coords], cfg)
     box_points = reorder_box_points(box_points)
 
-    # 5) 組 markers（只加入可算出 lat/lng 的點，確保 points 與 markers 對齊）
-    points, markers = [], []
-    for item in records:
-        x_px = item.get("real_x"); y_px = item.get("real_y")
-        if x_px is None or y_px is None:
-            continue
-        if not isinstance(x_px, (int, float)) or not isinstance(y_px, (int, float)):
-            continue
+    # 5) 只留有數值座標的紀錄；底圖尺寸為 0 時算不出經緯度 → 不輸出任何點
+    items = [it for it in records
+             if isinstance(it.get("real_x"), (int, float)) and isinstance(it.get("real_y"), (int, float))]
+    if not items or cfg["img_width"] == 0 or cfg["img_height"] == 0:
+        return []
 
-        lat, lng = pixel_to_latlng(x_px, y_px, cfg)
-        if lat is None or lng is None:
-            continue
+    # 6) 對齊到中心線 + 經緯度，整批陣列運算
+    points = np.array([[it["real_x"], it["real_y"]] for it in items], dtype=float)
+    aligned = align_points_to_centerline(points, box_points)
+    latlng = pixel_to_latlng_arr(aligned, cfg)
 
+    markers = []
+    for item, (x, y), (lat, lng) in zip(items, aligned.tolist(), latlng.tolist()):
         rect_name = item.get("rect_name") or item.get("subspot") or item.get("grid_name") or ""
         group_key = extract_group_from_rect_name(rect_name) or default_group  # 取不到就用預設(A/C...)
-
-        points.append([x_px, y_px])
         markers.append({
             "motor_index": item["motor_index"],
             "plate_text": item["plate_text"],
-            "pixel_x": int(x_px),
-            "pixel_y": int(y_px),
+            "pixel_x": int(x),
+            "pixel_y": int(y),
             "lat": lat,
             "lng": lng,
             "location": inferred_area,            # 例如 'IB_A01' 或 'ib_A01'
@@ -330,34 +444,197 @@ def generate_json_for_location(inferred_area: str):
             "spot_group": group_key,              # 同義備援
             "route_key": route_key,               # IB / TR（原樣回傳，給前端參考）
         })
+    return markers
 
-    # 6) 對齊到中心線（zip 避免越界）
-    if points:
-        aligned_pts = align_points_to_centerline(np.array(points, dtype=float), box_points)
-        for m, (x, y) in zip(markers, aligned_pts):
-            x = float(x); y = float(y)
-            lat, lng = pixel_to_latlng(x, y, cfg)
-            m["pixel_x"] = int(x); m["pixel_y"] = int(y)
-            if lat is not None and lng is not None:
-                m["lat"] = lat; m["lng"] = lng
-
-    # 7) 狀態表：用 route_key + area_id 當主鍵
-    latest_count = len(markers)
-    if route_key and area_id:
-        upsert_current_count(route_key, area_id, latest_count, src_id=latest_filename)
-        print(f"🟢 current_status 更新：({route_key}, {area_id}) = {latest_count}")
-    else:
-        print(f"⚠️ 未更新：inferred_area='{inferred_area}' 無法解析到 route_key/area_id")
-        
-    # 8) 輸出 JSON（檔名也用 route+area）
-    out_dir = Path("map_outputs")
-    out_dir.mkdir(exist_ok=True)  # 沒有資料夾就自動建立
-    out_path = out_dir / f"map_output_{route_key}_{area_id}.json"
+# map_outputs：每區一個 JSON + 同名 .sha1（內容雜湊）；內容沒變就不重寫
+# .sha1 與 manifest 要等 current_status 寫成功才更新（commit_map_outputs）：
+# DB 寫入失敗時雜湊還是舊的，下一輪會當成「有變動」重試，而不是永遠略過
+MAP_OUTPUT_DIR = Path("map_outputs")
+MAP_JSON_COMPACT = os.environ.get("MAP_JSON_COMPACT", "0") == "1"   # 1 = 不縮排
+MAP_MANIFEST = os.environ.get("MAP_MANIFEST", "1") == "1"           # map_outputs/manifest.json
+MANIFEST_NAME = "manifest.json"
+MANIFEST_LOCK_NAME = "manifest.lock"   # daemon 的多個執行緒、手動跑的 auto_process 共用
+
+def _atomic_write_text(path: Path, text: str):
+    atomic_write_bytes(path, text.encode("utf-8"))
+
+def _map_json_path(route_key: str, area_id: str) -> Path:
+    return MAP_OUTPUT_DIR / f"map_output_{route_key}_{area_id}.json"
 
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(markers, f, ensure_ascii=False, indent=2)
+def markers_digest(markers) -> str:
+    """與縮排無關的內容雜湊（key 排序、最精簡分隔）"""
+    canon = json.dumps(markers, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canon.encode("utf-8")).hexdigest()
+
+def write_map_json(route_key: str, area_id: str, markers):
+    """
+    8) 輸出 JSON（檔名也用 route+area）；回傳 (是否有寫入, 內容雜湊)
+    只寫 JSON 本身；.sha1 / manifest 由呼叫端在 DB 寫入成功後用 commit_map_outputs 更新
+    """
+    MAP_OUTPUT_DIR.mkdir(exist_ok=True)  # 沒有資料夾就自動建立
+    out_path = _map_json_path(route_key, area_id)
+    hash_path = out_path.with_name(out_path.name + ".sha1")
+
+    digest = markers_digest(markers)
+    try:
+        unchanged = out_path.exists() and hash_path.read_text(encoding="utf-8").strip() == digest
+    except OSError:
+        unchanged = False
+    if unchanged:
+        print(f"⏸️ {route_key}_{area_id}: 內容沒變，略過 {out_path}")
+        return False, digest
+
+    if MAP_JSON_COMPACT:
+        text = json.dumps(markers, ensure_ascii=False, separators=(",", ":"))
+    else:
+        text = json.dumps(markers, ensure_ascii=False, indent=2)
+    _atomic_write_text(out_path, text)
 
     print(f" {route_key}_{area_id}: 已輸出 {out_path} (含經緯度，沿中心線整齊化)")
+    return True, digest
+
+def commit_map_outputs(changes):
+    """
+    changes: {"IB_A01": (sha1, 點數)}；下游 DB 寫入成功後才呼叫：
+    寫各區的 .sha1（下一輪才會略過），再合併進 manifest.json
+    """
+    if not changes:
+        return
+    for key, (digest, _) in changes.items():
+        _atomic_write_text(MAP_OUTPUT_DIR / f"map_output_{key}.json.sha1", digest)
+    update_map_manifest(changes)
+
+def update_map_manifest(changes):
+    """
+    changes: {"IB_A01": (sha1, 點數)}；合併進 map_outputs/manifest.json
+    前端先抓這個小檔，只下載 sha1 變了的區
+    """
+    if not MAP_MANIFEST or not changes:
+        return
+    with file_lock(MAP_OUTPUT_DIR / MANIFEST_LOCK_NAME):   # 讀 → 合併 → 寫，跨行程互斥
+        _update_map_manifest(changes)
+
+def _update_map_manifest(changes):
+    path = MAP_OUTPUT_DIR / MANIFEST_NAME
+    try:
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        manifest = {"areas": {}}
+    now = datetime.now().isoformat()
+    for key, (digest, count) in changes.items():
+        manifest["areas"][key] = {
+            "file": f"map_output_{key}.json",
+            "sha1": digest,
+            "count": int(count),
+            "updated_at": now,
+        }
+    manifest["generated_at"] = now
+    MAP_OUTPUT_DIR.mkdir(exist_ok=True)
+    _atomic_write_text(path, json.dumps(manifest, ensure_ascii=False, separators=(",", ":")))
+
+# ----------------- JSON 產出（批次版） -----------------
+# generate_json_for_locations 只讀需要的欄位
+UPLOAD_COLS = "inferred_area,filename,created_at"
+MOTOR_RECORD_COLS = "location,image_filename,motor_index,plate_text,real_x,real_y"
+PAGE_SIZE = 1000            # PostgREST 預設單次最多回 1000 列
+UPLOAD_SCAN_PER_AREA = 20   # 找每區最新一張時，每區最多掃幾列
+
+def _select_pages(make_query, page: int = PAGE_SIZE):
+    """make_query() 每次回傳新的 query builder；用 range 分頁讀完"""
+    rows, start = [], 0
+    while True:
+        chunk = make_query().range(start, start + page - 1).execute().data or []
+        rows.extend(chunk)
+        if len(chunk) < page:
+            return rows
+        start += page
+
+def upsert_current_counts(rows):
+    """rows: [(route_key, area_id, count, src_id)] → 一次 upsert"""
+    now = datetime.now().isoformat()
+    payload = [{
+        "route_key": (route_key or "").lower(),
+        "area_id": area_id,
+        "scooter_count": int(count),
+        "ts": now,
+        "src_id": src_id or "",
+    } for route_key, area_id, count, src_id in rows]
+    if payload:
+        supabase.table("current_status").upsert(payload, on_conflict="route_key,area_id").execute()
+
+def generate_json_for_locations(inferred_areas):
+    """
+    generate_json_for_location 的批次版：這一輪刷新過的所有區一起處理。
+    最新上傳、motor_records、base_configs 各用 in_() 查一次（只取需要的欄位），
+    current_status 一次 upsert；DB 往返次數與區數無關。
+    """
+    areas = sorted({a.strip() for a in inferred_areas if a and a.strip()})
+    for area in [a for a in areas if not all(split_inferred_area(a)[:2])]:
+        print(f"⚠️ 略過：inferred_area='{area}' 無法解析到 route_key/area_id")
+        areas.remove(area)
+    if not areas:
+        return
+
+    # 2) 每區最新圖片
+    uploads = (
+        supabase.table("image_uploads")
+        .select(UPLOAD_COLS)
+        .in_("inferred_area", areas)
+        .order("created_at", desc=True)
+        .limit(len(areas) * UPLOAD_SCAN_PER_AREA)
+        .execute()
+        .data
+    ) or []
+    latest = {}
+    for row in uploads:                       # 已依 created_at 由新到舊
+        latest.setdefault(row["inferred_area"], row["filename"])
+    for area in areas:
+        if area not in latest:                # 掃描範圍內沒出現（極少見）→ 單區查詢
+            one = supabase.table("image_uploads").select(UPLOAD_COLS)\
+                .eq("inferred_area", area).order("created_at", desc=True).limit(1).execute().data
+            if one:
+                latest[area] = one[0]["filename"]
+            else:
+                print(f" {area} 沒有任何圖片上傳紀錄")
+
+    # 3) 這些區的 motor_records（差異更新後，一區的資料就是目前畫面）
+    records_by_area = defaultdict(list)
+    if latest:
+        for rec in _select_pages(lambda: supabase.table("motor_records")
+                                 .select(MOTOR_RECORD_COLS)
+                                 .in_("location", sorted(latest))
+                                 .order("location")
+                                 .order("motor_index")):
+            records_by_area[rec["location"]].append(rec)
+
+    # 4) 底圖設定（本機快取；一次版本查詢 + 一次抓變動的）
+    parsed = {area: split_inferred_area(area) for area in latest}
+    cfgs = base_config_cache().get_many([(aid, rk) for rk, aid, _ in parsed.values()])
+
+    status_rows, manifest_changes, unchanged = [], {}, 0
+    for area, filename in latest.items():
+        route_key, area_id, _ = parsed[area]
+        records = records_by_area.get(area)
+        if not records:
+            print(f"⚠️ {area} 沒有 motor_records")
+            continue
+        cfg = cfgs.get(cache_key(route_key, area_id))
+        if not cfg:
+            print(f"⚠️ 找不到底圖：route_key='{route_key.lower()}', area_id='{area_id}'")
+            continue
+
+        markers = build_markers(area, records, cfg)
+        changed, digest = write_map_json(route_key, area_id, markers)
+        if not changed:
+            unchanged += 1                    # 內容沒變：不寫檔、不更新狀態表
+            continue
+        manifest_changes[f"{route_key}_{area_id}"] = (digest, len(markers))
+        status_rows.append((route_key, area_id, len(markers), filename))
+
+    # 7) 狀態表一次 upsert（只含有變動的區）；成功後才寫 .sha1 + 總清單
+    upsert_current_counts(status_rows)
+    commit_map_outputs(manifest_changes)
+    print(f"🟢 current_status 更新 {len(status_rows)} 區（內容沒變略過 {unchanged} 區）")
 
 def resolve_base_config_dir(inferred_area_value: str) -> str:
     """
@@ -373,115 +650,312 @@ def resolve_base_config_dir(inferred_area_value: str) -> str:
     p2 = f"base_config_{area_id}"
     return p1 if os.path.isdir(p1) else p2
 
-if __name__ == "__main__":
-    images = get_unprocessed_images_raw()
-    if not images:
-        print(" 沒有新的圖片要處理")
-    else:
-        # ========= 第 1 階段：為所有未處理影像推論 inferred_area =========
-        prepared = []  # 暫存：每張圖的基本資訊 + 推論結果
-        for img in images:
-            filename = img["filename"]
-            image_id = img["id"]
-            location = (img.get("location") or "").strip()  # 路段：ib / tr
-
-            # 下載影像（若已存在會覆蓋/複寫，OK）
-            downloaded_path = download_image(filename)
-            if downloaded_path is None:
-                mark_as_processed(image_id)
-                continue
+def _run_suffix() -> str:
+    """同一行程內多個 process_images 同時跑（daemon）時，中繼檔名不要撞在一起"""
+    ident = threading.get_ident()
+    return "" if ident == _MAIN_THREAD else f"_{os.getpid()}_{ident}"
 
-            # 只在該「location 的底圖庫」中推論純區代號（A01/B01/...）
-            area_id = infer_area_by_kp(downloaded_path, str(BASE_IMAGES_ROOT), location)
-            print(f"\n處理圖片: {filename} @ {location}")
-            print(f"📍 推論到的區域代號(area_id): {area_id}")
-
-            inferred_area_value = f"{location}_{area_id}" if area_id else None
+def _predict_area(path: str, root: str, loc: str):
+    """粗分類失敗或不夠確定都回 None：照常完整推論"""
+    if not PRECLASSIFY:
+        return None
+    try:
+        return predict_area(path, root, loc)
+    except Exception as e:
+        print(f"⚠️ 粗分類失敗，照常推論：{e}")
+        return None
 
-            # 寫回 DB：image_uploads.inferred_area
-            supabase.table("image_uploads")\
-                .update({"inferred_area": inferred_area_value})\
-                .eq("id", image_id)\
-                .execute()
+def run_single_stage(items, worker=None):
+    """
+    based_mark.analyze_images（worker 或 yolo_paddle 行程）；回傳 {img_path: 結果}。
+    OCR 在這個環境載入不了回 None：呼叫端要退回兩段流程，不能把圖標成已處理。
+    其他失敗回 {}，與兩段流程裡 based_mark 失敗一樣，這批的圖當作沒有結果
+    """
+    if worker is not None:
+        try:
+            return worker.call("pipeline", items=items) or {}
+        except TimeoutError:
+            raise   # worker 卡住已被 kill：整批失敗，交給 daemon 重試
+        except Exception as e:
+            print(f"❌ 偵測 + OCR 失敗：{e}")
+            # worker 的錯誤訊息是 "型別: 訊息"；ModuleNotFoundError 也是 ImportError
+            return None if str(e).startswith(("ImportError", "ModuleNotFoundError")) else {}
+    jobs_path = os.path.abspath(os.path.join(DOWNLOAD_DIR, f"_pipeline_jobs{_run_suffix()}.json"))
+    out_path = os.path.abspath(os.path.join(DOWNLOAD_DIR, f"_pipeline_results{_run_suffix()}.json"))
+    with open(jobs_path, "w", encoding="utf-8") as f:
+        json.dump(items, f, ensure_ascii=False)
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    proc = subprocess.run([
+        "conda", "run", "-n", "yolo_paddle", "python", r"E:\ParkSavvy\mark\based_mark.py",
+        "--pipeline", jobs_path, out_path
+    ], check=False)
+    if proc.returncode == PIPELINE_NO_OCR_EXIT:
+        return None
+    if not os.path.exists(out_path):
+        print(f"❌ 偵測 + OCR 沒有寫出結果檔（結束碼 {proc.returncode}）")
+        return {}
+    with open(out_path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-            if not area_id:
-                print("❌ 無法推論區域（area_id 為空），先標記 processed 跳過此圖")
-                mark_as_processed(image_id)
+def process_images(images, pool=None, worker=None):
+    """
+    未處理影像 → 區域推論 → 偵測 + OCR → motor_records → 地圖 JSON
+    pool / worker 可由呼叫端提供（daemon 常駐共用）；沒給就這一輪自己建、自己關。
+    回傳這一輪刷新過的 inferred_area list
+    """
+    # ========= 第 1 階段：為未處理影像推論 inferred_area（由新到舊，跳過已被取代的） =========
+    # 每個 location 依拍攝時間由新到舊；某區已經被較新的圖判定過，舊圖就算推論出來也會在第 2 階段被丟掉：
+    #   - 先用詞袋 top-1 粗分類；預測的區已判定過 → 排到該 location 最後才推論
+    #     （粗分類可能猜錯，只拿來排順序；要完整推論確認區域後才算被取代）
+    #   - 預測的區和這一批裡較新的圖相同 → 延到下一批
+    #   - 該 location 所有區都判定完就不再推論（延後的圖多半在這一步直接略過）
+    root = str(BASE_IMAGES_ROOT)
+    pending = defaultdict(list)
+    for img in images:
+        pending[(img.get("location") or "").strip()].append(img)   # 路段：ib / tr
+    for loc in pending:
+        pending[loc].sort(key=capture_time, reverse=True)
+    loc_areas = {loc: set(list_areas(root, loc)) for loc in pending}
+    resolved = {loc: {} for loc in pending}   # location -> {area_id: 判定它的檔名}
+
+    prepared = []      # 暫存：每張圖的基本資訊 + 推論結果
+    assignments = {}   # image_id -> inferred_area（整批寫回）
+    done_ids = []      # 直接標 processed 的 image_id
+    superseded = {}    # image_id -> 原因
+    predicted = {}     # image_id -> (下載路徑, 粗分類預測的區)；延到下一批時不重下載、不重算
+    deferred = defaultdict(list)   # location -> 預測區已判定過、排到最後的圖（由新到舊）
+    released = set()   # 已從 deferred 放回的 image_id：不再依粗分類延後
+
+    own_pool = pool is None and STAGE1_WORKERS > 1
+    if own_pool:
+        pool = make_pool([(root, loc) for loc in pending], STAGE1_WORKERS)
+    try:
+        while any(pending.values()) or any(deferred.values()):
+            for loc in list(deferred):
+                if not pending[loc]:       # 其他圖都推論完了才輪到延後的圖
+                    imgs = deferred.pop(loc)
+                    released.update(img["id"] for img in imgs)
+                    pending[loc] = imgs
+            # 1-a 組一批：輪流從每個 location 取最新的一張，湊滿 worker 數
+            wave, by_id = [], {}
+            inflight, held = defaultdict(set), defaultdict(list)   # 這一批已佔用的預測區 / 延後的圖
+            while len(wave) < STAGE1_WORKERS and any(pending.values()):
+                for loc in list(pending):
+                    if not pending[loc]:
+                        continue
+                    if loc_areas[loc] and loc_areas[loc] <= set(resolved[loc]):
+                        for old in pending[loc] + deferred.pop(loc, []):
+                            superseded[old["id"]] = f"{loc} 所有區都已由較新的上傳判定"
+                        pending[loc] = []
+                        continue
+                    img = pending[loc].pop(0)
+                    if img["id"] in predicted:
+                        downloaded_path, guess = predicted[img["id"]]
+                    else:
+                        # 下載影像（若已存在會覆蓋/複寫，OK）
+                        downloaded_path = download_image(img["filename"])
+                        if downloaded_path is None:
+                            done_ids.append(img["id"])
+                            continue
+                        guess = _predict_area(downloaded_path, root, loc)
+                        predicted[img["id"]] = (downloaded_path, guess)
+                    if guess in resolved[loc] and img["id"] not in released:
+                        deferred[loc].append(img)
+                        continue
+                    if guess in inflight[loc]:
+                        held[loc].append(img)
+                        continue
+                    if guess:
+                        inflight[loc].add(guess)
+                    # 只在該「location 的底圖庫」中推論純區代號（A01/B01/...）
+                    wave.append((img["id"], downloaded_path, root, loc))
+                    by_id[img["id"]] = img
+                    if len(wave) >= STAGE1_WORKERS:
+                        break
+            for loc, imgs in held.items():
+                pending[loc][:0] = imgs   # 放回最前面，仍由新到舊
+            if not wave:
                 continue
 
-            prepared.append({
-                "id": image_id,
-                "filename": filename,
-                "created_at": img.get("created_at", ""),
-                "inferred_area": inferred_area_value,   # 例如 ib_H01
-            })
-
-        if not prepared:
-            print(" 沒有完成區域判定的圖片可處理")
-            print("\n✅ 所有地區處理完成！")
-            sys.exit(0)
-
-        # ========= 第 2 階段：依 inferred_area 只挑最新一張做後續處理 =========
-        latest_by_area = {}
-        for row in prepared:
-            area = (row.get("inferred_area") or "").strip()
-            if not area:
-                continue
-            ts = row.get("created_at", "")
-            if area not in latest_by_area or ts > latest_by_area[area].get("created_at", ""):
-                latest_by_area[area] = row
-
-        targets = list(latest_by_area.values())
-        for tgt in targets:
-            image_id = tgt["id"]
-            filename = tgt["filename"]
-            inferred_area_value = tgt["inferred_area"]  # ← 區鍵：ib_H01 / tr_A02
-            print(f"\n▶︎ 開始處理（每區最新）: {filename} @ {inferred_area_value}")
-
-            # 檔案一定在 downloads/（上面第一階段已下載過），這邊再拿一次路徑比較直覺
-            downloaded_path = os.path.join(DOWNLOAD_DIR, filename)
-
-            # --- OCR ---
-            ocr_json_path = os.path.abspath(os.path.join(DOWNLOAD_DIR, f"{filename}_ocr.json"))
+            # 1-b 平行推論
+            areas = infer_many(wave, STAGE1_WORKERS, executor=pool)
+
+            # 1-c 依原順序（由新到舊）收結果
+            for image_id, _, _, loc in wave:
+                img = by_id[image_id]
+                area_id = areas.get(image_id)
+                print(f"\n處理圖片: {img['filename']} @ {loc}")
+                print(f"📍 推論到的區域代號(area_id): {area_id}")
+
+                inferred_area_value = f"{loc}_{area_id}" if area_id else None
+                assignments[image_id] = inferred_area_value
+
+                if not area_id:
+                    print("❌ 無法推論區域（area_id 為空），先標記 processed 跳過此圖")
+                    done_ids.append(image_id)
+                    continue
+                if area_id in resolved[loc]:
+                    superseded[image_id] = f"{inferred_area_value} 已由較新的 {resolved[loc][area_id]} 判定"
+                    continue
+                resolved[loc][area_id] = img["filename"]
+
+                prepared.append({
+                    "id": image_id,
+                    "filename": img["filename"],
+                    "created_at": img.get("created_at", ""),
+                    "inferred_area": inferred_area_value,   # 例如 ib_H01
+                })
+    finally:
+        if own_pool:
+            pool.shutdown()
+
+    for image_id, reason in superseded.items():
+        print(f"⏭️ 略過 image_id={image_id}：{reason}")
+    print(f"🔎 區域推論 {len(assignments)} 張，略過（已被取代）{len(superseded)} 張")
+
+    bulk_update_inferred_area(assignments)
+    mark_many_processed(done_ids + list(superseded))
+
+    if not prepared:
+        print(" 沒有完成區域判定的圖片可處理")
+        return []
+
+    # ========= 第 2 階段：依 inferred_area 只挑最新一張做後續處理 =========
+    latest_by_area = {}
+    for row in prepared:
+        area = (row.get("inferred_area") or "").strip()
+        if not area:
+            continue
+        ts = row.get("created_at", "")
+        if area not in latest_by_area or ts > latest_by_area[area].get("created_at", ""):
+            latest_by_area[area] = row
+
+    targets = list(latest_by_area.values())
+    own_worker = worker is None and USE_WORKER
+    if own_worker:
+        from inference_worker import WorkerClient
+        try:
+            worker = WorkerClient(WORKER_CMD)
+            print(f"🔌 inference worker 就緒（{worker.spawn_ms:.0f} ms）")
+        except Exception as e:
+            print(f"⚠️ inference worker 啟動失敗，改用 conda run：{e}")
+            worker, own_worker = None, False
+
+    for tgt in targets:
+        # 檔案一定在 downloads/（上面第一階段已下載過），這邊再拿一次路徑比較直覺
+        tgt["path"] = os.path.join(DOWNLOAD_DIR, tgt["filename"])
+        tgt["ocr_json"] = os.path.abspath(os.path.join(DOWNLOAD_DIR, f"{tgt['filename']}_ocr.json"))
+        # 跑之前刪舊 result，避免誤用
+        try:
+            if os.path.exists(tgt["path"] + "_result.json"):
+                os.remove(tgt["path"] + "_result.json")
+        except Exception:
+            pass
+
+    batch_items = [
+        [tgt["path"], resolve_base_config_dir(tgt["inferred_area"]), tgt["ocr_json"]]
+        for tgt in targets
+    ]
+
+    # --- 單一階段：偵測 + OCR 一起跑；只有 OCR 載入失敗時退回兩段流程 ---
+    results_by_path = None
+    if SINGLE_STAGE:
+        results_by_path = run_single_stage([item[:2] for item in batch_items], worker)
+        if results_by_path is None:
+            print("⚠️ 這個環境載入不了 OCR，改用 OCR → based_mark 兩段流程")
+    single = results_by_path is not None
+
+    # --- OCR（每區最新一張） ---
+    for tgt in targets:
+        print(f"\n▶︎ 開始處理（每區最新）: {tgt['filename']} @ {tgt['inferred_area']}")
+        if single or OCR_MODE == "crops":
+            pass
+        elif worker is not None:
+            try:
+                worker.call("ocr", image_path=tgt["path"], save_path=tgt["ocr_json"])
+            except TimeoutError:
+                raise   # worker 卡住已被 kill：整批失敗，交給 daemon 重試
+            except Exception as e:
+                print(f"❌ OCR 失敗：{e}")
+        else:
             subprocess.run([
                 "conda", "run", "-n", "ocr_env", "python", r"E:\ParkSavvy\mark\ocr.py",
-                downloaded_path, ocr_json_path
+                tgt["path"], tgt["ocr_json"]
             ], check=False)
 
-            # --- YOLO + Homography ---
-            base_config_dir = resolve_base_config_dir(inferred_area_value)
+    # --- YOLO + Homography：所有區一次批次偵測（每個模型只載入/前向一輪） ---
+    if single:
+        pass
+    elif worker is not None:
+        try:
+            worker.call("detect_batch", items=batch_items)
+        except TimeoutError:
+            raise   # worker 卡住已被 kill：整批失敗，交給 daemon 重試
+        except Exception as e:
+            print(f"❌ based_mark 失敗：{e}")
+    else:
+        jobs_path = os.path.abspath(os.path.join(DOWNLOAD_DIR, f"_detect_jobs{_run_suffix()}.json"))
+        with open(jobs_path, "w", encoding="utf-8") as f:
+            json.dump(batch_items, f, ensure_ascii=False)
+        subprocess.run([
+            "conda", "run", "-n", "yolo_paddle", "python", r"E:\ParkSavvy\mark\based_mark.py",
+            "--batch", jobs_path
+        ], check=False)
+
+    refreshed_areas = []
+    rows_written = rows_before = 0
+    for tgt in targets:
+        image_id = tgt["id"]
+        filename = tgt["filename"]
+        inferred_area_value = tgt["inferred_area"]  # ← 區鍵：ib_H01 / tr_A02
+        result_json_path = tgt["path"] + "_result.json"
+
+        # --- 上傳 motor_records（location= inferred_area） ---
+        if single:
+            results = results_by_path.get(tgt["path"])
+        else:
+            results = result_json_path if os.path.exists(result_json_path) else None
+        if results is not None:
+            written, before = upload_motor_records(results, inferred_area_value, filename)
+            rows_written += written
+            rows_before += before
+        else:
+            print(f"❌ based_mark 未產生 {filename} 的結果，跳過此圖")
+            mark_as_processed(image_id)
+            continue
+
+        # 地圖 JSON 等整輪上傳完後一次批次產出（見迴圈後）
+        refreshed_areas.append(inferred_area_value)
 
-            # 跑之前刪舊 result，避免誤用
-            result_json_path = downloaded_path + "_result.json"
-            try:
-                if os.path.exists(result_json_path):
-                    os.remove(result_json_path)
-            except Exception:
-                pass
+        # --- 標記 processed ---
+        mark_as_processed(image_id)
+        # 同一區的其他舊圖也一併標 processed（避免重複處理）
+        supabase.table("image_uploads")\
+            .update({"processed": True})\
+            .eq("inferred_area", inferred_area_value)\
+            .neq("id", image_id)\
+            .execute()
 
-            subprocess.run([
-                "conda", "run", "-n", "yolo_paddle", "python", r"E:\ParkSavvy\mark\based_mark.py",
-                downloaded_path, base_config_dir, ocr_json_path
-            ], check=False)
+    print(f"📝 motor_records 本輪寫入 {rows_written} 列（刪除再插入會是 {rows_before} 列）")
 
-            # --- 上傳 motor_records（location= inferred_area） ---
-            if os.path.exists(result_json_path):
-                upload_motor_records(result_json_path, inferred_area_value, filename)
-            else:
-                print("❌ based_mark 執行失敗，未產生 result.json，跳過此圖")
-                mark_as_processed(image_id)
-                continue
+    # --- 產地圖 JSON（這一輪刷新過的所有區一起） ---
+    generate_json_for_locations(refreshed_areas)
 
-            # --- 產地圖 JSON（用 inferred_area） ---
-            generate_json_for_location(inferred_area_value)
+    if own_worker:
+        worker.close()
+    return refreshed_areas
 
-            # --- 標記 processed ---
-            mark_as_processed(image_id)
-            # 同一區的其他舊圖也一併標 processed（避免重複處理）
-            supabase.table("image_uploads")\
-                .update({"processed": True})\
-                .eq("inferred_area", inferred_area_value)\
-                .neq("id", image_id)\
-                .execute()
-
-    print("\n✅ 所有地區處理完成！")
\ No newline at end of file
+if __name__ == "__main__":
+    # python auto_process.py --daemon [--watch <uploads_dir>] [--port 8765]  （見 auto_daemon.py）
+    if len(sys.argv) >= 2 and sys.argv[1] == "--daemon":
+        from auto_daemon import main as daemon_main
+        sys.exit(daemon_main(sys.argv[2:]))
+
+    images = get_unprocessed_images_raw()
+    if not images:
+        print(" 沒有新的圖片要處理")
+    else:
+        process_images(images)
+
+    print("\n✅ 所有地區處理完成！")
@@ -0,0 +1,287 @@
+# base_config_cache.py
+"""
+base_configs 的本機快取（已解碼）：
+
+  {cache_dir}/{route}_{AREA}/
+    H.npy       已正規化（H[2,2] = 1）的 Homography
+    meta.json   id / route_key / area_id / img_width / img_height / coords / lat_min... / version
+
+熱路徑每次只查一個很小的版本查詢（id, route_key, area_id, updated_at），
+版本沒變就直接讀本機；只有版本變了才抓 h_base_b64 等欄位，而且從不抓 base_image_b64
+（除非資料列沒有 img_width/img_height）。
+offline=True（或 BASE_CFG_OFFLINE=1）完全不連 DB，只用快取。
+
+client 可注入：任何有 table().select().eq()/in_()/ilike()/limit().execute() 的物件
+（tests/test_base_config_cache.py 用本機替身驗證）。
+"""
+import os
+import io
+import json
+import time
+import base64
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from atomic_io import tmp_path
+
+CACHE_DIR = Path(os.environ.get("BASE_CFG_CACHE_DIR",
+                                str(Path(__file__).resolve().parent / "base_config_cache")))
+OFFLINE = os.environ.get("BASE_CFG_OFFLINE", "0") == "1"
+VERSION_COL = os.environ.get("BASE_CFG_VERSION_COL", "updated_at")
+# 同一個 key 在這段時間內不重複查版本（一批影像常常是同一區）
+RECHECK_SEC = float(os.environ.get("BASE_CFG_RECHECK_SEC", "30"))
+# 表上沒有版本欄位時，快取最多沿用多久
+MAX_AGE_SEC = float(os.environ.get("BASE_CFG_MAX_AGE_SEC", "3600"))
+
+LIGHT_COLS = ["id", "route_key", "area_id"]
+DATA_COLS = ["id", "route_key", "area_id", "h_base_b64", "img_width", "img_height",
+             "coords", "lat_min", "lat_max", "lng_min", "lng_max"]
+
+
+def cache_key(route_key: Optional[str], area_id: str):
+    return ((route_key or "").strip().lower(), (area_id or "").strip().upper())
+
+
+def _decode_h(b64_str: str) -> np.ndarray:
+    H = np.load(io.BytesIO(base64.b64decode(b64_str))).astype(float)
+    if H[2, 2] == 0:
+        raise ValueError("H[2,2] = 0，Homography 無效")
+    return H / H[2, 2]
+
+
+def _matches(row: Optional[dict], rk: str, aid: str) -> bool:
+    """row 的 (route_key, area_id) 與 key 完全相同；rk 為空時只比 area_id"""
+    if not row or (row.get("area_id") or "").strip().upper() != aid:
+        return False
+    return not rk or (row.get("route_key") or "").strip().lower() == rk
+
+
+def _pick_row(rows: List[dict], rk: str, aid: str, exact: bool = False) -> Optional[dict]:
+    """
+    exact=False：與 generate_json_for_location 相同的優先順序：雙鍵 → 只用 area_id → area_id 尾碼模糊比對
+    exact=True ：只接受雙鍵完全相同（Homography 用錯區就是整批座標錯，寧可報錯）
+    """
+    for r in rows:
+        if _matches(r, rk, aid):
+            return r
+    if exact:
+        return None
+    same_aid = [r for r in rows if (r.get("area_id") or "").strip().upper() == aid]
+    if same_aid:
+        return same_aid[0]
+    return rows[0] if rows else None
+
+
+class BaseConfigCache:
+    def __init__(self, client=None, cache_dir: Path = CACHE_DIR, offline: bool = OFFLINE,
+                 version_col: Optional[str] = VERSION_COL):
+        self.client = client
+        self.dir = Path(cache_dir)
+        self.offline = offline or client is None
+        self.version_col = version_col or None
+        self._memo: Dict[tuple, dict] = {}      # key -> cfg
+        self._checked: Dict[tuple, float] = {}  # key -> 最後一次確認版本的時間
+        self.stats = {"version_queries": 0, "full_fetches": 0, "disk_hits": 0}
+
+    # ---------- 本機 ----------
+    def _path(self, key) -> Path:
+        rk, aid = key
+        return self.dir / f"{rk or '_'}_{aid}"
+
+    def _read_disk(self, key) -> Optional[dict]:
+        d = self._path(key)
+        try:
+            meta = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+            meta["H"] = np.load(d / "H.npy")
+            meta["_cached_at"] = (d / "meta.json").stat().st_mtime
+            return meta
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, cfg: dict):
+        d = self._path(key)
+        d.mkdir(parents=True, exist_ok=True)
+        for name, writer in (("H.npy", lambda f: np.save(f, cfg["H"])),
+                             ("meta.json", lambda f: f.write(json.dumps(
+                                 {k: v for k, v in cfg.items() if k not in ("H", "_cached_at")},
+                                 ensure_ascii=False).encode("utf-8")))):
+            tmp = tmp_path(d / name)   # 多個行程共用同一份快取，暫存檔名不能撞
+            with open(tmp, "wb") as f:
+                writer(f)
+            os.replace(tmp, d / name)
+
+    # ---------- DB ----------
+    def _query_rows(self, aid: str, cols: List[str]) -> List[dict]:
+        return (self.client.table("base_configs").select(",".join(cols))
+                .ilike("area_id", f"%{aid}").execute().data or [])
+
+    def _light_query(self, run):
+        """run(cols) 做版本查詢；表上沒有版本欄位就退回只查 id/route_key/area_id"""
+        self.stats["version_queries"] += 1
+        cols = LIGHT_COLS + ([self.version_col] if self.version_col else [])
+        try:
+            return run(cols)
+        except Exception as e:
+            if not self.version_col:
+                raise
+            print(f"[base_cfg] 無法讀版本欄位 {self.version_col}（{e}），改用快取時效 {MAX_AGE_SEC:.0f}s")
+            self.version_col = None
+            return run(LIGHT_COLS)
+
+    def _version_row(self, key, exact: bool = False) -> Optional[dict]:
+        rk, aid = key
+        return _pick_row(self._light_query(lambda cols: self._query_rows(aid, cols)), rk, aid, exact)
+
+    def _is_stale(self, cfg: Optional[dict], row: dict, now: float) -> bool:
+        if cfg is None or cfg.get("id") != row["id"]:
+            return True
+        if self.version_col:
+            return cfg.get("version") != row.get(self.version_col)
+        return now - cfg.get("_cached_at", 0) > MAX_AGE_SEC
+
+    def _fetch(self, key, row: dict) -> dict:
+        self.stats["full_fetches"] += 1
+        cols = DATA_COLS + ([self.version_col] if self.version_col else [])
+        res = self.client.table("base_configs").select(",".join(cols)).eq("id", row["id"]).limit(1).execute()
+        if not res.data:
+            raise ValueError(f"找不到 base_config：id={row['id']}")
+        return self._cfg_from_raw(key, res.data[0])
+
+    def _cfg_from_raw(self, key, raw: dict) -> dict:
+        if not raw.get("h_base_b64"):
+            raise ValueError(f"{raw.get('area_id')} 沒有 h_base_b64")
+
+        W, H_img = raw.get("img_width"), raw.get("img_height")
+        if not W or not H_img:
+            # 舊資料沒填尺寸：只有這時才抓底圖，解一次就記下來
+            import cv2
+            b64 = (self.client.table("base_configs").select("base_image_b64")
+                   .eq("id", raw["id"]).limit(1).execute().data or [{}])[0].get("base_image_b64")
+            if not b64:
+                raise ValueError(f"{raw.get('area_id')} 沒有 img_width/img_height，且無法讀底圖")
+            img = cv2.imdecode(np.frombuffer(base64.b64decode(b64), dtype=np.uint8), cv2.IMREAD_COLOR)
+            H_img, W = img.shape[:2]
+
+        coords = raw.get("coords")
+        if isinstance(coords, str):
+            coords = json.loads(coords)
+        cfg = {
+            "id": raw["id"], "route_key": raw.get("route_key"), "area_id": raw.get("area_id"),
+            "img_width": int(W), "img_height": int(H_img), "coords": coords,
+            "lat_min": raw.get("lat_min"), "lat_max": raw.get("lat_max"),
+            "lng_min": raw.get("lng_min"), "lng_max": raw.get("lng_max"),
+            "version": raw.get(self.version_col) if self.version_col else None,
+            "H": _decode_h(raw["h_base_b64"]),
+        }
+        self._write_disk(key, cfg)
+        cfg["_cached_at"] = time.time()
+        return cfg
+
+    # ---------- 對外 ----------
+    def get(self, area_id: str, route_key: Optional[str] = None, exact: bool = False) -> dict:
+        """
+        回傳 dict：H / img_width / img_height / coords / lat_min... / version
+        exact=True：(route_key, area_id) 必須完全相同，模糊比對到的舊快取也不算數，找不到就 ValueError
+        """
+        key = cache_key(route_key, area_id)
+        now = time.time()
+        cfg = self._memo.get(key)
+        if exact and not _matches(cfg, *key):
+            cfg = None
+        if cfg is not None and (self.offline or now - self._checked.get(key, 0) < RECHECK_SEC):
+            return cfg
+
+        if cfg is None:
+            cfg = self._read_disk(key)
+            if exact and not _matches(cfg, *key):
+                cfg = None
+            if cfg is not None:
+                self.stats["disk_hits"] += 1
+
+        if self.offline:
+            if cfg is None:
+                raise ValueError(f"離線模式且無快取：route_key={key[0] or '(none)'}, area_id={key[1]}")
+        else:
+            try:
+                row = self._version_row(key, exact)
+            except Exception as e:
+                if cfg is None:
+                    raise
+                print(f"[base_cfg] 版本查詢失敗，沿用快取：{e}")
+                row = None
+            else:
+                if row is None:
+                    raise ValueError(f"找不到 base_config：area_id={area_id}, route_key={route_key or '(none)'}")
+                if self._is_stale(cfg, row, now):
+                    cfg = self._fetch(key, row)
+
+        self._memo[key] = cfg
+        self._checked[key] = now
+        return cfg
+
+    def get_many(self, pairs) -> Dict[tuple, dict]:
+        """
+        pairs: [(area_id, route_key), ...] → {cache_key: cfg}（找不到的不會出現在結果裡）
+        一次 in_ 版本查詢 + 一次 in_ 抓變動的資料列；in_ 對不到的（例如 area_id 存成 ib_H01）才逐一走 get()
+        """
+        now = time.time()
+        out, todo = {}, []
+        for area_id, route_key in pairs:
+            key = cache_key(route_key, area_id)
+            cfg = self._memo.get(key)
+            if cfg is not None and (self.offline or now - self._checked.get(key, 0) < RECHECK_SEC):
+                out[key] = cfg
+            elif key not in todo:
+                todo.append(key)
+
+        if todo and not self.offline:
+            aids = sorted({aid for _, aid in todo})
+            try:
+                rows = self._light_query(lambda cols: self.client.table("base_configs")
+                                         .select(",".join(cols)).in_("area_id", aids).execute().data or [])
+            except Exception as e:
+                print(f"[base_cfg] 批次版本查詢失敗，改逐一查詢：{e}")
+                rows = []
+            by_aid: Dict[str, List[dict]] = {}
+            for r in rows:
+                by_aid.setdefault((r.get("area_id") or "").strip().upper(), []).append(r)
+
+            stale: Dict[object, tuple] = {}
+            for key in list(todo):
+                row = _pick_row(by_aid.get(key[1], []), *key)
+                if row is None:
+                    continue
+                cfg = self._memo.get(key) or self._read_disk(key)
+                if self._is_stale(cfg, row, now):
+                    stale[row["id"]] = key
+                else:
+                    out[key] = self._memo[key] = cfg
+                    self._checked[key] = now
+                todo.remove(key)
+
+            if stale:
+                self.stats["full_fetches"] += len(stale)
+                cols = DATA_COLS + ([self.version_col] if self.version_col else [])
+                raws = (self.client.table("base_configs").select(",".join(cols))
+                        .in_("id", list(stale)).execute().data or [])
+                for raw in raws:
+                    key = stale[raw["id"]]
+                    try:
+                        out[key] = self._memo[key] = self._cfg_from_raw(key, raw)
+                        self._checked[key] = now
+                    except ValueError as e:
+                        print(f"[base_cfg] {key}: {e}")
+
+        for key in todo:   # 離線模式，或 in_ 對不到 → 單筆（含模糊比對）
+            try:
+                out[key] = self.get(key[1], key[0])
+            except Exception as e:
+                print(f"[base_cfg] {key}: {e}")
+        return out
+
+    def get_homography(self, area_id: str, route_key: Optional[str] = None):
+        """based_mark 用：(H, W, H_img)"""
+        cfg = self.get(area_id, route_key, exact=True)
+        return cfg["H"], cfg["img_width"], cfg["img_height"]
@@ -4,6 +4,7 @@ from scipy.optimize import linear_sum_assignment
 import io
 from ultralytics import YOLO
 from supabase import create_client
+from projection import image_to_base_px, motor_uids
 
 # Supabase 連線
 SUPABASE_URL = "https://polqjhuklxclnvgpjckf.supabase.co"
@@ -12,16 +13,87 @@ supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 USE_RANGE_MINUS1_TO_1 = True
 
+# OCR 來源：full = 讀 ocr.py 對整張圖的結果（_ocr.json）；crops = 只對配對到的車牌框做辨識
+OCR_MODE = os.environ.get("OCR_MODE", "full").lower()
+# 單一階段管線（analyze_images）是否仍寫出 _ocr.json / _result.json（除錯用）
+DEBUG_JSON = os.environ.get("PIPELINE_DEBUG_JSON", "0") == "1"
+_OCR_MODULE = None
+
+def _ocr_module():
+    """PaddleOCR 在 import ocr 時建立，每個行程只建一次"""
+    global _OCR_MODULE
+    if _OCR_MODULE is None:
+        import ocr as _ocr
+        _OCR_MODULE = _ocr
+    return _OCR_MODULE
+
+def _ocr_on_plates(img, plate_boxes, ocr_json_path: str):
+    """車牌框 OCR，結果也寫到 ocr_json_path 方便除錯（None 就不寫）"""
+    data = _ocr_module().ocr_plate_crops(img, plate_boxes)
+    if ocr_json_path:
+        with open(ocr_json_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    return data
+
+MOTOR_WEIGHTS = "yolov8m.pt"
+PLATE_WEIGHTS = r"C:\Users\CGM\Desktop\best_weight\plate.pt"
+
+# 推論後端：torch（原本的 .pt）/ onnx（onnxruntime CPU）/ openvino
+YOLO_BACKEND = os.environ.get("YOLO_BACKEND", "torch").lower()
+_WEIGHTS = {"motor": MOTOR_WEIGHTS, "plate": PLATE_WEIGHTS}
+_EXPORT_FORMATS = {"onnx": "onnx", "openvino": "openvino"}
+
+# (name, backend) -> YOLO；同一行程每個偵測器只載入一次
+_MODEL_REGISTRY = {}
+
+def _exported_path(weights: str, backend: str) -> str:
+    """已匯出的模型路徑（yolov8m.onnx / yolov8m_openvino_model/），沒有就匯出一次"""
+    stem = os.path.splitext(weights)[0]
+    path = stem + ".onnx" if backend == "onnx" else stem + "_openvino_model"
+    if not os.path.exists(path):
+        print(f"🔧 匯出 {weights} → {backend}（只需一次）")
+        path = YOLO(weights).export(format=_EXPORT_FORMATS[backend], dynamic=True)
+    return str(path)
+
+def get_model(name: str, backend: str | None = None):
+    backend = (backend or YOLO_BACKEND).lower()
+    key = (name, backend)
+    if key not in _MODEL_REGISTRY:
+        weights = _WEIGHTS[name]
+        if backend == "torch":
+            _MODEL_REGISTRY[key] = YOLO(weights)
+        elif backend in _EXPORT_FORMATS:
+            _MODEL_REGISTRY[key] = YOLO(_exported_path(weights, backend), task="detect")
+        else:
+            raise ValueError(f"未知的 YOLO_BACKEND：{backend}")
+    return _MODEL_REGISTRY[key]
+
+def load_models(backend: str | None = None):
+    """取得 (機車模型, 車牌模型)；同一行程內重複呼叫不會重新載入"""
+    return get_model("motor", backend), get_model("plate", backend)
+
 def decode_npy_b64(b64_str):
     """將 base64 還原為 numpy array"""
     raw = base64.b64decode(b64_str)
     return np.load(io.BytesIO(raw))
 
+# base_configs 本機快取（BASE_CFG_CACHE=0 退回每次 select("*")）
+USE_BASE_CFG_CACHE = os.environ.get("BASE_CFG_CACHE", "1") == "1"
+_BASE_CFG_CACHE = None
+
 def get_base_config(area_id: str, route_key: str | None):
     """
     從 base_configs 撈對應的 Homography 與底圖資訊
     - 優先用 (route_key, area_id)；route_key 為空則只用 area_id（向下相容）
+    - 預設走 base_config_cache：版本沒變就不傳 base64 欄位
     """
+    global _BASE_CFG_CACHE
+    if USE_BASE_CFG_CACHE:
+        if _BASE_CFG_CACHE is None:
+            from base_config_cache import BaseConfigCache
+            _BASE_CFG_CACHE = BaseConfigCache(supabase)
+        return _BASE_CFG_CACHE.get_homography(area_id, route_key)
+
     q = supabase.table("base_configs").select("*").eq("area_id", area_id)
     if route_key:
         q = q.eq("route_key", route_key)
@@ -67,21 +139,163 @@ def parse_base_cfg_dir(base_cfg_dir: str):
     area  = m.group(2).upper()
     return route, area
 
-def run_detection_and_draw(img_path: str, base_cfg_dir: str, ocr_json_path: str):
-    # 解析 base_cfg_dir => route_key / area_id
-    route_key, area_id = parse_base_cfg_dir(base_cfg_dir)
+def _boxes_from(mot, plate):
+    """YOLO 結果 → (機車框 list, 車牌框 list)；COCO class 3 = motorcycle"""
+    m_boxes = [b.tolist() for b,c in zip(mot.boxes.xyxy.cpu(), mot.boxes.cls.cpu()) if int(c)==3]
+    p_boxes = plate.boxes.xyxy.cpu().tolist()
+    return m_boxes, p_boxes
 
-    # 1. 從 DB 取 H 與底圖大小（雙鍵 or 單鍵）
-    H, W, H_img = get_base_config(area_id, route_key)
+# 機車 ↔ 車牌配對
+#   dense  = 原本的做法：全矩陣解指派，之後才丟掉距離 >= MATCH_GATE_PX 的配對
+#   sparse = 結果與 dense 相同，但只在候選邊上解：少的一邊當列，先取每列最近的幾個點，
+#            用稀疏的指派解；再以殘差圖的最短路徑當對偶變數檢查所有沒列入的邊，
+#            有 reduced cost < 0 的就補進候選邊重解，直到沒有為止 → 這時的解就是全矩陣的最佳解
+#            （只有總成本完全平手、有多組最佳解時，選到的可能是另一組）
+#   auto   = 機車或車牌數 >= MATCH_SPARSE_MIN 才走 sparse（停車場場景約 800 以下全矩陣反而快）
+MATCH_MODE = os.environ.get("MATCH_MODE", "auto").lower()
+MATCH_GATE_PX = float(os.environ.get("MATCH_GATE_PX", "1000"))
+MATCH_SPARSE_MIN = int(os.environ.get("MATCH_SPARSE_MIN", "800"))
 
-    # 2. YOLO 偵測
-    img = cv2.imread(img_path)
-    model_motor = YOLO("yolov8m.pt")
-    model_plate = YOLO(r"C:\Users\CGM\Desktop\best_weight\plate.pt")
-    mot, plate = model_motor(img, verbose=False)[0], model_plate(img, verbose=False)[0]
+def _match_dense(m_cent, p_cent, gate: float):
+    """原本的配對：全矩陣匈牙利法，解完才套固定門檻"""
+    M, P = np.asarray(m_cent, float).reshape(-1, 2), np.asarray(p_cent, float).reshape(-1, 2)
+    D = np.linalg.norm(M[:, None, :] - P[None, :, :], axis=-1)
+    rows, cols = linear_sum_assignment(D)
+    return [(int(i), int(j)) for i, j in zip(rows, cols) if D[i, j] < gate]
 
-    m_boxes = [b.tolist() for b,c in zip(mot.boxes.xyxy.cpu(), mot.boxes.cls.cpu()) if int(c)==3]
-    p_boxes = plate.boxes.xyxy.cpu().tolist()
+def _potentials(n_r: int, n_c: int, ei, ej, d, match_col) -> np.ndarray:
+    """
+    殘差圖（未配對邊 列→行 權重 d、已配對邊 行→列 權重 -d、空著的行→匯點、匯點→各行 權重 0）
+    從匯點出發的最短距離；最佳解沒有負環，所以 Bellman-Ford 會收斂
+    回傳 pi：前 n_r 個是列、接著 n_c 個是行
+    """
+    F = n_r + n_c
+    on = match_col[ei] == ej
+    free = np.ones(n_c, bool)
+    free[match_col] = False
+    src = np.concatenate([ei[~on], n_r + ej[on], n_r + np.flatnonzero(free)])
+    dst = np.concatenate([n_r + ej[~on], ei[on], np.full(int(free.sum()), F)])
+    w = np.concatenate([d[~on], -d[on], np.zeros(int(free.sum()))])
+    pi = np.full(F + 1, np.inf)
+    pi[n_r:] = 0.0                      # 匯點 → 各行 權重 0
+    for _ in range(F + 1):
+        new = pi.copy()
+        np.minimum.at(new, dst, pi[src] + w)
+        if np.array_equal(new, pi):
+            return pi[:F]
+        pi = new
+    raise RuntimeError("殘差圖有負環：候選邊上的指派不是最佳解")
+
+def _match_sparse(m_cent, p_cent, gate: float, k: int = 4):
+    """與 _match_dense 相同的結果；候選邊從每列最近 k 個點開始，依 reduced cost 補邊直到最佳"""
+    from scipy.spatial import cKDTree
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+    M, P = np.asarray(m_cent, float).reshape(-1, 2), np.asarray(p_cent, float).reshape(-1, 2)
+    flip = len(M) > len(P)              # 少的一邊當列：最佳解裡每一列都會被配到
+    R, C = (P, M) if flip else (M, P)
+    n_r, n_c = len(R), len(C)
+    tree = cKDTree(C)
+    keys = np.empty(0, np.int64)
+    while True:
+        k = min(k, n_c)
+        _, nn = tree.query(R, k=k)
+        keys = np.union1d(keys, np.arange(n_r).repeat(k) * n_c + nn.reshape(-1))
+        ei, ej = keys // n_c, keys % n_c
+        d = np.linalg.norm(R[ei] - C[ej], axis=1)
+        try:
+            # 權重全部 +1：稀疏矩陣裡 0 等於沒有邊（中心重疊時距離為 0）；每列都配一次，總成本只差常數
+            _, match_col = min_weight_full_bipartite_matching(csr_matrix((d + 1.0, (ei, ej)), shape=(n_r, n_c)))
+        except ValueError:              # 候選邊湊不出讓每一列都配到的解：鄰居加倍
+            k *= 2
+            continue
+        pi = _potentials(n_r, n_c, ei, ej, d, match_col)
+        pr, pc = pi[:n_r], pi[n_r:]
+        # 沒列入的邊 (i, j) 只有 d_ij < pc_j - pr_i 才可能改善：先用 KD-tree 取半徑內的點再逐一檢查
+        tol = 1e-9 * (1.0 + float(d.max()))
+        near = tree.query_ball_point(R, r=np.maximum(pc.max() - pr, 0.0))
+        ci = np.fromiter((i for i, js in enumerate(near) for _ in js), dtype=np.int64)
+        cj = np.fromiter((j for js in near for j in js), dtype=np.int64)
+        bad = np.linalg.norm(R[ci] - C[cj], axis=1) < pc[cj] - pr[ci] - tol
+        add = np.setdiff1d(ci[bad] * n_c + cj[bad], keys)
+        if not len(add):
+            break
+        keys = np.union1d(keys, add)
+
+    dist = np.linalg.norm(R - C[match_col], axis=1)
+    matches = [((int(j), int(i)) if flip else (int(i), int(j)))
+               for i, j in enumerate(match_col) if dist[i] < gate]
+    return sorted(matches)
+
+def match_motors_plates(m_cent, p_cent, mode: str = None, gate: float = MATCH_GATE_PX):
+    """回傳 [(機車 idx, 車牌 idx)]，依機車 idx 排序（與 linear_sum_assignment 的列順序相同）"""
+    mode = (mode or MATCH_MODE).lower()
+    if not len(m_cent) or not len(p_cent):
+        return []
+    if mode == "auto":
+        mode = "sparse" if max(len(m_cent), len(p_cent)) >= MATCH_SPARSE_MIN else "dense"
+    if mode == "dense":
+        return _match_dense(m_cent, p_cent, gate)
+    return _match_sparse(m_cent, p_cent, gate)
+
+# PIPELINE_DEBUG_JSON=1 時原始偵測框另存 {img_path}_dets.json：{"motor": 機車框, "plate": 車牌框}
+# （tests/test_matching.py 設 MATCH_DETS_DIR 時拿來重播 dense / sparse 對照）
+DETS_SUFFIX = "_dets.json"
+
+def _save_detections(img_path: str, m_boxes, p_boxes):
+    with open(img_path + DETS_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump({"motor": m_boxes, "plate": p_boxes}, f)
+
+# 車牌 ↔ OCR 文字：conf 門檻；UNIQUE=1 時以指派問題解，同一段文字不會被兩個車牌拿走
+# 指派會把遠處的文字硬配給車牌：解完後離車牌中心超過 OCR_MAX_DIST_SCALE × 車牌框對角線的就丟掉（<= 0 不限）
+OCR_MIN_CONF = 0.7
+OCR_UNIQUE_ASSIGN = os.environ.get("OCR_UNIQUE_ASSIGN", "1") == "1"
+OCR_MAX_DIST_SCALE = float(os.environ.get("OCR_MAX_DIST_SCALE", "1.0"))
+
+def associate_plate_text(plate_centers, ocr_data, min_conf: float = OCR_MIN_CONF,
+                         unique: bool = None, plate_boxes=None, max_dist_scale: float = OCR_MAX_DIST_SCALE):
+    """
+    plate_centers: Nx2；ocr_data: [{text, conf, center}]；plate_boxes: Nx4（unique 時的距離門檻用）
+    回傳 (texts, dists)：每個車牌最近的可信文字與距離，找不到為 ("未知", None)
+    unique=False 等同舊的逐筆最近鄰（KD-tree 一次查完）；True 則一段文字只配給一個車牌，
+    且配到的文字離車牌中心超過 max_dist_scale × 車牌框對角線就當作沒配到
+    """
+    unique = OCR_UNIQUE_ASSIGN if unique is None else unique
+    n = len(plate_centers)
+    texts, dists = ["未知"] * n, [None] * n
+    good = [e for e in ocr_data if e.get("conf", 0) > min_conf]
+    if n == 0 or not good:
+        return texts, dists
+
+    P = np.asarray(plate_centers, dtype=np.float64).reshape(-1, 2)
+    T = np.asarray([e["center"] for e in good], dtype=np.float64).reshape(-1, 2)
+    if unique:
+        D = np.linalg.norm(P[:, None, :] - T[None, :, :], axis=-1)
+        rows, cols = linear_sum_assignment(D)
+        if plate_boxes is not None and max_dist_scale > 0:
+            B = np.asarray(plate_boxes, dtype=np.float64).reshape(-1, 4)
+            diag = np.hypot(B[:, 2] - B[:, 0], B[:, 3] - B[:, 1])
+            keep = D[rows, cols] <= max_dist_scale * diag[rows]
+            rows, cols = rows[keep], cols[keep]
+        pairs = zip(rows, cols, D[rows, cols])
+    else:
+        from scipy.spatial import cKDTree
+        d, j = cKDTree(T).query(P, k=1)
+        pairs = zip(range(n), j, d)
+    for i, j, d in pairs:
+        texts[i] = good[j].get("text", "未知")
+        dists[i] = float(d)
+    return texts, dists
+
+def build_results(img_path: str, route_key, area_id, base_cfg, m_boxes, p_boxes, ocr_json_path: str,
+                  img=None, ocr_data=None, write_json: bool = True):
+    """
+    配對 + 投影 + OCR，寫出 {img_path}_result.json 並回傳結果 list（失敗回 None）
+    ocr_data：OCR 結果 list 直接用；可呼叫物件則在配對之後才以「有配對到的車牌框」呼叫
+    （單一階段管線：沒機車 / 沒配對就完全不跑 OCR）；None 依 OCR_MODE 讀 ocr_json_path 或辨識車牌框
+    """
+    H, W, H_img = base_cfg
     if not m_boxes or not p_boxes:
         print("⚠️ 影像中無機車或車牌，跳過")
         return
@@ -89,48 +303,37 @@ def run_detection_and_draw(img_path: str, base_cfg_dir: str, ocr_json_path: str)
     mid = lambda b: ((b[0]+b[2])/2, (b[1]+b[3])/2)
     m_cent, p_cent = [mid(b) for b in m_boxes], [mid(b) for b in p_boxes]
 
-    # 3. 匈牙利配對
-    D = np.linalg.norm(np.expand_dims(m_cent,1)-np.expand_dims(p_cent,0), axis=-1)
-    rows, cols = linear_sum_assignment(D)
-    matches = [(i,j) for i,j in zip(rows, cols) if D[i,j] < 1000]
+    # 3. 匈牙利配對（大場景走 sparse：剪掉不可能被選的邊，結果與全矩陣相同）
+    matches = match_motors_plates(m_cent, p_cent)
     if not matches:
         print("⚠️ 無配對成功機車")
         return
 
-    # 4. 投影 + 像素換算
-    def norm_to_px(xn: float, yn: float):
-        x = (xn + 1) / 2 * W
-        y = (1 - yn) / 2 * H_img
-        return float(x), float(y)
-
-    px_pos = []
-    for i,_ in matches:
-        cx, cy = m_cent[i]
-        xn, yn = cv2.perspectiveTransform(np.array([[[cx, cy]]], dtype=np.float32), H)[0, 0]
-        x_px, y_px = norm_to_px(xn, yn)
-        px_pos.append((x_px, y_px))
+    # 4. 投影 + 像素換算（所有配對到的機車中心一次投影）
+    px_pos = [(float(x), float(y)) for x, y in
+              image_to_base_px(H, [m_cent[i] for i, _ in matches], W, H_img)]
 
-    # 5. 讀 OCR
-    ocr_data = json.load(open(ocr_json_path, encoding="utf-8"))
+    # 5. 讀 OCR（crops 模式：只辨識有配對到機車的車牌框）
+    if callable(ocr_data):
+        ocr_data = ocr_data([p_boxes[j] for _, j in matches])
+    elif ocr_data is not None:
+        pass
+    elif OCR_MODE == "crops":
+        if img is None:
+            img = cv2.imread(img_path)
+        ocr_data = _ocr_on_plates(img, [p_boxes[j] for _, j in matches], ocr_json_path)
+    else:
+        ocr_data = json.load(open(ocr_json_path, encoding="utf-8"))
 
     # 6. 組 result list（避免 Infinity）
+    plate_texts, plate_dists = associate_plate_text([p_cent[j] for _, j in matches], ocr_data,
+                                                    plate_boxes=[p_boxes[j] for _, j in matches])
+    # motor_uid 用底圖座標量化（照片像素每張都會抖動）
+    uids = motor_uids(plate_texts, px_pos)
     results = []
     for idx, (x_px, y_px) in enumerate(px_pos):
-        mot_idx, plate_idx = matches[idx]
-        cx, cy = m_cent[mot_idx]
-        px, py = p_cent[plate_idx]
-
-        best_txt, best_d = "未知", None
-        for e in ocr_data:
-            ex, ey = e["center"]
-            d = np.hypot(ex - px, ey - py)
-            if e.get("conf", 0) > 0.7:
-                if best_d is None or d < best_d:
-                    best_d = d
-                    best_txt = e.get("text", best_txt)
-
-        # motor_uid
-        motor_uid = f"{best_txt}#{int(cx)}#{int(cy)}"
+        best_txt, best_d = plate_texts[idx], plate_dists[idx]
+        motor_uid = uids[idx]
 
         results.append(dict(
             motor_index=idx,
@@ -143,16 +346,157 @@ def run_detection_and_draw(img_path: str, base_cfg_dir: str, ocr_json_path: str)
             motor_uid=motor_uid,
         ))
 
-    # 7. 輸出 JSON（禁止 NaN/Inf）
-    out_path = img_path + "_result.json"
-    json.dump(results, open(out_path, "w", encoding="utf-8"),
-              ensure_ascii=False, indent=2, allow_nan=False)
-    print(f"✅ 產生 {out_path}  ({len(results)} 筆)")
+    # 7. 輸出 JSON（禁止 NaN/Inf）；PIPELINE_DEBUG_JSON=1 時原始偵測框另存 _dets.json
+    if write_json:
+        if DEBUG_JSON:
+            _save_detections(img_path, m_boxes, p_boxes)
+        out_path = img_path + "_result.json"
+        json.dump(results, open(out_path, "w", encoding="utf-8"),
+                  ensure_ascii=False, indent=2, allow_nan=False)
+        print(f"✅ 產生 {out_path}  ({len(results)} 筆)")
+    return results
+
+def run_detection_and_draw(img_path: str, base_cfg_dir: str, ocr_json_path: str, models=None):
+    # 解析 base_cfg_dir => route_key / area_id
+    route_key, area_id = parse_base_cfg_dir(base_cfg_dir)
+
+    # 1. 從 DB 取 H 與底圖大小（雙鍵 or 單鍵）
+    base_cfg = get_base_config(area_id, route_key)
+
+    # 2. YOLO 偵測
+    img = cv2.imread(img_path)
+    model_motor, model_plate = models if models is not None else load_models()
+    mot, plate = model_motor(img, verbose=False)[0], model_plate(img, verbose=False)[0]
+
+    m_boxes, p_boxes = _boxes_from(mot, plate)
+    return build_results(img_path, route_key, area_id, base_cfg, m_boxes, p_boxes, ocr_json_path,
+                         img=img)
+
+# ------------ 多張批次 ------------
+BATCH_SIZE = int(os.environ.get("YOLO_BATCH", "8"))
+
+def detect_batch(images, models, batch_size: int = BATCH_SIZE):
+    """images: BGR ndarray list → [(m_boxes, p_boxes)]；每個模型一次跑 batch_size 張"""
+    model_motor, model_plate = models
+    out = []
+    for s in range(0, len(images), batch_size):
+        chunk = images[s:s + batch_size]
+        mots = model_motor(chunk, verbose=False)
+        plates = model_plate(chunk, verbose=False)
+        out.extend(_boxes_from(m, p) for m, p in zip(mots, plates))
+    return out
+
+def _prepare_jobs(items, out):
+    """
+    items: [(img_path, base_cfg_dir, ocr_json_path), ...] → (jobs, images)
+    每張只解碼一次；同一區的 base config 只查一次。失敗的在 out 記 None。
+    """
+    jobs, images = [], []
+    cfg_cache = {}
+    for img_path, base_cfg_dir, ocr_json_path in items:
+        route_key, area_id = parse_base_cfg_dir(base_cfg_dir)
+        try:
+            key = (route_key, area_id)
+            if key not in cfg_cache:
+                cfg_cache[key] = get_base_config(area_id, route_key)
+        except Exception as e:
+            print(f"❌ {img_path}: {e}")
+            out[img_path] = None
+            continue
+        img = cv2.imread(img_path)
+        if img is None:
+            print(f"❌ 無法讀圖：{img_path}")
+            out[img_path] = None
+            continue
+        jobs.append((img_path, route_key, area_id, cfg_cache[key], ocr_json_path))
+        images.append(img)
+    return jobs, images
+
+def run_detection_batch(items, models=None, batch_size: int = BATCH_SIZE):
+    """
+    items: [(img_path, base_cfg_dir, ocr_json_path), ...]
+    每個模型對整批影像跑一次前向（依 batch_size 切），每張各自輸出 _result.json。
+    回傳 {img_path: 結果 list 或 None}
+    """
+    models = models if models is not None else load_models()
+    out = {}
+    jobs, images = _prepare_jobs(items, out)
+
+    for (img_path, route_key, area_id, base_cfg, ocr_json_path), img, (m_boxes, p_boxes) in \
+            zip(jobs, images, detect_batch(images, models, batch_size)):
+        try:
+            out[img_path] = build_results(img_path, route_key, area_id, base_cfg,
+                                          m_boxes, p_boxes, ocr_json_path, img=img)
+        except Exception as e:
+            print(f"❌ {img_path}: {e}")
+            out[img_path] = None
+    return out
+
+# ------------ 單一階段：解碼一次 → 偵測 + OCR 都在記憶體 ------------
+def _deferred_ocr(img, ocr_mode: str, ocr_json_path):
+    """給 build_results 的 OCR：配對完才以配對到的車牌框呼叫（crops 只辨識這些框，full 整張）"""
+    def run(matched_plate_boxes):
+        if ocr_mode == "crops":
+            return _ocr_on_plates(img, matched_plate_boxes, ocr_json_path)
+        data = _ocr_module().ocr_image(img)
+        if ocr_json_path:
+            with open(ocr_json_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        return data
+    return run
+
+def analyze_images(items, models=None, ocr_mode: str = None, debug_json: bool = None,
+                   batch_size: int = BATCH_SIZE):
+    """
+    items: [(img_path, base_cfg_dir), ...]
+    取代「ocr.py 寫 _ocr.json → based_mark.py 再讀」的兩個行程：
+    同一個 ndarray 給 YOLO 與 PaddleOCR（full 整張 / crops 只辨識有配對到機車的車牌框），結果直接回傳；
+    OCR 在配對之後才跑，沒機車或沒配對的影像不跑 OCR。
+    debug_json=True 才寫 _ocr.json / _result.json。
+    回傳 {img_path: 結果 list 或 None}；這個環境載入不了 OCR 就直接丟 ImportError（呼叫端退回兩段流程）
+    """
+    ocr_mode = (ocr_mode or OCR_MODE).lower()
+    debug_json = DEBUG_JSON if debug_json is None else debug_json
+    _ocr_module()   # 先確認 OCR 可用，不要每張都失敗成 None 被當成「沒有結果」
+    models = models if models is not None else load_models()
+    out = {}
+    jobs, images = _prepare_jobs(
+        [(p, cfg_dir, (p + "_ocr.json") if debug_json else None) for p, cfg_dir in items], out)
+
+    for (img_path, route_key, area_id, base_cfg, ocr_json_path), img, (m_boxes, p_boxes) in \
+            zip(jobs, images, detect_batch(images, models, batch_size)):
+        try:
+            out[img_path] = build_results(img_path, route_key, area_id, base_cfg, m_boxes, p_boxes,
+                                          ocr_json_path, img=img,
+                                          ocr_data=_deferred_ocr(img, ocr_mode, ocr_json_path),
+                                          write_json=debug_json)
+        except Exception as e:
+            print(f"❌ {img_path}: {e}")
+            out[img_path] = None
+    return out
 
 # ------------ CLI ------------
 if __name__ == "__main__":
+    # python based_mark.py --batch jobs.json   （jobs.json: [[image, base_config_dir, ocr_json], ...]）
+    if len(sys.argv) == 3 and sys.argv[1] == "--batch":
+        items = json.load(open(sys.argv[2], encoding="utf-8"))
+        res = run_detection_batch([tuple(x) for x in items])
+        sys.exit(0 if any(v is not None for v in res.values()) else 1)
+    # python based_mark.py --pipeline jobs.json out.json  （jobs.json: [[image, base_config_dir], ...]）
+    if len(sys.argv) == 4 and sys.argv[1] == "--pipeline":
+        items = json.load(open(sys.argv[2], encoding="utf-8"))
+        try:
+            res = analyze_images([tuple(x) for x in items])
+        except ImportError as e:
+            print(f"❌ 這個環境載入不了 OCR：{e}")   # 不寫 out.json：auto_process 會退回兩段流程
+            sys.exit(2)
+        with open(sys.argv[3], "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, allow_nan=False)
+        sys.exit(0 if any(v is not None for v in res.values()) else 1)
     # 仍然只收 3 個參數（跟你原本一樣）
     if len(sys.argv) != 3 and len(sys.argv) != 4:
         print("用法: python based_mark.py <image> <base_config_dir> <ocr_json>")
+        print("      python based_mark.py --batch <jobs.json>")
+        print("      python based_mark.py --pipeline <jobs.json> <out.json>")
         sys.exit(1)
-    run_detection_and_draw(*sys.argv[1:])
\ No newline at end of file
+    run_detection_and_draw(*sys.argv[1:])
@@ -0,0 +1,104 @@
+# bench_detect.py
+"""
+based_mark 的效能量測（不屬於正式流程；輸出一致性見 tests/test_backends.py）：
+  python benchmarks/bench_detect.py batch <image> [image ...]             不同 batch size 的 YOLO 前向延遲
+  python benchmarks/bench_detect.py pipeline <image> [image ...]          單一階段省下的解碼 / _ocr.json / 行程啟動
+  python benchmarks/bench_detect.py backends <onnx|openvino> [image ...]  torch 與匯出後端的每張延遲
+"""
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+MARK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MARK_DIR)
+
+import cv2
+
+from based_mark import _ocr_module, detect_batch, load_models
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        dt = (time.perf_counter() - t0) * 1000
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def bench_pipeline(img_paths, repeat: int = 3):
+    """量單一階段省下的成本：每張多一次 JPEG 解碼、_ocr.json 往返、以及每張一個 ocr.py 行程的啟動"""
+    paths = [p for p in img_paths if os.path.exists(p)]
+    if not paths:
+        print("沒有可讀的影像")
+        return
+
+    decode_ms = _best_of(lambda: [cv2.imread(p) for p in paths], repeat) / len(paths)
+
+    ocr_data = _ocr_module().ocr_image(cv2.imread(paths[0]))
+    tmp = os.path.join(os.path.dirname(os.path.abspath(paths[0])), "_bench_ocr.json")
+    def json_roundtrip():
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(ocr_data, f, ensure_ascii=False, indent=2)
+        json.load(open(tmp, encoding="utf-8"))
+    json_ms = _best_of(json_roundtrip, repeat)
+    os.remove(tmp)
+
+    spawn_ms = _best_of(lambda: subprocess.run(
+        [sys.executable, "-c", f"import sys; sys.path.insert(0, r'{MARK_DIR}'); import ocr"],
+        capture_output=True, check=False), repeat)
+
+    print(f"影像數：{len(paths)}（OCR 文字 {len(ocr_data)} 筆）")
+    print(f"{'重複解碼':<14} {decode_ms:9.1f} ms/張")
+    print(f"{'_ocr.json 往返':<14} {json_ms:9.1f} ms/張")
+    print(f"{'ocr.py 行程啟動':<14} {spawn_ms:9.1f} ms/張（不含 conda run 本身）")
+    print(f"{'合計省下':<14} {decode_ms + json_ms + spawn_ms:9.1f} ms/張")
+
+
+def bench_batch(img_paths, sizes=(1, 4, 8, 16), n_images: int = 16):
+    """只量 YOLO 前向：不同 batch size 下每張影像的平均延遲"""
+    models = load_models()
+    imgs = [cv2.imread(p) for p in img_paths]
+    imgs = [im for im in imgs if im is not None]
+    if not imgs:
+        print("沒有可讀的影像")
+        return
+    imgs = (imgs * (n_images // len(imgs) + 1))[:n_images]
+    detect_batch(imgs[:1], models, 1)   # 暖機
+
+    print(f"{'batch':>6} {'total (s)':>10} {'ms/img':>9}")
+    for bs in sizes:
+        t0 = time.perf_counter()
+        detect_batch(imgs, models, bs)
+        dt = time.perf_counter() - t0
+        print(f"{bs:>6} {dt:>10.2f} {dt / len(imgs) * 1000:>9.1f}")
+
+
+def bench_backends(img_paths, backend: str, repeat: int = 3):
+    """torch 與 backend 每張影像（兩個模型）的延遲"""
+    imgs = [im for im in (cv2.imread(p) for p in img_paths) if im is not None]
+    if not imgs:
+        print("沒有可讀的影像")
+        return
+    for name in ("torch", backend):
+        models = load_models(name)
+        detect_batch(imgs[:1], models, 1)   # 暖機
+        ms = _best_of(lambda: [detect_batch([im], models, 1) for im in imgs], repeat) / len(imgs)
+        print(f"{name:<10} {ms:9.1f} ms/張")
+
+
+if __name__ == "__main__":
+    cmd, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) >= 2 else ("", [])
+    if cmd == "batch" and args:
+        bench_batch(args)
+    elif cmd == "pipeline" and args:
+        bench_pipeline(args)
+    elif cmd == "backends" and args:
+        bench_backends(args[1:] or sorted(glob.glob(os.path.join(MARK_DIR, "downloads", "*.jpg"))), args[0])
+    else:
+        print(__doc__)
+        sys.exit(1)
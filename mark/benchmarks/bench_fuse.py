@@ -0,0 +1,95 @@
+# bench_fuse.py
+"""
+sift_v1 融合：全解析度 vs 金字塔（FUSE_WORK_WIDTH）的估 H 時間、峰值 RSS 與投影差。
+每種設定在獨立行程跑，才量得到各自的峰值 RSS：
+  python benchmarks/bench_fuse.py <base_img.jpg> <upload_img.jpg> [work_width]
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_DIR)
+
+import cv2
+import numpy as np
+
+from sift_v1 import WORK_WIDTH, blend_into_base, estimate_homography
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except Exception:
+            return float("nan")
+
+
+def _bench_run(base_img_path, target_img_path, work_width, refine):
+    t0 = time.perf_counter()
+    base_img = cv2.imread(base_img_path, cv2.IMREAD_COLOR)
+    target_img = cv2.imread(target_img_path, cv2.IMREAD_COLOR)
+    M = estimate_homography(base_img, target_img, None, work_width, refine, use_cache=False)
+    t_h = time.perf_counter() - t0
+    if M is not None:
+        blend_into_base(base_img, target_img, M)
+    t_all = time.perf_counter() - t0
+    print("BENCH " + json.dumps({
+        "homography_s": t_h, "total_s": t_all, "peak_rss_mb": _peak_rss_mb(),
+        "M": None if M is None else M.tolist(), "target_shape": list(target_img.shape[:2]),
+    }))
+
+
+def bench(base_img_path, target_img_path, work_width=WORK_WIDTH or 1600, repeat=3):
+    def run(ww, refine):
+        rows = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--run",
+                                  base_img_path, target_img_path, str(ww), "1" if refine else "0"],
+                                 capture_output=True, text=True, encoding="utf-8").stdout
+            line = next((l for l in out.splitlines() if l.startswith("BENCH ")), None)
+            if line:
+                rows.append(json.loads(line[6:]))
+        return rows
+
+    full = run(0, False)
+    if not full or full[0]["M"] is None:
+        print("全解析度估 H 失敗，無法比較")
+        return
+    M_ref = np.array(full[0]["M"])
+    th, tw = full[0]["target_shape"]
+    gx, gy = np.meshgrid(np.linspace(0, tw - 1, 10), np.linspace(0, th - 1, 10))
+    grid = np.stack([gx.ravel(), gy.ravel()], axis=1).astype(np.float32).reshape(-1, 1, 2)
+    ref = cv2.perspectiveTransform(grid, M_ref)
+
+    print(f"{'mode':<22}{'H (s)':>9}{'total (s)':>11}{'peak RSS (MB)':>15}{'reproj mean/max (px)':>24}")
+    for name, ww, refine in (("full-res", 0, False),
+                             (f"pyramid w={work_width}", work_width, False),
+                             (f"pyramid w={work_width}+ref", work_width, True)):
+        rows = full if ww == 0 else run(ww, refine)
+        ok = [r for r in rows if r["M"] is not None]
+        if not ok:
+            print(f"{name:<22}  估 H 失敗")
+            continue
+        d = np.linalg.norm(cv2.perspectiveTransform(grid, np.array(ok[0]["M"])) - ref, axis=-1)
+        print(f"{name:<22}{np.median([r['homography_s'] for r in ok]):>9.3f}"
+              f"{np.median([r['total_s'] for r in ok]):>11.3f}"
+              f"{max(r['peak_rss_mb'] for r in ok):>15.1f}"
+              f"{d.mean():>13.2f} / {d.max():<8.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 6 and sys.argv[1] == "--run":
+        _bench_run(sys.argv[2], sys.argv[3], int(sys.argv[4]), sys.argv[5] == "1")
+    elif len(sys.argv) in (3, 4):
+        bench(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) == 4 else WORK_WIDTH or 1600)
+    else:
+        print(__doc__.strip())
+        sys.exit(1)
@@ -0,0 +1,37 @@
+# bench_infer_pool.py
+"""
+同一批查詢圖在不同 worker 數下的區位推論吞吐量（張/秒）：
+  python benchmarks/bench_infer_pool.py <base_root> <location> 1,2,4,8 <query1> [query2 ...]
+"""
+import os
+import sys
+import time
+from typing import List
+
+MARK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MARK_DIR)
+
+from infer_location import _pool_init, infer_many
+
+
+def bench_pool(query_paths: List[str], base_root: str, location: str, worker_counts: List[int]):
+    jobs = [(i, q, base_root, location) for i, q in enumerate(query_paths)]
+    _pool_init([(base_root, location)])
+    rows = []
+    for n in worker_counts:
+        t0 = time.perf_counter()
+        infer_many(jobs, n)
+        dt = time.perf_counter() - t0
+        rows.append((n, dt, len(jobs) / dt if dt > 0 else float("inf")))
+    print(f"{'workers':>8} {'seconds':>9} {'img/s':>8}")
+    for n, dt, ips in rows:
+        print(f"{n:>8} {dt:>9.2f} {ips:>8.2f}")
+    return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        print(__doc__.strip())
+        sys.exit(1)
+    counts = [int(x) for x in sys.argv[3].split(",") if x]
+    bench_pool(sys.argv[4:], sys.argv[1], sys.argv[2], counts)
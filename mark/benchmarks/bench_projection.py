@@ -0,0 +1,48 @@
+# bench_projection.py
+"""
+projection 的批次寫法 vs 原本逐點寫法的速度（一致性見 tests/test_projection.py）：
+  python benchmarks/bench_projection.py [N ...]
+"""
+import os
+import sys
+import time
+
+MARK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MARK_DIR)
+sys.path.insert(0, os.path.join(MARK_DIR, "tests"))
+
+import numpy as np
+
+from projection import align_points_to_centerline, image_to_base_px, pixel_to_latlng_arr
+from test_projection import BOX, CFG, H, align_loop, latlng_loop, per_point_to_px
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        dt = (time.perf_counter() - t0) * 1000
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def bench(sizes=(10, 1000, 100000), repeat: int = 3):
+    rng = np.random.default_rng(0)
+    W, H_img = CFG["img_width"], CFG["img_height"]
+    print(f"{'N':>7} {'px loop':>9} {'px vec':>8} {'align loop':>11} {'align vec':>10} "
+          f"{'latlng loop':>12} {'latlng vec':>11}")
+    for n in sizes:
+        pts = rng.uniform(0, [1920, 1080], size=(n, 2))
+        box_pts = rng.uniform([100, 150], [1500, 350], size=(n, 2))
+        aligned = align_points_to_centerline(box_pts, BOX)
+        print(f"{n:>7} {_best_of(lambda: per_point_to_px(H, pts, W, H_img), repeat):>7.2f}ms "
+              f"{_best_of(lambda: image_to_base_px(H, pts, W, H_img), repeat):>6.2f}ms "
+              f"{_best_of(lambda: align_loop(box_pts, BOX), repeat):>9.2f}ms "
+              f"{_best_of(lambda: align_points_to_centerline(box_pts, BOX), repeat):>8.2f}ms "
+              f"{_best_of(lambda: latlng_loop(aligned, CFG), repeat):>10.2f}ms "
+              f"{_best_of(lambda: pixel_to_latlng_arr(aligned, CFG), repeat):>9.2f}ms")
+
+
+if __name__ == "__main__":
+    bench(tuple(int(x) for x in sys.argv[1:]) or (10, 1000, 100000))
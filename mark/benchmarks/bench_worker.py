@@ -0,0 +1,59 @@
+# bench_worker.py
+"""
+冷啟動（每張一個 python -c 行程，routes.ts 原本的做法）vs 常駐 inference_worker 的區位推論延遲：
+  python benchmarks/bench_worker.py <query.jpg> <base_root> <location> [-n 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MARK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MARK_DIR)
+
+from inference_worker import WorkerClient
+
+
+def _summary(name, xs):
+    xs = sorted(xs)
+    p95 = xs[min(len(xs) - 1, int(round(0.95 * (len(xs) - 1))))]
+    print(f"{name:<22} n={len(xs):<3} min={xs[0]:8.1f} ms  median={statistics.median(xs):8.1f} ms  p95={p95:8.1f} ms")
+
+
+def bench(query: str, base_root: str, location: str, n: int = 10, cold_n: int = 3):
+    # 1) 每次 python -c 載入 infer_location
+    snippet = ("import sys; sys.path.insert(0, r'%s'); import infer_location as m; "
+               "print('RESULT:', m.infer_area_by_kp(r'%s', r'%s', r'%s') or '')"
+               % (MARK_DIR, query, base_root, location))
+    cold = []
+    for _ in range(cold_n):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", snippet], capture_output=True, check=False)
+        cold.append((time.perf_counter() - t0) * 1000)
+
+    # 2) 常駐 worker
+    w = WorkerClient(extra_args=["--base-root", base_root, "--warm", location])
+    print(f"worker 啟動：spawn→ready {w.spawn_ms:.1f} ms（行程內 startup {w.startup_ms} ms）")
+    warm_ms = []
+    try:
+        for _ in range(n):
+            t0 = time.perf_counter()
+            w.call("infer_area", query_path=query, base_root=base_root, location=location)
+            warm_ms.append((time.perf_counter() - t0) * 1000)
+    finally:
+        w.close()
+
+    _summary("cold (python -c)", cold)
+    _summary("warm (worker)", warm_ms)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("query")
+    ap.add_argument("base_root")
+    ap.add_argument("location")
+    ap.add_argument("-n", type=int, default=10, help="暖請求次數")
+    a = ap.parse_args()
+    bench(a.query, a.base_root, a.location, n=a.n)
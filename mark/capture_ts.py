@@ -0,0 +1,22 @@
+# capture_ts.py
+"""
+上傳檔名裡的拍攝時間：<location>_YYYY-MM-DD-HH-MM[-SS].jpg（秒可省略）
+auto_process（排推論順序）與 sift_v1（融合順序）共用，兩邊對同一個檔名一定解析出同一個時間。
+"""
+import os
+import re
+from datetime import datetime
+from typing import Optional
+
+CAPTURE_TS_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})-(\d{2})-(\d{2})(?:-(\d{2}))?")
+
+
+def filename_capture_time(name: str) -> Optional[datetime]:
+    """從檔名（可帶路徑）取拍攝時間；取不到或日期不合法回 None"""
+    m = CAPTURE_TS_RE.search(os.path.basename(name or ""))
+    if not m:
+        return None
+    try:
+        return datetime(*(int(g or 0) for g in m.groups()))
+    except ValueError:
+        return None
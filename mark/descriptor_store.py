@@ -0,0 +1,382 @@
+# descriptor_store.py
+"""
+每個 location 一份、可 memory-map 的 SIFT 描述子庫（取代每張圖一個 .sift.npz）：
+
+  {base_dir}/_sift_store/
+    des.npy        float32 (capacity, dim)  所有底圖的描述子，連續一塊；每張底圖占一段連續的列
+    kp.npy         float32 (capacity, 3)    關鍵點 (x, y, size)，列與 des 對齊
+    offsets.npy    int64   (n, 2)           每張底圖（依檔名排序）的 [起始列, 列數]
+    labels.npy     str     (n,)             每張底圖的區代號（A01 / B02 ...）
+    manifest.json  generation / 資料檔名 / capacity / used / 每張底圖：name / area / mtime_ns / size / sha1 / start / count
+    sync.lock      sync 的跨行程鎖
+
+一張底圖變了只重算它、只寫它自己那一段：新的一段寫在 used 之後（r+ memmap，manifest 還沒引用的列），
+舊的那段變成空洞；其他底圖的列不動。目前 manifest 引用的列從不原地改寫，
+別的行程照舊 manifest 讀到的一定是完整資料。
+空洞超過存活列數、或容量不夠時才整理一次：存活的段落複製到新檔（暫存檔 → os.replace 成 des.npy；
+Windows 上 des.npy 還被別的行程 mmap 而換不掉時，改寫成 des.{generation}.npy，manifest 記下檔名）。
+offsets.npy / labels.npy 與 manifest 同一次寫（manifest 最後換）；讀的時候以 manifest 為準，兩者對不上
+（剛好撞上別的行程寫到一半）就從 manifest 重組。
+generation 是每次內容有變就換新的隨機代號（不會重複使用），索引 / 詞袋拿它當版本；
+只有 mtime 變、內容沒變時沿用原 generation。
+讀取用 np.load(mmap_mode="r")，多個行程共用 page cache、零複製。
+"""
+import os
+import time
+import json
+import uuid
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from atomic_io import atomic_write_bytes, file_lock, tmp_path
+
+STORE_DIRNAME = "_sift_store"
+MANIFEST_NAME = "manifest.json"
+OFFSETS_NAME = "offsets.npy"
+LABELS_NAME = "labels.npy"
+LOCK_NAME = "sync.lock"
+LAYOUT = "contiguous"  # manifest 格式；舊的 slots/ 或 des.{gen}.npy 格式會被視為過期、重建一次
+MIN_CAPACITY = 4096    # 新檔至少幾列；整理時容量取存活列數的兩倍
+STALE_TMP_SEC = 3600   # 超過這麼久的 .tmp 視為寫到一半掛掉的行程留下的
+
+# compute_fn(img_path) -> (kp Nx3 float32, des NxD float32 或 None)
+ComputeFn = Callable[[str], Tuple[np.ndarray, Optional[np.ndarray]]]
+
+
+def file_sha1(path: str, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _stat_key(path: Path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return int(st.st_mtime_ns), int(st.st_size), int(st.st_ino)
+
+
+def _save_npy(path: Path, arr: np.ndarray):
+    tmp = tmp_path(path)
+    try:
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class DescriptorStore:
+    def __init__(self, base_dir: Path, compute_fn: ComputeFn, max_des: int,
+                 area_fn: Callable[[str], str] = lambda p: Path(p).stem, dim: int = 128):
+        self.base_dir = Path(base_dir)
+        self.dir = self.base_dir / STORE_DIRNAME
+        self.compute_fn = compute_fn
+        self.area_fn = area_fn
+        self.max_des = int(max_des)
+        self.dim = int(dim)
+        self.entries: Dict[str, dict] = {}   # name -> manifest entry
+        self.meta: dict = {}                 # manifest 本體（資料檔名 / capacity / used）
+        self.generation = ""                 # 內容版本（隨機代號）；索引 / 詞袋用它判斷是否過期
+        self.loaded = False                  # manifest 有效（參數相同、格式相同）
+        self.offsets = np.zeros((0, 2), np.int64)   # 依檔名排序的 [起始列, 列數]
+        self.labels = np.zeros(0, dtype=str)        # 依檔名排序的區代號
+        self._stamp = None                   # 上次載入時 manifest 的 (mtime_ns, size, inode)
+        self._data = None                    # (kp, des) 整塊的 np.memmap（唯讀）
+        self._load_manifest()
+
+    # ---------- 讀取 ----------
+    def _load_manifest(self):
+        path = self.dir / MANIFEST_NAME
+        self.entries, self.meta, self.generation, self.loaded = {}, {}, "", False
+        self._data = None
+        self._stamp = _stat_key(path)
+        try:
+            meta = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if (meta.get("layout") != LAYOUT or meta.get("max_des") != self.max_des
+                or meta.get("dim") != self.dim):
+            return
+        self.meta = meta
+        self.entries = {e["name"]: e for e in meta["files"]}
+        self.generation = str(meta["generation"])
+        self.loaded = True
+        self._load_tables()
+
+    def _load_tables(self):
+        """offsets.npy / labels.npy；與 manifest 對不上（別的行程寫到一半）就從 manifest 重組"""
+        files = self.meta["files"]
+        want_off = np.array([[e["start"], e["count"]] for e in files], np.int64).reshape(-1, 2)
+        want_lab = np.array([e["area"] for e in files], dtype=str)
+        try:
+            off = np.load(self.dir / OFFSETS_NAME)
+            lab = np.load(self.dir / LABELS_NAME)
+            if np.array_equal(off, want_off) and np.array_equal(lab, want_lab):
+                self.offsets, self.labels = off, lab
+                return
+        except (OSError, ValueError):
+            pass
+        self.offsets, self.labels = want_off, want_lab
+
+    def _arrays(self):
+        if self._data is None:
+            self._data = (np.load(self.dir / self.meta["kp_file"], mmap_mode="r"),
+                          np.load(self.dir / self.meta["des_file"], mmap_mode="r"))
+        return self._data
+
+    def refresh(self) -> "DescriptorStore":
+        """manifest 被別的行程換掉了就重新載入（只 stat 一次）"""
+        if _stat_key(self.dir / MANIFEST_NAME) != self._stamp:
+            self._load_manifest()
+        return self
+
+    def _is_fresh(self, path: str) -> bool:
+        e = self.entries.get(os.path.basename(path))
+        if e is None or not self.loaded:
+            return False
+        st = os.stat(path)
+        return e["mtime_ns"] == int(st.st_mtime_ns) and e["size"] == int(st.st_size)
+
+    def get(self, path: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """回傳 (kp Nx3, des NxD) 的唯讀 view（整塊 memmap 的一段）；不在庫中、已過期或讀不到回 (None, None)"""
+        self.refresh()
+        if not self._is_fresh(path):
+            return None, None
+        e = self.entries[os.path.basename(path)]
+        if e["count"] == 0:
+            return np.zeros((0, 3), np.float32), None
+        try:
+            kp, des = self._arrays()
+        except (OSError, ValueError, KeyError):
+            return None, None   # 剛被別的行程整理掉了：呼叫端會 sync 後重讀
+        s, n = e["start"], e["count"]
+        return kp[s:s + n], des[s:s + n]
+
+    def areas(self) -> Dict[str, str]:
+        return {name: e["area"] for name, e in self.entries.items()}
+
+    def is_current(self, candidates: List[str]) -> bool:
+        names = {os.path.basename(p) for p in candidates}
+        return (self.loaded and names == set(self.entries)
+                and all(self._is_fresh(p) for p in candidates))
+
+    # ---------- 同步 ----------
+    def sync(self, candidates: List[str]) -> "DescriptorStore":
+        """
+        讓 store 與 candidates 一致（已一致就只 stat，不拿鎖）：
+          - mtime/size 沒變 → 不動
+          - mtime 變了但 sha1 相同 → 只更新 manifest（generation 不變）
+          - 內容變了 / 新增 → 只重算這幾張，各寫一段在 used 之後；刪除 → 只改 manifest
+        同一個 store 的 sync 以檔案鎖串起來；拿到鎖後重讀 manifest，別的行程剛同步完就不重做。
+        """
+        if self.refresh().is_current(candidates):
+            return self
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.dir / LOCK_NAME):
+            self._load_manifest()
+            if not self.is_current(candidates):
+                self._sync_locked(candidates)
+        return self
+
+    def _sync_locked(self, candidates: List[str]):
+        old_entries = self.entries if self.loaded else {}
+        new_entries: Dict[str, dict] = {}
+        pending: Dict[str, tuple] = {}   # name -> (kp, des)：要寫新的一段
+
+        for p in candidates:
+            name = os.path.basename(p)
+            st = os.stat(p)
+            old = old_entries.get(name)
+            e = {"name": name, "area": self.area_fn(p),
+                 "mtime_ns": int(st.st_mtime_ns), "size": int(st.st_size)}
+            if old and old["mtime_ns"] == e["mtime_ns"] and old["size"] == e["size"]:
+                new_entries[name] = {**old, **e}
+                continue
+            e["sha1"] = file_sha1(p)
+            if old and old.get("sha1") == e["sha1"]:
+                new_entries[name] = {**old, **e}
+                continue
+            kp, des = self.compute_fn(p)
+            n = 0 if des is None else min(len(des), self.max_des)
+            pending[name] = (np.asarray(kp[:n], dtype=np.float32).reshape(-1, 3),
+                             np.asarray(des[:n], dtype=np.float32).reshape(-1, self.dim) if n
+                             else np.zeros((0, self.dim), np.float32))
+            new_entries[name] = e
+
+        same_content = (self.loaded and set(new_entries) == set(old_entries)
+                        and all(old_entries[n].get("sha1") == e["sha1"] for n, e in new_entries.items()))
+        gen = self.generation if same_content else uuid.uuid4().hex[:12]
+        meta = self._write_rows(new_entries, pending, gen)
+        if not same_content:
+            print(f"[store] {self.base_dir.name}：generation {gen}，{len(new_entries)} 張"
+                  f"（重算 {len(pending)} 張，資料 {meta['used']}/{meta['capacity']} 列）")
+        self._write_manifest(meta, new_entries, gen)
+        self._prune()
+
+    def _write_rows(self, entries: Dict[str, dict], pending: Dict[str, tuple], gen: str) -> dict:
+        """pending 的段落寫到 used 之後；放不下或空洞太多就整理成新檔。回傳新的 meta（不含 files）"""
+        need = sum(len(d) for _, d in pending.values())
+        live = sum(e["count"] for n, e in entries.items() if n not in pending)
+        meta = {k: self.meta[k] for k in ("des_file", "kp_file", "capacity", "used")} if self.loaded else None
+        if (meta is None or meta["used"] + need > meta["capacity"]
+                or meta["used"] - live > max(live, MIN_CAPACITY)):
+            return self._compact(entries, pending, live + need, gen)
+
+        kp_all = np.load(self.dir / meta["kp_file"], mmap_mode="r+")
+        des_all = np.load(self.dir / meta["des_file"], mmap_mode="r+")
+        used = meta["used"]
+        for name, (kp, des) in pending.items():
+            kp_all[used:used + len(des)] = kp
+            des_all[used:used + len(des)] = des
+            entries[name].update(start=used, count=int(len(des)))
+            used += len(des)
+        kp_all.flush()
+        des_all.flush()
+        del kp_all, des_all
+        return {**meta, "used": used}
+
+    def _compact(self, entries: Dict[str, dict], pending: Dict[str, tuple], rows: int, gen: str) -> dict:
+        """存活段落 + pending 依序複製到新檔（容量 = 兩倍），先寫暫存檔再換成 des.npy / kp.npy"""
+        capacity = max(MIN_CAPACITY, 2 * rows)
+        old = self._arrays() if self.loaded else None
+        # (新起始列, 來源)：來源是 pending 的新陣列，或舊檔裡的 (start, count)
+        layout, pos = [], 0
+        for name in sorted(entries):
+            e = entries[name]
+            src = pending[name] if name in pending else (e["start"], e["count"])
+            n = len(src[1]) if name in pending else e["count"]
+            layout.append((e, pos, n, src))
+            pos += n
+        names = {}
+        for col, (which, width) in enumerate((("kp", 3), ("des", self.dim))):
+            path = self.dir / f"{which}.npy"
+            tmp = tmp_path(path)
+            try:
+                arr = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(capacity, width))
+                for e, start, n, src in layout:
+                    arr[start:start + n] = src[col] if isinstance(src[0], np.ndarray) else \
+                        old[col][src[0]:src[0] + n]
+                arr.flush()
+                del arr
+                try:
+                    os.replace(tmp, path)
+                except PermissionError:      # Windows：des.npy 還被別的行程 mmap
+                    path = self.dir / f"{which}.{gen}.npy"
+                    os.replace(tmp, path)
+                names[which] = path.name
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+        for e, start, n, _ in layout:
+            e["start"], e["count"] = start, int(n)
+        self._data = None
+        return {"des_file": names["des"], "kp_file": names["kp"], "capacity": capacity, "used": pos}
+
+    def _write_manifest(self, meta: dict, entries: Dict[str, dict], gen: str):
+        files = sorted(entries.values(), key=lambda e: e["name"])
+        _save_npy(self.dir / OFFSETS_NAME,
+                  np.array([[e["start"], e["count"]] for e in files], np.int64).reshape(-1, 2))
+        _save_npy(self.dir / LABELS_NAME, np.array([e["area"] for e in files], dtype=str))
+        meta = {"layout": LAYOUT, "max_des": self.max_des, "dim": self.dim, "generation": gen,
+                **meta, "files": files}
+        atomic_write_bytes(self.dir / MANIFEST_NAME, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        self._load_manifest()
+
+    def _prune(self):
+        """
+        刪掉 manifest 已不引用的資料檔（整理後留下的 des.{gen}.npy、舊格式的 slots/）、放太久的 .tmp；
+        刪不掉的（Windows 仍被 mmap）下次再試
+        """
+        live = {self.meta["des_file"], self.meta["kp_file"], OFFSETS_NAME, LABELS_NAME}
+        now = time.time()
+        for p in list(self.dir.iterdir()) + list((self.dir / "slots").glob("*")):
+            try:
+                if p.suffix == ".tmp":
+                    stale = now - p.stat().st_mtime > STALE_TMP_SEC
+                else:
+                    stale = p.suffix == ".npy" and (p.parent != self.dir or p.name not in live)
+                if stale:
+                    p.unlink()
+            except OSError:
+                pass
+
+
+# -----------------------------
+# 以內容 sha1 為鍵的單張快取（給 sift_v1 融合用：參數與 store 不同，用 tag 區分）
+#   {image_dir}/_sift_store/by_hash/{sha1}.{tag}.kp.npy / .des.npy
+# 格式與 store 相同：kp Nx3 float32、des NxD float32，未壓縮、可 memory-map
+# 清理只看檔案本身（不讀資料夾裡其他圖）：命中時更新 mtime，每個 tag 依最近使用留 HASH_KEEP 份，
+#       超過 HASH_MAX_AGE_SEC 沒用過的也刪掉（圖被改寫後留下的孤兒最後都會走到這裡）
+# -----------------------------
+HASH_DIRNAME = "by_hash"
+HASH_KEEP = int(os.environ.get("SIFT_HASH_KEEP", "64"))                        # 每個 tag 保留幾份（最近使用）
+HASH_MAX_AGE_SEC = float(os.environ.get("SIFT_HASH_MAX_AGE_SEC", str(30 * 86400)))  # 多久沒用就刪
+
+_SHA1_MEMO: Dict[Tuple[str, int, int], str] = {}
+
+
+def cached_sha1(path: str) -> str:
+    """同一行程內 (path, mtime, size) 沒變就不重算 sha1"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), int(st.st_mtime_ns), int(st.st_size))
+    if key not in _SHA1_MEMO:
+        _SHA1_MEMO[key] = file_sha1(path)
+    return _SHA1_MEMO[key]
+
+
+def load_or_compute_by_hash(img_path: str, tag: str, compute_fn: ComputeFn,
+                            cache_dir: Optional[str] = None, dim: int = 128):
+    """回傳 (kp, des, hit)：hit 表示這次是否直接讀快取（沒有呼叫 compute_fn）"""
+    sha = cached_sha1(img_path)
+    cdir = Path(cache_dir) if cache_dir else Path(img_path).parent / STORE_DIRNAME / HASH_DIRNAME
+    kp_p, des_p = cdir / f"{sha}.{tag}.kp.npy", cdir / f"{sha}.{tag}.des.npy"
+    try:
+        if kp_p.exists() and des_p.exists():
+            kp, des = np.load(kp_p, mmap_mode="r"), np.load(des_p, mmap_mode="r")
+            try:
+                os.utime(kp_p)        # 最近使用：清理時依 kp 檔的 mtime 排序
+            except OSError:
+                pass
+            return kp, des, True
+    except Exception:
+        pass
+
+    kp, des = compute_fn(img_path)
+    kp = np.asarray(kp, dtype=np.float32).reshape(-1, 3)
+    des = np.zeros((0, dim), np.float32) if des is None else np.asarray(des, dtype=np.float32)
+    try:
+        cdir.mkdir(parents=True, exist_ok=True)
+        _save_npy(kp_p, kp)
+        _save_npy(des_p, des)
+        _prune_hash_cache(cdir, tag)
+    except Exception as e:
+        print(f"[store] 無法寫入特徵快取：{e}")
+    return kp, des, False
+
+
+def _prune_hash_cache(cdir: Path, tag: str, keep: int = HASH_KEEP, max_age: float = HASH_MAX_AGE_SEC):
+    now = time.time()
+    kps = sorted(cdir.glob(f"*.{tag}.kp.npy"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for i, p in enumerate(kps):
+        sha = p.name.split(".", 1)[0]
+        if i < keep and now - p.stat().st_mtime <= max_age:
+            continue
+        for q in (p, cdir / f"{sha}.{tag}.des.npy"):
+            try:
+                q.unlink()
+            except OSError:
+                pass
@@ -1,9 +1,36 @@
 # download_and_convert_segments.py
 
+import os
 import json
 import sys
+from datetime import datetime, timezone
+from pathlib import Path
 from supabase import create_client
-from latlng_to_pixel import convert_latlng_to_pixel
+from atomic_io import atomic_write_bytes
+from latlng_to_pixel import latlng_to_pixel_array
+from group_configs import group_latlng_map
+
+SHAPE_COLS = "group_id,segment_order,point_order,lat,lng"
+# --since 比對的欄位：要抓得到「原地修改」就得是每次更新都會變的欄位：
+#   alter table parking_shapes add column if not exists updated_at timestamptz default now();
+#   （再加一個 before update trigger 設 new.updated_at = now()）
+SHAPES_TS_COL = os.environ.get("SHAPES_TS_COL", "updated_at")
+PAGE_SIZE = 1000
+STATE_FILE = "_segments_state.json"   # 上次匯出時間 + 每個 group 的指紋（--since last）
+
+def _segments_from(seg_ids, point_orders, xs, ys):
+    """整理每個 segment 的起點與終點；只保留起終點都有的"""
+    segments = {}
+    for seg_id, point_order, x, y in zip(seg_ids, point_orders, xs, ys):
+        if point_order == 0:
+            segments.setdefault(seg_id, {})["start"] = {"x": x, "y": y}
+        elif point_order == 1:
+            segments.setdefault(seg_id, {})["end"] = {"x": x, "y": y}
+    return [
+        {"segment_id": seg_id, "start": pts["start"], "end": pts["end"]}
+        for seg_id, pts in segments.items()
+        if "start" in pts and "end" in pts
+    ]
 
 def download_and_convert_segments(supabase_url, anon_key, group_id, output_path):
     # 建立 Supabase client
@@ -11,41 +38,19 @@ def download_and_convert_segments(supabase_url, anon_key, group_id, output_path)
 
     # 從 Supabase 抓資料表 parking_shapes
     print(f"🔄 正在下載 group_id={group_id} 的 segment...")
-    response = supabase.table("parking_shapes").select("*").eq("group_id", group_id).execute()
+    response = supabase.table("parking_shapes").select(SHAPE_COLS).eq("group_id", group_id).execute()
     data = response.data
 
     if not data:
         print("找不到資料")
         return
 
-    # 整理每個 segment 的起點與終點
-    segments = {}
-    for row in data:
-        seg_id = int(row["segment_order"])
-        point_order = int(row["point_order"])
-        lat = float(row["lat"])
-        lng = float(row["lng"])
-
-        # 經緯度轉像素
-        x, y = convert_latlng_to_pixel(group_id, lat, lng)
-
-        if seg_id not in segments:
-            segments[seg_id] = {}
-
-        if point_order == 0:
-            segments[seg_id]["start"] = {"x": x, "y": y}
-        elif point_order == 1:
-            segments[seg_id]["end"] = {"x": x, "y": y}
+    # 經緯度轉像素：整欄 lat / lng 一次換算（與 _write_group 相同）
+    xs, ys = latlng_to_pixel_array([float(r["lat"]) for r in data], [float(r["lng"]) for r in data], group_id)
 
     # 整理結果成 JSON 格式
-    result = []
-    for seg_id, pts in segments.items():
-        if "start" in pts and "end" in pts:
-            result.append({
-                "segment_id": seg_id,
-                "start": pts["start"],
-                "end": pts["end"]
-            })
+    result = _segments_from([int(r["segment_order"]) for r in data], [int(r["point_order"]) for r in data],
+                            xs.tolist(), ys.tolist())
 
     # 輸出到 JSON 檔案
     with open(output_path, 'w', encoding='utf-8') as f:
@@ -53,15 +58,157 @@ def download_and_convert_segments(supabase_url, anon_key, group_id, output_path)
 
     print(f" 已輸出 segment JSON 至：{output_path}")
 
+# ===== 多 group 串流匯出 =====
+def _paged(make_query, page: int = PAGE_SIZE):
+    """make_query() 每次回傳新的 query builder；逐頁 yield，記憶體只留一頁"""
+    start = 0
+    while True:
+        chunk = make_query().range(start, start + page - 1).execute().data or []
+        yield from chunk
+        if len(chunk) < page:
+            return
+        start += page
+
+def group_fingerprints(supabase, group_ids=None) -> dict:
+    """
+    每個 group 的指紋 [列數, 最大 id, 最大 SHAPES_TS_COL]（只讀這三欄）：
+    新增（列數 / 最大 id 變）、刪除（列數變）、原地修改（時間欄變）都會讓指紋不同
+    """
+    def query():
+        q = supabase.table("parking_shapes").select(f"group_id,id,{SHAPES_TS_COL}").order("group_id").order("id")
+        return q.in_("group_id", sorted(group_ids)) if group_ids else q
+    fps = {}
+    for r in _paged(query):
+        gid = int(r["group_id"])
+        n, max_id, max_ts = fps.get(gid, (0, None, ""))
+        fps[gid] = (n + 1, r["id"] if max_id is None else max(max_id, r["id"]),
+                    max(max_ts, str(r.get(SHAPES_TS_COL) or "")))
+    return {gid: list(fp) for gid, fp in fps.items()}
+
+def changed_groups(supabase, since: str, group_ids=None) -> set:
+    """SHAPES_TS_COL 晚於 since 的 group（只讀 group_id 一欄）"""
+    def query():
+        q = supabase.table("parking_shapes").select("group_id").gt(SHAPES_TS_COL, since).order("group_id")
+        return q.in_("group_id", list(group_ids)) if group_ids else q
+    return {int(r["group_id"]) for r in _paged(query)}
+
+def _write_group(out_dir: Path, group_id: int, rows) -> int:
+    """一個 group 的列 → 批次換算像素 → 寫 segments_group_{id}.json（先寫暫存檔再 os.replace）"""
+    if group_id not in group_latlng_map:
+        print(f"⚠️ group_id={group_id} 不在 group_configs，略過 {len(rows)} 列")
+        return 0
+    xs, ys = latlng_to_pixel_array([float(r["lat"]) for r in rows], [float(r["lng"]) for r in rows], group_id)
+    result = _segments_from([int(r["segment_order"]) for r in rows], [int(r["point_order"]) for r in rows],
+                            xs.tolist(), ys.tolist())
+    out_path = out_dir / f"segments_group_{group_id}.json"
+    atomic_write_bytes(out_path, json.dumps(result, ensure_ascii=False, indent=2).encode("utf-8"))
+    print(f" group {group_id}：{len(result)} 個 segment → {out_path}")
+    return len(result)
+
+def _read_state(state_path: Path) -> dict:
+    try:
+        return json.loads(state_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def export_all_groups(supabase_url, anon_key, out_dir, group_ids=None, since=None):
+    """
+    一次匯出多個 group（預設全部）：單一分頁查詢、依 group_id 排序串流，
+    每讀完一個 group 就批次換算並寫檔，記憶體只留一個 group + 一頁。
+    since：
+      'last' → 與上次匯出時記下的每個 group 指紋比對（group_fingerprints），只重新匯出指紋變了的 group；
+               整個 group 被刪光的，刪掉它的 segments_group_{id}.json
+      ISO 時間 → 只看 SHAPES_TS_COL 晚於這個時間的 group（看不到刪除；要完整請用 last）
+    查不到指紋 / 時間欄（例如欄位不存在）就退回全部匯出。
+    """
+    supabase = create_client(supabase_url, anon_key)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    state_path = out_dir / STATE_FILE
+    state = _read_state(state_path)
+    started = datetime.now(timezone.utc).isoformat()
+    wanted = set(group_ids) if group_ids else None
+
+    # 匯出前先記指紋：匯出途中又有變動，下次指紋對不上會再匯出一次（不會漏）
+    try:
+        fps = group_fingerprints(supabase, wanted)
+    except Exception as e:
+        print(f"⚠️ 無法讀 parking_shapes 的 id / {SHAPES_TS_COL}，不記錄 group 指紋：{e}")
+        fps = None
+
+    targets, removed = wanted, set()
+    prev = state.get("groups")
+    if since == "last" and fps is not None and isinstance(prev, dict):
+        prev = {int(g): fp for g, fp in prev.items()}
+        targets = {g for g, fp in fps.items() if prev.get(g) != fp}
+        removed = {g for g in prev if g not in fps and (wanted is None or g in wanted)}
+        print(f"🔄 指紋有變動的 group：{sorted(targets) or '無'}；已刪除：{sorted(removed) or '無'}")
+    elif since and since != "last":
+        try:
+            targets = changed_groups(supabase, since, wanted)
+            print(f"🔄 {since} 之後有變動的 group：{sorted(targets) or '無'}")
+        except Exception as e:
+            # 例如表上沒有 SHAPES_TS_COL 欄位：退回全部匯出，不要整個失敗
+            print(f"⚠️ 無法依 {SHAPES_TS_COL} 篩選變動的 group，改為全部匯出：{e}")
+    elif since == "last":
+        print("⚠️ 沒有可比對的 group 指紋（沒匯出過或讀不到指紋），全部匯出")
+
+    counts = {}
+    if targets is None or targets:
+        def query():
+            q = supabase.table("parking_shapes").select(SHAPE_COLS)
+            if targets:
+                q = q.in_("group_id", sorted(targets))
+            return q.order("group_id").order("segment_order").order("point_order")
+
+        cur_gid, buf = None, []
+        for row in _paged(query):
+            gid = int(row["group_id"])
+            if gid != cur_gid and buf:
+                counts[cur_gid] = _write_group(out_dir, cur_gid, buf)
+                buf = []
+            cur_gid = gid
+            buf.append(row)
+        if buf:
+            counts[cur_gid] = _write_group(out_dir, cur_gid, buf)
+
+    for gid in sorted(removed):
+        try:
+            (out_dir / f"segments_group_{gid}.json").unlink()
+            print(f" group {gid}：已無任何 shape，刪除輸出檔")
+        except OSError:
+            pass
+
+    new_state = {"exported_at": started}
+    if fps is not None:
+        groups = {} if wanted is None else {int(g): fp for g, fp in (state.get("groups") or {}).items()
+                                            if int(g) not in wanted}
+        groups.update(fps)
+        new_state["groups"] = {str(g): fp for g, fp in sorted(groups.items())}
+    atomic_write_bytes(state_path, json.dumps(new_state).encode("utf-8"))
+    print(f" 已匯出 {len(counts)} 個 group 至：{out_dir}")
+    return counts
+
 # ===== 主程式入口 =====
-if __name__ == '__main__':
-    if len(sys.argv) < 5:
-        print("用法：python download_and_convert_segments.py <SUPABASE_URL> <ANON_KEY> <GROUP_ID> <OUTPUT_PATH>")
-        sys.exit(1)
+USAGE = """用法：python {prog} <SUPABASE_URL> <ANON_KEY> <GROUP_ID> <OUTPUT_PATH>
+      python {prog} --all <SUPABASE_URL> <ANON_KEY> <OUT_DIR> [--groups 1,2] [--since ISO|last]"""
 
-    supabase_url = sys.argv[1]
-    anon_key = sys.argv[2]
-    group_id = int(sys.argv[3])
-    output_path = sys.argv[4]
+def main(argv, prog: str = "download_and_convert_segments.py") -> int:
+    """argv 不含程式名稱；draw_red_dots_on_map.py 也走這裡"""
+    # --all <URL> <KEY> <OUT_DIR> [--groups 1,2] [--since ISO|last]
+    if len(argv) >= 4 and argv[0] == "--all":
+        opts = dict(zip(argv[4::2], argv[5::2]))
+        groups = [int(g) for g in opts["--groups"].split(",")] if "--groups" in opts else None
+        export_all_groups(argv[1], argv[2], argv[3], groups, opts.get("--since"))
+        return 0
 
-    download_and_convert_segments(supabase_url, anon_key, group_id, output_path)
\ No newline at end of file
+    if len(argv) != 4:
+        print(USAGE.format(prog=prog))
+        return 1
+
+    supabase_url, anon_key, group_id, output_path = argv[0], argv[1], int(argv[2]), argv[3]
+    download_and_convert_segments(supabase_url, anon_key, group_id, output_path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -42,11 +42,15 @@
 
 
 import os
+import json
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Dict
 import cv2
 import numpy as np
 
+from atomic_io import atomic_savez, file_lock, tmp_path
+from descriptor_store import DescriptorStore, _stat_key
+
 # -----------------------------
 # 限制執行緒，避免吃滿 CPU
 # -----------------------------
@@ -71,6 +75,20 @@ NFEATURES  = int(os.environ.get("SIFT_NFEATURES",  "2000"))   # SIFT 特徵數
 RATIO      = float(os.environ.get("SIFT_RATIO",     "0.75"))  # Lowe ratio
 MAX_DES    = int(os.environ.get("SIFT_MAX_DES",    "4000"))   # 每張最多使用多少描述子（加速）
 
+# 近似最近鄰索引（FLANN KD-forest），0 = 退回逐張 BFMatcher
+USE_INDEX     = os.environ.get("SIFT_USE_INDEX", "1") != "0"
+INDEX_TREES   = int(os.environ.get("SIFT_INDEX_TREES",  "4"))    # KD 樹數量
+INDEX_CHECKS  = int(os.environ.get("SIFT_INDEX_CHECKS", "64"))   # 查詢時走訪的葉節點數
+INDEX_KNN     = int(os.environ.get("SIFT_INDEX_KNN",    "8"))    # 每個查詢描述子取幾個鄰居來投票
+INDEX_NAME    = "_kp_index"                                      # {base_dir}/_kp_index.npz + .flann
+
+# 詞袋粗篩：候選超過 K 張時先用 visual_vocab 取前 K 張，再做 ratio test；0 = 關閉
+SHORTLIST_K   = int(os.environ.get("SIFT_SHORTLIST_K",  "10"))
+
+# 上傳粗分類（auto_process 略過舊上傳用）：詞袋 top-1，不走 FLANN 投票；
+# SIFT 設定與底圖相同（MAX_WIDTH / NFEATURES），量化到的詞才與詞彙表的訓練資料一致
+PRECLASS_MARGIN   = float(os.environ.get("PRECLASS_MARGIN",  "1.2"))  # top-1 區分數 / 次佳區分數
+
 _SIFT = cv2.SIFT_create(nfeatures=NFEATURES)
 _BF   = cv2.BFMatcher(cv2.NORM_L2, crossCheck=False)
 
@@ -96,38 +114,47 @@ def _compute_sift(img: np.ndarray):
     return kp, des
 
 
-def _cache_path_for(img_path: str) -> str:
-    return img_path + ".sift.npz"
+def _compute_sift_arrays(img_path: str):
+    """讀圖 + SIFT，關鍵點轉成 Nx3 (x, y, size) 陣列（給 descriptor_store 用）"""
+    kp, des = _compute_sift(_read_gray_resized(img_path))
+    n = 0 if des is None else len(des)
+    kparr = np.array([[k.pt[0], k.pt[1], k.size] for k in kp[:n]], dtype=np.float32).reshape(-1, 3)
+    return kparr, des
+
+
+_STORES: Dict[str, DescriptorStore] = {}   # base_dir -> DescriptorStore
+
+
+def _store_for(base_dir: Path) -> DescriptorStore:
+    key = str(base_dir)
+    if key not in _STORES:
+        _STORES[key] = DescriptorStore(base_dir, _compute_sift_arrays, MAX_DES,
+                                       area_fn=_area_from_filename)
+    return _STORES[key]
 
 
 def _load_or_compute_sift(img_path: str):
     """
-    快取：{image}.sift.npz
-      - kp: Nx3 (x, y, size)
-      - des: SIFT 描述子 (float32)
+    從 {base_dir}/_sift_store 取 (kp Nx3, des) 的 memory-map view；
+    底圖有變動時先同步整個目錄（只重算變動的那幾張）。
+    不屬於底圖庫的檔案直接現算、不快取。
     """
-    cpath = _cache_path_for(img_path)
-    try:
-        if os.path.exists(cpath) and os.path.getmtime(cpath) >= os.path.getmtime(img_path):
-            data = np.load(cpath, allow_pickle=True)
-            kparr = data["kp"]
-            kp = [cv2.KeyPoint(x=float(x), y=float(y), _size=float(s)) for (x, y, s) in kparr]
-            des = data["des"]
-            return kp, des
-    except Exception:
-        pass
-
-    img = _read_gray_resized(img_path)
-    kp, des = _compute_sift(img)
+    base_dir = Path(img_path).parent
+    store = _store_for(base_dir)
+    kp, des = store.get(img_path)
+    if kp is not None:
+        return kp, des
 
-    try:
-        if des is not None:
-            kparr = np.array([[k.pt[0], k.pt[1], k.size] for k in kp], dtype=np.float32)
-            np.savez_compressed(cpath, kp=kparr, des=des)
-    except Exception:
-        pass
+    candidates = _collect_candidates(base_dir)
+    if os.path.abspath(img_path) in {os.path.abspath(p) for p in candidates}:
+        try:
+            kp, des = store.sync(candidates).get(img_path)
+            if kp is not None:
+                return kp, des
+        except Exception as e:
+            print(f"[store] 同步失敗，改為直接計算：{e}")
 
-    return kp, des
+    return _compute_sift_arrays(img_path)
 
 
 def _score_pair(query_des, base_des) -> float:
@@ -139,6 +166,169 @@ def _score_pair(query_des, base_des) -> float:
     return float(len(good))
 
 
+# -----------------------------
+# 近似最近鄰索引（每個 location 一份）
+#   {base_dir}/_kp_index.npz          des / labels / key（底圖清單 + store generation）/ flann 檔名
+#   {base_dir}/_kp_index.{gen}.flann  KD-forest
+# 兩個檔都先寫唯一暫存檔再 os.replace；重建以 _kp_index.lock 跨行程互斥
+# -----------------------------
+_INDEX_MEMO: Dict[str, dict] = {}   # base_dir -> 已載入的索引（同一行程內重用）
+_KEY_MEMO: Dict[str, tuple] = {}    # base_dir -> (底圖目錄的 stat + 底圖清單, _store_key)
+
+
+def _store_key(base_dir: Path, candidates: List[str]) -> dict:
+    """
+    (底圖清單, store generation, max_des, dim) 當索引 / 倒排檔的版本。
+    底圖一律暫存檔 + os.replace 寫入（sift_v1.atomic_imwrite），新增 / 替換 / 刪除都會改到目錄的 mtime：
+    目錄沒變就沿用上次的 key，每次查詢只 stat 一次目錄；變了才把 store 同步到 candidates（逐張 stat）
+    """
+    stamp = (_stat_key(base_dir), [os.path.basename(p) for p in candidates])
+    memo = _KEY_MEMO.get(str(base_dir))
+    if memo is not None and stamp[0] is not None and memo[0] == stamp:
+        return memo[1]
+    store = _store_for(base_dir).sync(candidates)
+    key = {"names": stamp[1], "generation": store.generation,
+           "max_des": store.max_des, "dim": store.dim}
+    _KEY_MEMO[str(base_dir)] = (stamp, key)
+    return key
+
+
+def _build_index(base_dir: Path, candidates: List[str], key: dict) -> dict:
+    des_list, labels = [], []
+    for ci, p in enumerate(candidates):
+        try:
+            _, des = _load_or_compute_sift(p)
+        except Exception as e:
+            print(f"[index] 略過 {p}: {e}")
+            continue
+        if des is None or len(des) == 0:
+            continue
+        des_list.append(np.asarray(des, dtype=np.float32))
+        labels.append(np.full(len(des), ci, dtype=np.int32))
+
+    if not des_list:
+        return {"flann": None, "labels": np.zeros(0, np.int32),
+                "candidates": candidates, "key": key}
+
+    des = np.ascontiguousarray(np.vstack(des_list))
+    lab = np.concatenate(labels)
+
+    flann = cv2.flann.Index()
+    flann.build(des, dict(algorithm=1, trees=INDEX_TREES))   # 1 = FLANN_INDEX_KDTREE
+
+    flann_name = f"{INDEX_NAME}.{key['generation']}.flann"
+    try:
+        tmp = tmp_path(base_dir / flann_name)
+        flann.save(str(tmp))
+        os.replace(tmp, base_dir / flann_name)
+        atomic_savez(base_dir / f"{INDEX_NAME}.npz", des=des, labels=lab,
+                     key=np.array(json.dumps(key)), flann_file=np.array(flann_name))
+        _prune_index_files(base_dir, flann_name)
+    except Exception as e:
+        print(f"[index] 無法寫入索引檔：{e}")
+
+    print(f"[index] 已重建 {base_dir.name}：{len(candidates)} 張 / {len(des)} 個描述子"
+          f"（store generation {key['generation']}）")
+    return {"flann": flann, "des": des, "labels": lab,
+            "candidates": candidates, "key": key}
+
+
+def _prune_index_files(base_dir: Path, current: str):
+    """舊的 .flann 已沒有 npz 指向它；刪不掉（別的行程還開著）就留到下次"""
+    for p in base_dir.glob(f"{INDEX_NAME}*.flann"):
+        if p.name != current:
+            try:
+                p.unlink()
+            except OSError:
+                pass
+
+
+def _read_index_file(base_dir: Path, candidates: List[str], key: dict) -> Optional[dict]:
+    npz_path = base_dir / f"{INDEX_NAME}.npz"
+    if not npz_path.exists():
+        return None
+    with np.load(npz_path) as data:
+        if "key" not in data.files or json.loads(str(data["key"])) != key:
+            return None
+        flann_path = base_dir / str(data["flann_file"])
+        des = np.ascontiguousarray(data["des"], dtype=np.float32)
+        labels = data["labels"]
+    flann = cv2.flann.Index()
+    if not flann_path.exists() or not flann.load(des, str(flann_path)):
+        return None
+    return {"flann": flann, "des": des, "labels": labels,
+            "candidates": candidates, "key": key}
+
+
+def _load_index(base_dir: Path, candidates: List[str]) -> dict:
+    """
+    取得 {base_dir} 的描述子索引：
+      - 同一行程內已載入且 key（底圖清單 + store generation）沒變 → 直接用
+        （底圖目錄沒變時 key 不重算，不會逐張 stat 底圖）
+      - 索引檔的 key 相同 → 從檔案載入
+      - 否則拿鎖後再確認一次（別的行程可能剛建好），還是舊的才重建並寫檔
+    """
+    memo_key = str(base_dir)
+    key = _store_key(base_dir, candidates)
+
+    memo = _INDEX_MEMO.get(memo_key)
+    if memo is not None and memo["key"] == key:
+        return memo
+
+    idx = None
+    try:
+        idx = _read_index_file(base_dir, candidates, key)
+    except Exception as e:
+        print(f"[index] 索引檔讀取失敗，改為重建：{e}")
+
+    if idx is None:
+        with file_lock(base_dir / f"{INDEX_NAME}.lock"):
+            try:
+                idx = _read_index_file(base_dir, candidates, key)
+            except Exception:
+                idx = None
+            if idx is None:
+                idx = _build_index(base_dir, candidates, key)
+
+    _INDEX_MEMO[memo_key] = idx
+    return idx
+
+
+def _vote_candidates(query_des, idx: dict) -> np.ndarray:
+    """
+    一次 knnSearch，對每張候選底圖各自做 Lowe ratio test 投票。
+    鄰居依距離排序；某候選在 k 個鄰居中只出現一次時，
+    其第二近鄰必定不小於第 k 個鄰居 → 以 d_k 當保守的 d2。
+    回傳：每個候選的 good match 數（與 _score_pair 同義）
+    """
+    n_cand = len(idx["candidates"])
+    scores = np.zeros(n_cand, dtype=np.float64)
+    labels = idx["labels"]
+    if query_des is None or idx["flann"] is None or len(labels) < 2:
+        return scores
+
+    k = min(INDEX_KNN, len(labels))
+    nn, d2 = idx["flann"].knnSearch(np.asarray(query_des, dtype=np.float32), k,
+                                    params=dict(checks=INDEX_CHECKS))
+    dist = np.sqrt(np.maximum(d2, 0))      # KD-tree 回傳平方 L2
+    lab = labels[nn]                        # (Q, k)
+    rows = np.arange(len(lab))
+    d_last = dist[:, -1]
+
+    for ci in np.unique(lab):
+        mask = lab == ci
+        cum = np.cumsum(mask, axis=1)
+        has1 = cum[:, -1] >= 1
+        has2 = cum[:, -1] >= 2
+        first = np.argmax(mask, axis=1)
+        second = np.argmax(cum >= 2, axis=1)
+        d1 = dist[rows, first]
+        d2nd = np.where(has2, dist[rows, second], d_last)
+        good = has1 & (d1 < RATIO * d2nd)
+        scores[ci] = float(good.sum())
+    return scores
+
+
 # -----------------------------
 # 候選收集 & 檔名解析
 # -----------------------------
@@ -188,6 +378,72 @@ def infer_area_by_kp(query_path: str, base_root: str, location: str) -> Optional
     q_img = _read_gray_resized(query_path)
     _, q_des = _compute_sift(q_img)
 
+    # 詞袋粗篩有效（真的刪掉候選）→ 只對這 K 張做精確的 ratio test；否則走 location 索引
+    if SHORTLIST_K > 0 and len(candidates) > SHORTLIST_K:
+        try:
+            import visual_vocab   # 延遲載入：visual_vocab 反過來會用到本模組
+            short = visual_vocab.shortlist(q_des, base_root, base_dir, candidates, SHORTLIST_K)
+            if len(short) < len(candidates):
+                return _infer_bruteforce(q_des, short)
+        except Exception as e:
+            print(f"[infer] 詞袋粗篩失敗，改用全部候選：{e}")
+
+    if USE_INDEX:
+        try:
+            return _infer_with_index(q_des, base_dir, candidates)
+        except Exception as e:
+            print(f"[infer] 索引比對失敗，改用逐張比對：{e}")
+
+    return _infer_bruteforce(q_des, candidates)
+
+
+def predict_area(query_path: str, base_root: str, location: str) -> Optional[str]:
+    """
+    便宜的區域預測：與底圖相同設定的 SIFT → 詞袋分數取 top-1 區（每區取該區底圖的最高分）。
+    top-1 沒有比次佳的其他區高出 PRECLASS_MARGIN 倍、或沒有詞彙表，就回 None（呼叫端照常完整推論）
+    """
+    base_dir = Path(base_root) / f"{location}_base_images"
+    candidates = _collect_candidates(base_dir) if base_dir.exists() else []
+    if not candidates:
+        return None
+    import visual_vocab   # 延遲載入：visual_vocab 反過來會用到本模組
+    vocab = visual_vocab.load_vocabulary(base_root)
+    if vocab is None:
+        return None
+
+    _, q_des = _compute_sift(_read_gray_resized(query_path))
+    if q_des is None:
+        return None
+    idx = visual_vocab.load_bow_index(base_dir, candidates, vocab)
+    best: Dict[str, float] = {}
+    for p, sc in zip(candidates, visual_vocab.score_candidates(q_des, idx, vocab)):
+        area = _area_from_filename(p)
+        best[area] = max(best.get(area, 0.0), float(sc))
+
+    ranked = sorted(best.items(), key=lambda kv: -kv[1])
+    if ranked[0][1] <= 0:
+        return None
+    if len(ranked) > 1 and ranked[0][1] < PRECLASS_MARGIN * ranked[1][1]:
+        return None
+    return ranked[0][0]
+
+
+def _infer_with_index(q_des, base_dir: Path, candidates: List[str]) -> Optional[str]:
+    idx = _load_index(base_dir, candidates)
+    scores = _vote_candidates(q_des, idx)
+
+    best_score, best_area = -1.0, None
+    for p, sc in zip(candidates, scores):
+        area = _area_from_filename(p)
+        print(f"[infer] {area} score={sc}")
+        if sc > best_score:
+            best_score, best_area = float(sc), area
+
+    print(f"[infer] best = {best_area} (score={best_score}, index)")
+    return best_area
+
+
+def _infer_bruteforce(q_des, candidates: List[str]) -> Optional[str]:
     best_score, best_area = -1.0, None
     for p in candidates:
         try:
@@ -204,6 +460,81 @@ def infer_area_by_kp(query_path: str, base_root: str, location: str) -> Optional
     return best_area
 
 
+def list_areas(base_root: str, location: str) -> List[str]:
+    """該 location 底圖庫裡所有的區代號（A01 / B02 ...）"""
+    base_dir = Path(base_root) / f"{location}_base_images"
+    if not base_dir.exists():
+        return []
+    return sorted({_area_from_filename(p) for p in _collect_candidates(base_dir)})
+
+
+# -----------------------------
+# 多行程批次推論（每個行程 OpenCV/BLAS 只用 1 執行緒，用行程數吃滿多核）
+# -----------------------------
+def _pool_init(warm: List[Tuple[str, str]]):
+    """先把每個 location 的描述子庫 / 索引載好；store 是 memory-map，各行程共用 page cache"""
+    for base_root, location in warm:
+        base_dir = Path(base_root) / f"{location}_base_images"
+        cands = _collect_candidates(base_dir) if base_dir.exists() else []
+        if not cands:
+            continue
+        for p in cands:
+            _load_or_compute_sift(p)
+        if USE_INDEX:
+            _load_index(base_dir, cands)
+        if SHORTLIST_K > 0 and len(cands) > SHORTLIST_K:
+            import visual_vocab   # 底圖有變時由主行程先重新訓練，worker 只讀檔
+            visual_vocab.load_vocabulary(base_root)
+
+
+def _infer_job(job):
+    key, query_path, base_root, location = job
+    try:
+        return key, infer_area_by_kp(query_path, base_root, location), None
+    except Exception as e:
+        return key, None, f"{type(e).__name__}: {e}"
+
+
+def make_pool(warm: List[Tuple[str, str]], workers: int):
+    """建立可跨多批重用的行程池（主行程先同步 store / 索引）"""
+    from concurrent.futures import ProcessPoolExecutor
+    _pool_init(warm)
+    return ProcessPoolExecutor(max_workers=workers, initializer=_pool_init, initargs=(warm,))
+
+
+def infer_many(jobs: List[Tuple], workers: int = 1, executor=None) -> Dict:
+    """
+    jobs: [(key, query_path, base_root, location), ...]
+    回傳 {key: area 或 None}；workers > 1 時用 ProcessPoolExecutor 平行推論，
+    有給 executor（make_pool）就直接用它
+    """
+    if not jobs:
+        return {}
+    warm = sorted({(str(j[2]), j[3]) for j in jobs})
+    # 每批都由主行程先同步 store / 索引檔（有給 executor 也一樣：常駐池建立時不知道之後會來哪些
+    # location，底圖也可能在兩批之間更新），worker 只需要唯讀開檔，不會搶著重建
+    _pool_init(warm)
+    if executor is not None:
+        return _collect_results(executor.map(_infer_job, jobs))
+
+    if workers <= 1 or len(jobs) == 1:
+        results = map(_infer_job, jobs)
+        return _collect_results(results)
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=_pool_init, initargs=(warm,)) as ex:
+        return _collect_results(ex.map(_infer_job, jobs))
+
+
+def _collect_results(results) -> Dict:
+    out = {}
+    for key, area, err in results:
+        if err:
+            print(f"[infer] {key} 推論失敗：{err}")
+        out[key] = area
+    return out
+
+
 # -----------------------------
 # 舊名相容（保留函式名，實作用 SIFT）
 # -----------------------------
@@ -0,0 +1,301 @@
+# inference_worker.py
+"""
+常駐推論 worker：stdin/stdout 一行一個 JSON（JSON-lines）
+
+  啟動後輸出： {"event": "ready", "startup_ms": ...}
+  請求：       {"id": 1, "op": "infer_area", "args": {...}}
+  回應：       {"id": 1, "ok": true, "result": ..., "ms": ...}
+              {"id": 1, "ok": false, "error": "...", "ms": ...}
+
+op：
+  ping        {}                                           -> "pong"
+  infer_area  {query_path, base_root, location}            -> 'A01' / None
+              （也接受舊介面 processed_images_dir，直接轉給 infer_location_clip）
+  fuse        {base_path, upload_path, out_path, feature_source?, latest?}  -> out_path / None
+  fuse_batch  {base_path, upload_paths, out_path, feature_source?, latest?} -> 成功融合張數
+              （feature_source：底圖的不變來源圖，底圖特徵從它的快取取；
+               latest：out_path 已存在就疊在它上面，否則照給的 base_path）
+  ocr         {image_path, save_path?}                     -> [{text, conf, center}]
+  ocr_plates  {image_path, plate_boxes, pad?}              -> 只辨識車牌框，格式同 ocr
+  detect      {image_path, base_cfg_dir, ocr_json_path}    -> based_mark 的結果 list
+  detect_batch {items: [[image, base_cfg_dir, ocr_json], ...]} -> {image: 結果 list 或 None}
+  pipeline    {items: [[image, base_cfg_dir], ...], ocr_mode?, debug_json?}
+                                                           -> 解碼一次、偵測 + OCR 都在記憶體，{image: 結果}
+
+SIFT、底圖描述子（descriptor_store / 索引）、PaddleOCR、YOLO 都只在這個行程載入一次。
+各模組的 print 一律導到 stderr，stdout 只留給協定。
+"""
+import os
+import sys
+import json
+import time
+import queue
+import subprocess
+import threading
+import contextlib
+from pathlib import Path
+from typing import List, Optional
+
+MARK_DIR = Path(__file__).resolve().parent
+ROOT_DIR = MARK_DIR.parent
+for _p in (str(MARK_DIR), str(ROOT_DIR)):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+_T0 = time.perf_counter()
+
+# WorkerClient 的時限（與 server/inferenceWorker.ts 同名的環境變數，單位 ms）；
+# auto_process 一次呼叫就是整批偵測 / OCR，呼叫時限預設比 TS 端長
+READY_TIMEOUT_SEC = float(os.environ.get("WORKER_READY_TIMEOUT_MS", "120000")) / 1000
+CALL_TIMEOUT_SEC = float(os.environ.get("WORKER_CALL_TIMEOUT_MS", "600000")) / 1000
+
+import infer_location   # noqa: E402  SIFT 與底圖描述子庫
+
+_OCR = None       # ocr 模組（import 時建立 PaddleOCR）
+_MODELS = None    # based_mark.load_models() 的 (機車, 車牌)
+_SIFT_V1 = None
+
+
+def _ocr_module():
+    global _OCR
+    if _OCR is None:
+        import ocr
+        _OCR = ocr
+    return _OCR
+
+
+def _detect_models():
+    global _MODELS
+    if _MODELS is None:
+        import based_mark
+        _MODELS = (based_mark, based_mark.load_models())
+    return _MODELS
+
+
+def _fusion_module():
+    global _SIFT_V1
+    if _SIFT_V1 is None:
+        import sift_v1
+        _SIFT_V1 = sift_v1
+    return _SIFT_V1
+
+
+# -----------------------------
+# op 實作
+# -----------------------------
+def op_ping(**_):
+    return "pong"
+
+
+def op_infer_area(query_path: str, base_root: Optional[str] = None,
+                  location: Optional[str] = None, **kwargs):
+    if base_root and location:
+        return infer_location.infer_area_by_kp(query_path, base_root, location)
+    return infer_location.infer_location_clip(query_path, base_root, location, **kwargs)
+
+
+def op_fuse(base_path: str, upload_path: str, out_path: str, feature_source: Optional[str] = None,
+            latest: bool = False):
+    ok = _fusion_module().fuse_into(base_path, upload_path, out_path, feature_source=feature_source,
+                                    latest=latest)
+    return out_path if ok else None
+
+
+def op_fuse_batch(base_path: str, upload_paths: List[str], out_path: str,
+                  feature_source: Optional[str] = None, latest: bool = False):
+    return _fusion_module().fuse_batch(base_path, upload_paths, out_path, feature_source=feature_source,
+                                       latest=latest)
+
+
+def op_ocr(image_path: str, save_path: Optional[str] = None):
+    mod = _ocr_module()
+    if save_path:
+        return mod.run_ocr(image_path, save_path)
+    return mod.ocr_image(image_path)
+
+
+def op_ocr_plates(image_path: str, plate_boxes: List[list], pad: Optional[float] = None):
+    mod = _ocr_module()
+    return mod.ocr_plate_crops(image_path, plate_boxes, mod.PLATE_PAD if pad is None else pad)
+
+
+def op_detect(image_path: str, base_cfg_dir: str, ocr_json_path: str):
+    based_mark, models = _detect_models()
+    return based_mark.run_detection_and_draw(image_path, base_cfg_dir, ocr_json_path, models=models)
+
+
+def op_detect_batch(items: List[list]):
+    based_mark, models = _detect_models()
+    return based_mark.run_detection_batch([tuple(x) for x in items], models=models)
+
+
+def op_pipeline(items: List[list], ocr_mode: Optional[str] = None, debug_json: Optional[bool] = None):
+    based_mark, models = _detect_models()
+    return based_mark.analyze_images([tuple(x) for x in items], models=models,
+                                     ocr_mode=ocr_mode, debug_json=debug_json)
+
+
+OPS = {
+    "ping": op_ping,
+    "infer_area": op_infer_area,
+    "fuse": op_fuse,
+    "fuse_batch": op_fuse_batch,
+    "ocr": op_ocr,
+    "ocr_plates": op_ocr_plates,
+    "detect": op_detect,
+    "detect_batch": op_detect_batch,
+    "pipeline": op_pipeline,
+}
+
+
+def warm(base_root: Optional[str], locations: List[str], preload: List[str]):
+    """啟動時先把底圖描述子與模型載好，第一個請求就不用等"""
+    for loc in (locations if base_root else []):
+        base_dir = Path(base_root) / f"{loc}_base_images"
+        cands = infer_location._collect_candidates(base_dir) if base_dir.exists() else []
+        if not cands:
+            continue
+        for p in cands:
+            infer_location._load_or_compute_sift(p)
+        if infer_location.USE_INDEX:
+            infer_location._load_index(base_dir, cands)
+    if "ocr" in preload:
+        _ocr_module()
+    if "detect" in preload:
+        _detect_models()
+    if "fuse" in preload:
+        _fusion_module()
+
+
+def serve(stdin=sys.stdin, stdout=sys.stdout):
+    def emit(obj):
+        stdout.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        stdout.flush()
+
+    emit({"event": "ready", "startup_ms": round((time.perf_counter() - _T0) * 1000, 1)})
+
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        t0 = time.perf_counter()
+        req_id = None
+        try:
+            req = json.loads(line)
+            req_id = req.get("id")
+            fn = OPS.get(req.get("op"))
+            if fn is None:
+                raise ValueError(f"未知的 op：{req.get('op')}")
+            with contextlib.redirect_stdout(sys.stderr):
+                result = fn(**(req.get("args") or {}))
+            emit({"id": req_id, "ok": True, "result": result,
+                  "ms": round((time.perf_counter() - t0) * 1000, 1)})
+        except Exception as e:
+            emit({"id": req_id, "ok": False, "error": f"{type(e).__name__}: {e}",
+                  "ms": round((time.perf_counter() - t0) * 1000, 1)})
+
+
+# -----------------------------
+# 給 auto_process 等 Python 端用的 client
+# -----------------------------
+class WorkerTimeout(TimeoutError):
+    """worker 在時限內沒回應；該 worker 已被 kill，下一次 call 會重新啟動"""
+
+
+class WorkerClient:
+    """
+    啟動一個常駐 worker 並同步呼叫：
+        w = WorkerClient(); w.call("infer_area", query_path=..., base_root=..., location=...)
+    cmd 可指定 conda 環境，例如
+        ["conda", "run", "--no-capture-output", "-n", "yolo_paddle", "python", "-u", ".../inference_worker.py"]
+    （conda run 沒加 --no-capture-output 會把 stdout 攔到結束才吐，worker 就收不到回應）
+    啟動 / 呼叫超過時限就 kill 掉 worker 並丟 WorkerTimeout（與 server/inferenceWorker.ts 相同的環境變數）；
+    呼叫端不要吞掉它，auto_daemon 才會走重試
+    """
+
+    def __init__(self, cmd: Optional[List[str]] = None, extra_args: Optional[List[str]] = None,
+                 ready_timeout: float = READY_TIMEOUT_SEC, call_timeout: float = CALL_TIMEOUT_SEC):
+        self.cmd = (cmd or [sys.executable, "-u", str(Path(__file__).resolve())]) + (extra_args or [])
+        self.ready_timeout, self.call_timeout = ready_timeout, call_timeout
+        self.proc = None
+        self._next_id = 0
+        self._spawn()
+
+    def _spawn(self):
+        t0 = time.perf_counter()
+        env = {**os.environ, "PYTHONIOENCODING": "utf-8"}
+        self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     text=True, encoding="utf-8", env=env)
+        # readline() 沒有逾時：另開執行緒讀 stdout，_read 從佇列等
+        self._lines: "queue.Queue" = queue.Queue()
+        threading.Thread(target=self._pump, args=(self.proc.stdout, self._lines), daemon=True).start()
+        ready = self._read(self.ready_timeout, "啟動")
+        self.spawn_ms = (time.perf_counter() - t0) * 1000
+        self.startup_ms = ready.get("startup_ms")
+
+    @staticmethod
+    def _pump(stdout, lines: "queue.Queue"):
+        for line in stdout:
+            lines.put(line)
+        lines.put(None)   # EOF
+
+    def _kill(self):
+        proc, self.proc = self.proc, None
+        if proc is not None:
+            try:
+                proc.kill()
+                proc.wait(timeout=10)
+            except Exception:
+                pass
+
+    def _read(self, timeout: float, what: str) -> dict:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                line = self._lines.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self._kill()
+                raise WorkerTimeout(f"inference worker {what}逾時（{timeout:.0f} s）")
+            if line is None:
+                self._kill()
+                raise RuntimeError("inference worker 已結束")
+            line = line.strip()
+            if line.startswith("{"):
+                return json.loads(line)
+
+    def call(self, op: str, timeout: Optional[float] = None, **args):
+        if self.proc is None:      # 上次逾時 / 結束後重新啟動
+            self._spawn()
+        self._next_id += 1
+        self.proc.stdin.write(json.dumps({"id": self._next_id, "op": op, "args": args},
+                                         ensure_ascii=False) + "\n")
+        self.proc.stdin.flush()
+        resp = self._read(self.call_timeout if timeout is None else timeout, f"呼叫 {op} ")
+        if not resp.get("ok"):
+            raise RuntimeError(resp.get("error"))
+        return resp.get("result")
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=10)
+        except Exception:
+            self.proc.kill()
+
+
+def _parse_args(argv: List[str]):
+    import argparse
+    ap = argparse.ArgumentParser(description="ParkSavvy 常駐推論 worker（JSON-lines）")
+    ap.add_argument("--base-root", default=os.environ.get("BASE_IMAGES_ROOT"))
+    ap.add_argument("--warm", action="append", default=[], help="啟動時預載的 location，可重複")
+    ap.add_argument("--preload", default="", help="逗號分隔：ocr,detect,fuse")
+    return ap.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = _parse_args(sys.argv[1:])
+    with contextlib.redirect_stdout(sys.stderr):
+        warm(args.base_root, args.warm, [s for s in args.preload.split(",") if s])
+    serve()
@@ -1,4 +1,6 @@
 # latlng_to_pixel.py
+import numpy as np
+
 from group_configs import group_latlng_map
 
 # -------- 共享公式 --------
@@ -13,12 +15,44 @@ def _latlng_to_pixel(lat: float, lng: float, cfg: dict) -> tuple[int, int]:
             (cfg["lat_max"] - cfg["lat_min"]) * cfg["img_height"])
     return x, y
 
+# -------- 載入時建好的索引 --------
+class AmbiguousLocationError(ValueError):
+    """同一個 location 對應到多個 group（例如 'group1'）"""
+    def __init__(self, location: str, group_ids: list):
+        super().__init__(f" location='{location}' 對應到多個 group：{group_ids}，"
+                         f"請改用 group_id 或 get_group_configs_by_location")
+        self.location = location
+        self.group_ids = group_ids
+
+def _build_location_index(groups: dict) -> dict:
+    """location -> [group_id, ...]（依 group_latlng_map 的順序）"""
+    index = {}
+    for gid, cfg in groups.items():
+        for name in cfg.get("area_names", []):
+            index.setdefault(name, []).append(gid)
+    return index
+
+def _coefficients(cfg: dict) -> tuple:
+    """每個 group 的換算係數：(lng_min, lng 範圍, 寬, lat_max, lat 範圍, 高)；
+    陣列版照原公式的運算順序算，結果與 _latlng_to_pixel 逐點相同"""
+    return (cfg["lng_min"], cfg["lng_max"] - cfg["lng_min"], cfg["img_width"],
+            cfg["lat_max"], cfg["lat_max"] - cfg["lat_min"], cfg["img_height"])
+
+LOCATION_INDEX = _build_location_index(group_latlng_map)
+GROUP_COEFFS = {gid: _coefficients(cfg) for gid, cfg in group_latlng_map.items()}
+
 # -------- 由 location 取得 group_config --------
+def get_group_configs_by_location(location: str) -> list[dict]:
+    """回傳所有對應的 group config（'group1' 這種共用名稱會有多個）"""
+    return [group_latlng_map[gid] for gid in LOCATION_INDEX.get(location, [])]
+
 def get_group_config_by_location(location: str) -> dict:
-    for cfg in group_latlng_map.values():
-        if location in cfg.get("area_names", []):
-            return cfg
-    raise ValueError(f" 找不到 location='{location}' 對應的 group config")
+    gids = LOCATION_INDEX.get(location)
+    if not gids:
+        raise ValueError(f" 找不到 location='{location}' 對應的 group config")
+    if len(gids) > 1:
+        raise AmbiguousLocationError(location, gids)
+    return group_latlng_map[gids[0]]
 
 # -------- 對外 API 1：直接給 config --------
 def convert_latlng_to_pixel(lat: float, lng: float, group_config: dict):
@@ -34,7 +68,40 @@ def convert_latlng_to_pixel_by_group(lat: float, lng: float, group_id: int):
     cfg = group_latlng_map[group_id]
     return _latlng_to_pixel(lat, lng, cfg)
 
+# -------- 陣列版：整欄 lat/lng 一次換算 --------
+def _coeffs_for(group) -> tuple:
+    """group 可為 group_id 或 config dict"""
+    if isinstance(group, dict):
+        return _coefficients(group)
+    return GROUP_COEFFS[group]
+
+def latlng_to_pixel_array(lats, lngs, group) -> tuple[np.ndarray, np.ndarray]:
+    """lats/lngs: 長度 N → (xs, ys) int64，與逐點 _latlng_to_pixel 相同（int() 向零截斷）"""
+    lng_min, lng_rng, w, lat_max, lat_rng, h = _coeffs_for(group)
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    xs = ((lngs - lng_min) / lng_rng * w).astype(np.int64)
+    ys = ((lat_max - lats) / lat_rng * h).astype(np.int64)
+    return xs, ys
+
+def pixel_to_latlng_array(xs, ys, group) -> tuple[np.ndarray, np.ndarray]:
+    """(xs, ys) 像素 → (lats, lngs)，latlng_to_pixel_array 的反函數（不截斷）"""
+    lng_min, lng_rng, w, lat_max, lat_rng, h = _coeffs_for(group)
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    return lat_max - ys / h * lat_rng, lng_min + xs / w * lng_rng
+
+def latlng_to_pixel_array_by_location(lats, lngs, location: str):
+    """location 必須只對應一個 group；'group1' 這種會丟 AmbiguousLocationError"""
+    return latlng_to_pixel_array(lats, lngs, get_group_config_by_location(location))
+
 
 # ===== 測試 =====
 if __name__ == "__main__":
-    print(convert_latlng_to_pixel_by_location(25.011910, 121.540540, "left"))
\ No newline at end of file
+    print(convert_latlng_to_pixel_by_location(25.011910, 121.540540, "left"))
+    lats = np.array([25.011910, 25.011880]); lngs = np.array([121.540540, 121.540520])
+    xs, ys = latlng_to_pixel_array(lats, lngs, 1)
+    assert [(int(x), int(y)) for x, y in zip(xs, ys)] == \
+        [convert_latlng_to_pixel_by_group(a, b, 1) for a, b in zip(lats, lngs)]
+    print(list(zip(xs.tolist(), ys.tolist())))
+    print("group1 →", [c["image"] for c in get_group_configs_by_location("group1")])
@@ -0,0 +1,125 @@
+# load_generator.py
+"""
+auto_daemon 壓力測試：以固定速率把樣本圖丟進 uploads 資料夾，
+從 daemon 的事件檔（_daemon_events.jsonl）對回每張圖的完成時間，算端到端延遲百分位。
+
+  python load_generator.py <sample_dir> <uploads_dir> --rate 2 --count 50 \\
+      [--register <location> --user-id 1] [--events downloads/_daemon_events.jsonl] [--timeout 600]
+
+--register：同時在 image_uploads 插入對應列（模擬 server 上傳流程；daemon 靠這列知道 location）
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import statistics
+from datetime import datetime
+from pathlib import Path
+
+# 與 auto_daemon.EVENTS_PATH 相同（都以 mark/ 為準，不看目前工作目錄）
+DEFAULT_EVENTS = os.environ.get("DAEMON_EVENTS", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             "downloads", "_daemon_events.jsonl"))
+
+
+def _percentile(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(q * (len(xs) - 1))))]
+
+
+def _drop(src: Path, uploads: Path, name: str):
+    """先寫 .part 再改名，watcher 不會讀到寫一半的檔"""
+    tmp = uploads / (name + ".part")
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, uploads / name)
+
+
+def run(sample_dir, uploads_dir, rate=2.0, count=50, location=None, user_id=1,
+        events_path=DEFAULT_EVENTS, timeout=600.0):
+    samples = sorted(p for p in Path(sample_dir).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if not samples:
+        print(f"{sample_dir} 沒有樣本圖")
+        return 1
+    uploads = Path(uploads_dir)
+    uploads.mkdir(parents=True, exist_ok=True)
+
+    supabase = None
+    if location:
+        from auto_process import supabase
+
+    events = Path(events_path)
+    offset = events.stat().st_size if events.exists() else 0
+    run_id = datetime.now().strftime("%H%M%S")
+    dropped = {}   # filename -> 丟進資料夾的時間
+
+    t_start = time.time()
+    for i in range(count):
+        due = t_start + i / rate
+        time.sleep(max(0.0, due - time.time()))
+        src = samples[i % len(samples)]
+        name = f"loadgen-{run_id}-{i:04d}-{datetime.now():%Y-%m-%d-%H-%M-%S}{src.suffix.lower()}"
+        _drop(src, uploads, name)
+        dropped[name] = time.time()
+        if supabase is not None:
+            supabase.table("image_uploads").insert({
+                "user_id": user_id, "filename": name, "original_name": src.name,
+                "mime_type": "image/png" if src.suffix.lower() == ".png" else "image/jpeg",
+                "size": src.stat().st_size, "location": location, "processed": False,
+            }).execute()
+    print(f"已丟入 {count} 張（{rate}/s），等待 daemon 完成…")
+
+    # 讀事件檔對回完成時間
+    finished, skipped = {}, {}
+    deadline = time.time() + timeout
+    while len(finished) + len(skipped) < count and time.time() < deadline:
+        if events.exists():
+            with open(events, "r", encoding="utf-8") as f:
+                f.seek(offset)
+                chunk = f.read()
+                if chunk.endswith("\n"):
+                    offset = f.tell()
+                else:
+                    chunk = chunk[:chunk.rfind("\n") + 1]
+                    offset += len(chunk.encode("utf-8"))
+            for line in chunk.splitlines():
+                try:
+                    ev = json.loads(line)
+                except ValueError:
+                    continue
+                name = ev.get("filename")
+                if name not in dropped:
+                    continue
+                if ev.get("event") == "done":
+                    finished[name] = ev["ts"] - dropped[name]
+                elif ev.get("event") in ("skipped", "failed"):
+                    skipped[name] = ev.get("reason") or ev["event"]
+        time.sleep(0.2)
+
+    lat = [v * 1000 for v in finished.values()]
+    missing = count - len(finished) - len(skipped)
+    print(f"完成 {len(finished)} / 略過或失敗 {len(skipped)} / 逾時未回 {missing}")
+    if lat:
+        print(f"端到端延遲 ms：p50={_percentile(lat, .5):.0f}  p90={_percentile(lat, .9):.0f}  "
+              f"p95={_percentile(lat, .95):.0f}  p99={_percentile(lat, .99):.0f}  "
+              f"max={max(lat):.0f}  mean={statistics.mean(lat):.0f}")
+        span = max(dropped[n] + finished[n] for n in finished) - t_start
+        print(f"吞吐量：{len(finished) / span:.2f} 張/s")
+    return 0 if missing == 0 else 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("用法: python load_generator.py <sample_dir> <uploads_dir> [--rate 2] [--count 50] "
+              "[--register <location> --user-id 1] [--events <jsonl>] [--timeout 600]")
+        sys.exit(1)
+    args = sys.argv[3:]
+    opts = dict(zip(args[::2], args[1::2]))
+    sys.exit(run(
+        sys.argv[1], sys.argv[2],
+        rate=float(opts.get("--rate", 2)),
+        count=int(opts.get("--count", 50)),
+        location=opts.get("--register"),
+        user_id=int(opts.get("--user-id", 1)),
+        events_path=opts.get("--events", DEFAULT_EVENTS),
+        timeout=float(opts.get("--timeout", 600)),
+    ))
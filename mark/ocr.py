@@ -8,12 +8,12 @@ import sys
 
 ocr = PaddleOCR(use_angle_cls=True, lang='en', use_gpu=False)  # ✅ 用 CPU 或 GPU 執行，看環境設定
 
-def run_ocr(image_path, save_path):
-    result = ocr.ocr(image_path, cls=True)
-    image = cv2.imread(image_path)
+def ocr_image(image):
+    """image 可為路徑或 BGR ndarray；回傳 [{text, conf, center}]"""
+    result = ocr.ocr(image, cls=True)
     ocr_output = []
 
-    for idx, line in enumerate(result[0]):
+    for idx, line in enumerate(result[0] or []):
         box, (text, conf) = line
         center = [(box[0][0] + box[2][0]) / 2, (box[0][1] + box[2][1]) / 2]
         ocr_output.append({
@@ -21,12 +21,65 @@ def run_ocr(image_path, save_path):
             "conf": float(conf),
             "center": center
         })
+    return ocr_output
+
+# -------- 車牌框 OCR：只做辨識（不跑整張的文字偵測） --------
+PLATE_PAD = float(os.environ.get("OCR_PLATE_PAD", "0.15"))   # 框四周外擴比例
+
+def crop_plates(image, boxes, pad=PLATE_PAD):
+    """回傳 (crops, centers)；center 為車牌框在原圖的中心"""
+    h, w = image.shape[:2]
+    crops, centers = [], []
+    for x1, y1, x2, y2 in boxes:
+        px, py = (x2 - x1) * pad, (y2 - y1) * pad
+        X1, Y1 = max(0, int(x1 - px)), max(0, int(y1 - py))
+        X2, Y2 = min(w, int(round(x2 + px))), min(h, int(round(y2 + py)))
+        if X2 <= X1 or Y2 <= Y1:
+            continue
+        crops.append(image[Y1:Y2, X1:X2])
+        centers.append([(x1 + x2) / 2, (y1 + y2) / 2])
+    return crops, centers
+
+def _recognize(crops):
+    """批次辨識 → [(text, conf)]；舊版 PaddleOCR 沒有 text_recognizer 就逐張 det=False"""
+    try:
+        imgs = list(crops)
+        if getattr(ocr, "use_angle_cls", False):
+            imgs, _, _ = ocr.text_classifier(imgs)
+        rec_res, _ = ocr.text_recognizer(imgs)
+        return rec_res
+    except AttributeError:
+        out = []
+        for c in crops:
+            r = ocr.ocr(c, det=False, cls=True)
+            out.append(tuple(r[0][0]) if r and r[0] else ("", 0.0))
+        return out
+
+def ocr_plate_crops(image, plate_boxes, pad=PLATE_PAD):
+    """
+    image 可為路徑或 BGR ndarray；plate_boxes: [[x1, y1, x2, y2], ...]（原圖座標）
+    回傳與 ocr_image 相同格式 [{text, conf, center}]，center 為原圖座標
+    """
+    if isinstance(image, str):
+        image = cv2.imread(image)
+    crops, centers = crop_plates(image, plate_boxes, pad)
+    if not crops:
+        return []
+    return [
+        {"text": text, "conf": float(conf), "center": center}
+        for (text, conf), center in zip(_recognize(crops), centers)
+        if text
+    ]
+
+def run_ocr(image_path, save_path):
+    ocr_output = ocr_image(image_path)
 
     # 儲存中繼檔案
     with open(save_path, 'w', encoding='utf-8') as f:
         json.dump(ocr_output, f, indent=2, ensure_ascii=False)
 
     print(f"✅ OCR 結果儲存完成：{save_path}")
+    return ocr_output
 
 if __name__ == '__main__':
     img_path = sys.argv[1]
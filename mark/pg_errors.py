@@ -0,0 +1,25 @@
+# pg_errors.py
+"""
+辨識 Supabase（PostgREST）回來的「欄位不存在」錯誤，讓呼叫端只在這種情況走相容退路，
+其他錯誤（網路、5xx、RLS 權限）照樣丟出去：
+
+  42703     Postgres undefined_column（select / filter 用到不存在的欄位）
+  PGRST204  PostgREST schema cache 裡找不到欄位（insert / update 帶了不存在的欄位）
+"""
+MISSING_COLUMN_CODES = ("42703", "PGRST204")
+
+
+def _error_fields(e: Exception):
+    code = getattr(e, "code", None)
+    message = getattr(e, "message", None)
+    if code is None and e.args and isinstance(e.args[0], dict):   # 舊版 postgrest-py 把內容放在 args[0]
+        code, message = e.args[0].get("code"), e.args[0].get("message")
+    return str(code or ""), str(message or e)
+
+
+def is_missing_column(e: Exception, column: str = None) -> bool:
+    """e 是「欄位不存在」錯誤；有給 column 時還要求訊息裡提到這個欄位"""
+    code, message = _error_fields(e)
+    if code not in MISSING_COLUMN_CODES:
+        return False
+    return column is None or column in message
@@ -0,0 +1,126 @@
+# projection.py
+"""
+影像座標 → 底圖像素的批次投影（Nx2 進、Nx2 出）：
+  - project_points：所有點一次 cv2.perspectiveTransform（H 的輸出是 [-1, 1] 正規化座標）
+  - norm_to_px：正規化座標 → 底圖像素，整個陣列一起算
+  - latlng_to_base_px / pixel_to_latlng_arr：經緯度 ↔ 底圖像素（base_configs 的 lat/lng 邊界做線性換算）
+  - align_points_to_centerline：紅點沿停車格中心線整齊化（整個陣列一起算）
+  - motor_uids：底圖像素量化成格子編號的 motor_uid（based_mark 產生、auto_process 比對）
+based_mark（機車中心投影）與 auto_process.generate_json_for_location（藍框角點）共用。
+"""
+import os
+
+import cv2
+import numpy as np
+
+
+def _as_points(pts) -> np.ndarray:
+    return np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+
+
+def project_points(H, pts) -> np.ndarray:
+    """pts: Nx2 影像座標 → Nx2 投影後座標（一次呼叫）"""
+    pts = _as_points(pts)
+    if len(pts) == 0:
+        return np.zeros((0, 2), dtype=np.float32)
+    src = np.ascontiguousarray(pts, dtype=np.float32).reshape(-1, 1, 2)
+    # 保持 float32 輸出：與原本逐點 perspectiveTransform 的結果逐位元相同
+    return cv2.perspectiveTransform(src, np.asarray(H, dtype=np.float64)).reshape(-1, 2)
+
+
+def norm_to_px(xy_norm, W, H_img) -> np.ndarray:
+    """[-1, 1] 正規化座標（y 向上）→ 底圖像素（y 向下）；浮點輸入保留原 dtype"""
+    xy = np.asarray(xy_norm)
+    xy = (xy if np.issubdtype(xy.dtype, np.floating) else xy.astype(np.float64)).reshape(-1, 2)
+    out = np.empty_like(xy)
+    out[:, 0] = (xy[:, 0] + 1) / 2 * W
+    out[:, 1] = (1 - xy[:, 1]) / 2 * H_img
+    return out
+
+
+def image_to_base_px(H, pts, W, H_img) -> np.ndarray:
+    """影像座標 → 底圖像素：project_points + norm_to_px"""
+    return norm_to_px(project_points(H, pts), W, H_img)
+
+
+def latlng_to_base_px(lat, lng, cfg) -> np.ndarray:
+    """lat/lng 陣列 → Nx2 底圖像素；cfg 需有 lat_min/lat_max/lng_min/lng_max/img_width/img_height"""
+    lat = np.asarray(lat, dtype=np.float64).ravel()
+    lng = np.asarray(lng, dtype=np.float64).ravel()
+    x = (lng - cfg["lng_min"]) / (cfg["lng_max"] - cfg["lng_min"]) * cfg["img_width"]
+    y = (cfg["lat_max"] - lat) / (cfg["lat_max"] - cfg["lat_min"]) * cfg["img_height"]
+    return np.stack([x, y], axis=1)
+
+
+def pixel_to_latlng_arr(xy, cfg):
+    """Nx2 底圖像素 → Nx2 (lat, lng)；底圖尺寸為 0 時回 None（與 pixel_to_latlng 相同）"""
+    if cfg["img_width"] == 0 or cfg["img_height"] == 0:
+        return None
+    xy = _as_points(xy)
+    lng = cfg["lng_min"] + (xy[:, 0] / cfg["img_width"]) * (cfg["lng_max"] - cfg["lng_min"])
+    lat = cfg["lat_max"] - (xy[:, 1] / cfg["img_height"]) * (cfg["lat_max"] - cfg["lat_min"])
+    return np.stack([lat, lng], axis=1)
+
+
+# -----------------------------
+# motor_uid：底圖座標（不是上傳照片的像素）量化成格子編號
+# -----------------------------
+# 格距 = 同一台車換一張照片時，投影到底圖的位置容許誤差（auto_process 比對也用這個距離）
+MOTOR_UID_TOL_PX = float(os.environ.get("MOTOR_UID_TOL_PX", "25"))
+
+
+def motor_uids(texts, xy, tol: float = MOTOR_UID_TOL_PX):
+    """
+    texts[i] + 底圖像素 xy[i] → "車牌@格x_格y"；同一格同車牌（例如兩台都是「未知」）依序加 #2、#3，
+    不會互相蓋掉
+    """
+    cells = np.rint(_as_points(xy) / tol).astype(int) if len(texts) else np.zeros((0, 2), int)
+    seen, out = {}, []
+    for t, (gx, gy) in zip(texts, cells.tolist()):
+        uid = f"{t}@{gx}_{gy}"
+        seen[uid] = seen.get(uid, 0) + 1
+        out.append(uid if seen[uid] == 1 else f"{uid}#{seen[uid]}")
+    return out
+
+
+# -----------------------------
+# 停車格中心線對齊（generate_json_for_location 用）
+# -----------------------------
+def reorder_box_points(points) -> np.ndarray:
+    """把 4 點排序成順時針"""
+    pts = np.array(points, dtype=float)
+    center = np.mean(pts, axis=0)
+    angles = np.arctan2(pts[:, 1] - center[1], pts[:, 0] - center[0])
+    return pts[np.argsort(angles)]
+
+
+def align_points_to_centerline(points, box_points, padding_ratio=0.1, smooth_factor=0.3) -> np.ndarray:
+    """
+    紅點沿著停車位中心線排列，帶原始距離權重的平滑分布
+    Nx2 進、Nx2 出；輸出依投影距離由小到大排列（與原本逐點版本相同）
+    """
+    box = reorder_box_points(box_points)
+    nxt = np.roll(box, -1, axis=0)
+    lengths = np.linalg.norm(nxt - box, axis=1)
+
+    # 最短邊（停車位頭尾）與對邊的中點連成中心線
+    s = int(np.argmin(lengths))
+    o = (s + 2) % 4
+    center_start = (box[s] + nxt[s]) / 2
+    center_end = (box[o] + nxt[o]) / 2
+    dir_vec = center_end - center_start
+    dir_len = np.linalg.norm(dir_vec)
+    dir_vec /= dir_len
+
+    pts = _as_points(points)
+    n = len(pts)
+    # 投影距離 → 正規化，和線性等距混合
+    proj = np.sort((pts - center_start) @ dir_vec)
+    min_proj, max_proj = proj.min(), proj.max()
+    proj_range = max_proj - min_proj if max_proj > min_proj else 1.0
+    mixed = (1 - smooth_factor) * np.linspace(0, 1, n) + smooth_factor * ((proj - min_proj) / proj_range)
+
+    # padding 後還原成座標
+    start_pos = dir_len * padding_ratio
+    usable_len = dir_len * (1 - padding_ratio) - start_pos
+    return center_start + np.outer(start_pos + mixed * usable_len, dir_vec)
@@ -0,0 +1,7 @@
+# mark/ 底下的模組彼此以頂層名稱 import（與 auto_process / worker 執行時相同）
+import sys
+from pathlib import Path
+
+MARK_DIR = Path(__file__).resolve().parents[1]
+if str(MARK_DIR) not in sys.path:
+    sys.path.insert(0, str(MARK_DIR))
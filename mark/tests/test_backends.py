@@ -0,0 +1,56 @@
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+
+pytest.importorskip("ultralytics")
+import based_mark
+
+MARK_DIR = Path(__file__).resolve().parents[1]
+IMAGES = [MARK_DIR / f for f in ("left.jpg", "left2.jpg", "mid.jpg")]
+TOL_PX = 2.0
+RUNTIMES = {"onnx": "onnxruntime", "openvino": "openvino"}
+
+
+def _box_iou(a, b):
+    """a: Nx4, b: Mx4 → NxM IoU"""
+    a, b = np.asarray(a, float).reshape(-1, 4), np.asarray(b, float).reshape(-1, 4)
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=-1)
+    area = lambda x: (x[:, 2] - x[:, 0]) * (x[:, 3] - x[:, 1])
+    return inter / (area(a)[:, None] + area(b)[None, :] - inter + 1e-9)
+
+
+def _assert_boxes_equivalent(ref, got, what):
+    """每個參考框都要有一個一對一對應、座標差 <= TOL_PX 的框"""
+    assert len(ref) == len(got), f"{what} 框數 {len(ref)} vs {len(got)}"
+    if not ref:
+        return
+    rows, cols = linear_sum_assignment(-_box_iou(ref, got))
+    diff = np.abs(np.asarray(ref)[rows] - np.asarray(got)[cols]).max()
+    assert diff <= TOL_PX, f"{what} 最大座標差 {diff:.2f}px"
+
+
+def test_box_iou():
+    a = [[0, 0, 10, 10]]
+    assert np.allclose(_box_iou(a, [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]]), [[1, 1 / 3, 0]])
+
+
+@pytest.mark.parametrize("backend", sorted(RUNTIMES))
+def test_exported_backend_matches_torch(backend):
+    pytest.importorskip(RUNTIMES[backend])
+    if not (os.path.exists(based_mark.MOTOR_WEIGHTS) and os.path.exists(based_mark.PLATE_WEIGHTS)):
+        pytest.skip("缺少 YOLO 權重檔")
+    imgs = [cv2.imread(str(p)) for p in IMAGES if p.exists()]
+    if not imgs:
+        pytest.skip("缺少 mark/ 的樣本圖")
+
+    ref = [based_mark.detect_batch([im], based_mark.load_models("torch"), 1)[0] for im in imgs]
+    got = [based_mark.detect_batch([im], based_mark.load_models(backend), 1)[0] for im in imgs]
+    for (rm, rp), (gm, gp) in zip(ref, got):
+        _assert_boxes_equivalent(rm, gm, "機車")
+        _assert_boxes_equivalent(rp, gp, "車牌")
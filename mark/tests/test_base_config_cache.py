@@ -0,0 +1,125 @@
+import base64
+import io
+import json
+from typing import List
+
+import numpy as np
+import pytest
+
+import base_config_cache as bcc
+from base_config_cache import BaseConfigCache
+
+
+class LocalQuery:
+    def __init__(self, rows: List[dict], cols: List[str], log: list):
+        self.rows, self.cols, self.log = rows, cols, log
+        self.filters, self.n = [], None
+
+    def eq(self, col, val):
+        self.filters.append(lambda r: r.get(col) == val)
+        return self
+
+    def in_(self, col, vals):
+        vals = set(vals)
+        self.filters.append(lambda r: r.get(col) in vals)
+        return self
+
+    def ilike(self, col, pattern):
+        p = pattern.lower()
+        if p.startswith("%"):
+            self.filters.append(lambda r: (r.get(col) or "").lower().endswith(p[1:]))
+        else:
+            self.filters.append(lambda r: (r.get(col) or "").lower() == p)
+        return self
+
+    def limit(self, n):
+        self.n = n
+        return self
+
+    def execute(self):
+        rows = [r for r in self.rows if all(f(r) for f in self.filters)][:self.n]
+        self.log.append(self.cols)
+        for c in self.cols:
+            if rows and c not in rows[0]:
+                raise ValueError(f"column base_configs.{c} does not exist")
+        return type("Res", (), {"data": [{c: r.get(c) for c in self.cols} for r in rows]})()
+
+
+class LocalBaseConfigs:
+    """client 替身：只實作 base_configs 會用到的查詢；log 記錄每次查詢的欄位"""
+    def __init__(self, rows: List[dict]):
+        self.rows = rows
+        self.log: List[List[str]] = []
+
+    def table(self, name):
+        assert name == "base_configs"
+        client = self
+        return type("T", (), {"select": lambda _, cols: LocalQuery(
+            client.rows, [c.strip() for c in cols.split(",")], client.log)})()
+
+
+def _npy_b64(a):
+    buf = io.BytesIO()
+    np.save(buf, a)
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+H = np.array([[2.0, 0, 1], [0, 2.0, 1], [0, 0, 2.0]])
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(bcc, "RECHECK_SEC", 0)
+    return LocalBaseConfigs([{
+        "id": 1, "route_key": "ib", "area_id": "A01", "h_base_b64": _npy_b64(H),
+        "img_width": 800, "img_height": 600, "coords": json.dumps([{"lat": 1, "lng": 2}]),
+        "lat_min": 0, "lat_max": 1, "lng_min": 0, "lng_max": 1,
+        "base_image_b64": "(很大的底圖)", "src_pts_b64": "...", "updated_at": "2024-01-01"}])
+
+
+def test_first_fetch_normalizes_h(db, tmp_path):
+    c = BaseConfigCache(db, cache_dir=tmp_path, offline=False)
+    Hc, W, Hh = c.get_homography("A01", "IB")
+    assert np.allclose(Hc, H / 2) and (W, Hh) == (800, 600)
+    assert c.stats["full_fetches"] == 1
+
+
+def test_unchanged_version_reads_disk(db, tmp_path):
+    BaseConfigCache(db, cache_dir=tmp_path, offline=False).get_homography("A01", "ib")
+    c2 = BaseConfigCache(db, cache_dir=tmp_path, offline=False)
+    c2.get_homography("A01", "ib")
+    assert c2.stats["full_fetches"] == 0 and c2.stats["disk_hits"] == 1
+
+    db.rows[0].update(updated_at="2024-02-01", img_width=1024)
+    assert c2.get("A01", "ib")["img_width"] == 1024 and c2.stats["full_fetches"] == 1
+
+
+def test_offline_reads_cache_only(db, tmp_path):
+    BaseConfigCache(db, cache_dir=tmp_path, offline=False).get("A01", "ib")
+    off = BaseConfigCache(None, cache_dir=tmp_path, offline=True)
+    assert off.get("A01", "ib")["img_width"] == 800
+    with pytest.raises(ValueError):
+        off.get("Z99", "ib")
+
+
+def test_get_many_batches_queries(db, tmp_path):
+    many = BaseConfigCache(db, cache_dir=tmp_path, offline=False)
+    got = many.get_many([("A01", "ib"), ("Z99", "ib")])
+    assert list(got) == [("ib", "A01")]
+    assert len(db.log) == 3   # 1 次批次版本查詢 + 1 次抓資料列 + Z99 的單筆查詢
+
+
+def test_homography_requires_exact_route(db, tmp_path):
+    fuzzy = BaseConfigCache(db, cache_dir=tmp_path, offline=False)
+    assert fuzzy.get("A01", "tr")["id"] == 1   # 地圖 JSON 用：route 不符仍退回同 area_id
+    with pytest.raises(ValueError):
+        fuzzy.get_homography("A01", "tr")
+    with pytest.raises(ValueError):   # 模糊比對寫下的快取不算數
+        BaseConfigCache(None, cache_dir=tmp_path, offline=True).get_homography("A01", "tr")
+
+
+def test_never_fetches_base_image(db, tmp_path):
+    c = BaseConfigCache(db, cache_dir=tmp_path, offline=False)
+    c.get_homography("A01", "ib")
+    c.get_many([("A01", "ib")])
+    assert all("base_image_b64" not in q and "src_pts_b64" not in q for q in db.log)
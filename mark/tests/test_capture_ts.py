@@ -0,0 +1,19 @@
+from datetime import datetime
+
+import auto_process
+from capture_ts import filename_capture_time
+
+
+def test_filename_capture_time():
+    assert filename_capture_time("ib_2025-07-29-16-51.jpg") == datetime(2025, 7, 29, 16, 51)
+    assert filename_capture_time(r"E:\x\tr_2025-07-29-16-51-07.jpg") == datetime(2025, 7, 29, 16, 51, 7)
+    assert filename_capture_time("/x/2025-07-29-16-51/left.jpg") is None   # 只看檔名
+    assert filename_capture_time("left_2025-13-40-16-51.jpg") is None
+    assert filename_capture_time("left.jpg") is None
+
+
+def test_auto_process_falls_back_to_created_at():
+    row = {"filename": "left.jpg", "created_at": "2025-07-29T08:51:00"}
+    assert auto_process.capture_time(row) == datetime(2025, 7, 29, 8, 51)
+    assert auto_process.capture_time({"filename": "ib_2025-07-29-16-51.jpg"}) == datetime(2025, 7, 29, 16, 51)
+    assert auto_process.capture_time({}) == datetime.min
@@ -0,0 +1,121 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+import descriptor_store as ds
+
+
+def _fake_sift(calls):
+    """以檔案內容決定的假特徵：同內容 → 同陣列，列數隨內容變"""
+    def compute(path):
+        calls.append(os.path.basename(path))
+        data = open(path, "rb").read()
+        rng = np.random.default_rng(len(data))
+        n = len(data) % 50 + 5
+        return rng.random((n, 3), dtype=np.float32), rng.random((n, 128), dtype=np.float32)
+    return compute
+
+
+def _write(path, n):
+    time.sleep(0.01)   # mtime_ns 一定要變
+    path.write_bytes(b"x" * n)
+
+
+@pytest.fixture
+def base_dir(tmp_path):
+    for i in range(5):
+        (tmp_path / f"base_A0{i}.jpg").write_bytes(b"x" * (10 + i))
+    return tmp_path
+
+
+def _candidates(base_dir):
+    return sorted(str(p) for p in base_dir.glob("*.jpg"))
+
+
+def _store(base_dir, calls):
+    return ds.DescriptorStore(base_dir, _fake_sift(calls), 4000, area_fn=lambda p: os.path.basename(p)[5:8])
+
+
+def test_one_contiguous_array_per_location(base_dir):
+    calls = []
+    store = _store(base_dir, calls).sync(_candidates(base_dir))
+    files = set(os.listdir(base_dir / ds.STORE_DIRNAME))
+    assert {"des.npy", "kp.npy", "offsets.npy", "labels.npy", "manifest.json"} <= files
+    offsets = np.load(base_dir / ds.STORE_DIRNAME / "offsets.npy")
+    assert offsets[:, 0].tolist() == np.concatenate([[0], np.cumsum(offsets[:-1, 1])]).tolist()
+    assert np.load(base_dir / ds.STORE_DIRNAME / "labels.npy").tolist() == ["A00", "A01", "A02", "A03", "A04"]
+    for p in _candidates(base_dir):
+        _, des = store.get(p)
+        assert isinstance(des.base, np.memmap) or isinstance(des, np.memmap)
+
+
+def test_change_rewrites_only_that_image(base_dir):
+    calls = []
+    cands = _candidates(base_dir)
+    store = _store(base_dir, calls).sync(cands)
+    before = store.offsets.copy()
+    gen = store.generation
+    calls.clear()
+
+    _write(base_dir / "base_A01.jpg", 33)
+    store.sync(cands)
+    assert calls == ["base_A01.jpg"]
+    assert store.generation != gen
+    changed = [i for i in range(len(cands)) if not np.array_equal(before[i], store.offsets[i])]
+    assert changed == [1]
+
+    check = []
+    for p in cands:
+        kp, des = store.get(p)
+        ref_kp, ref_des = _fake_sift(check)(p)
+        assert np.array_equal(kp, ref_kp) and np.array_equal(des, ref_des)
+
+
+def test_touch_keeps_generation(base_dir):
+    calls = []
+    cands = _candidates(base_dir)
+    store = _store(base_dir, calls).sync(cands)
+    gen = store.generation
+    calls.clear()
+    os.utime(cands[3])
+    store.sync(cands)
+    assert calls == [] and store.generation == gen
+
+
+def test_compaction_keeps_every_slice(base_dir, monkeypatch):
+    monkeypatch.setattr(ds, "MIN_CAPACITY", 10)
+    calls = []
+    cands = _candidates(base_dir)
+    store = _store(base_dir, calls).sync(cands)
+    for k in range(8):
+        _write(base_dir / f"base_A0{k % 5}.jpg", 40 + k)
+        store.sync(cands)
+    assert store.meta["used"] <= store.meta["capacity"]
+
+    other = _store(base_dir, [])   # 另一個行程：只讀 manifest + memmap
+    for p in cands:
+        ref_kp, ref_des = _fake_sift([])(p)
+        kp, des = other.get(p)
+        assert np.array_equal(kp, ref_kp) and np.array_equal(des, ref_des)
+
+
+def test_hash_cache_reports_hit(base_dir):
+    calls = []
+    img = str(base_dir / "base_A00.jpg")
+    kp, des, hit = ds.load_or_compute_by_hash(img, "t", _fake_sift(calls))
+    assert not hit and calls == ["base_A00.jpg"]
+    kp2, des2, hit = ds.load_or_compute_by_hash(img, "t", _fake_sift(calls))
+    assert hit and len(calls) == 1 and np.array_equal(des, des2)
+
+
+def test_hash_cache_failed_write_leaves_no_tmp(base_dir, monkeypatch):
+    def broken_save(f, arr):
+        f.write(b"partial")
+        raise OSError("disk full")
+    monkeypatch.setattr(ds.np, "save", broken_save)
+    calls = []
+    kp, des, hit = ds.load_or_compute_by_hash(str(base_dir / "base_A00.jpg"), "t", _fake_sift(calls))
+    assert not hit and len(kp) == len(des)
+    assert list((base_dir / ds.STORE_DIRNAME / ds.HASH_DIRNAME).iterdir()) == []
@@ -0,0 +1,63 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_DIR))   # sift_v1 在 repo 根目錄
+
+import sift_v1
+
+SAMPLES = REPO_DIR / "mark"
+BASE = SAMPLES / "downloads" / "left_2025-07-29-12-45.jpg"
+UPLOAD = SAMPLES / "left.jpg"
+
+
+@pytest.fixture
+def hits(monkeypatch):
+    """記下每次讀底圖特徵快取是否命中"""
+    log = []
+    load = sift_v1.load_or_compute_by_hash
+
+    def spy(*args, **kwargs):
+        kp, des, hit = load(*args, **kwargs)
+        log.append(hit)
+        return kp, des, hit
+
+    monkeypatch.setattr(sift_v1, "load_or_compute_by_hash", spy)
+    return log
+
+
+@pytest.fixture
+def area(tmp_path, hits):
+    if not (BASE.exists() and UPLOAD.exists()):
+        pytest.skip("缺少 mark/ 的樣本圖")
+    src = tmp_path / "base_X.jpg"
+    shutil.copyfile(BASE, src)
+    return src, tmp_path / "X_output.jpg"
+
+
+def _fuse(base, source, hits):
+    """融合一次並寫出 X_output.jpg；回傳 (成功與否, 這次讀快取的命中紀錄)"""
+    del hits[:]
+    img = sift_v1.replace_region_with_visible_mask_feature_matching(
+        str(base), str(UPLOAD), feature_source=source and str(source))
+    ok = img is not None
+    if ok:
+        sift_v1.atomic_imwrite(str(base.parent / "X_output.jpg"), img)
+    return ok, list(hits)
+
+
+def test_second_fuse_hits_feature_cache(area, hits):
+    src, out = area
+    assert _fuse(src, src, hits) == (True, [False])
+    # 第二次的底圖已是 X_output.jpg，特徵仍取自不變的 base_X.jpg → 命中
+    assert _fuse(out, src, hits) == (True, [True])
+
+
+def test_feature_source_falls_back_without_source(area, hits):
+    src, out = area
+    _fuse(src, src, hits)
+    # 不給來源就以融合後的輸出檔本身算特徵：內容變了，不會誤用 base_X.jpg 的快取
+    assert _fuse(out, None, hits) == (True, [False])
@@ -0,0 +1,53 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+import infer_location as il
+from descriptor_store import DescriptorStore
+
+MARK_DIR = Path(__file__).resolve().parents[1]
+SAMPLES = MARK_DIR / "downloads"
+BASES = {"A01": "left_2025-07-29-12-45.jpg", "A02": "mid_2025-07-29-12-45.jpg",
+         "A03": "right_2025-07-29-12-45.jpg"}
+QUERIES = ["left.jpg", "left2.jpg", "mid.jpg", "downloads/left_2025-07-27-17-12.jpg"]
+
+
+@pytest.fixture
+def base_dir(tmp_path, monkeypatch):
+    if not all((SAMPLES / f).exists() for f in BASES.values()):
+        pytest.skip("缺少 mark/downloads 的樣本圖")
+    d = tmp_path / "test_base_images"
+    d.mkdir()
+    for area, f in BASES.items():
+        shutil.copy(SAMPLES / f, d / f"base_{area}.jpg")
+    for memo in ("_STORES", "_INDEX_MEMO", "_KEY_MEMO"):
+        monkeypatch.setattr(il, memo, {})
+    return d
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_index_top1_equals_bruteforce(base_dir, query):
+    cands = il._collect_candidates(base_dir)
+    _, q_des = il._compute_sift(il._read_gray_resized(str(MARK_DIR / query)))
+    assert il._infer_with_index(q_des, base_dir, cands) == il._infer_bruteforce(q_des, cands)
+
+
+def test_index_reuse_does_not_sync_store(base_dir, monkeypatch):
+    cands = il._collect_candidates(base_dir)
+    il._load_index(base_dir, cands)
+    idx = il._load_index(base_dir, cands)   # 索引檔寫在底圖目錄裡：重建後第一次查詢會再 stat 一輪
+
+    calls = []
+    sync = DescriptorStore.sync
+    monkeypatch.setattr(DescriptorStore, "sync", lambda self, c: calls.append(1) or sync(self, c))
+    for _ in range(3):
+        assert il._load_index(base_dir, cands) is idx
+    assert calls == []
+
+    # 底圖換掉（與 sift_v1 一樣 暫存檔 + os.replace）→ 目錄 mtime 變了才同步、重建
+    tmp = base_dir / "base_A01.jpg.tmp"
+    shutil.copy(SAMPLES / BASES["A02"], tmp)
+    tmp.replace(base_dir / "base_A01.jpg")
+    new = il._load_index(base_dir, cands)
+    assert calls and new is not idx and new["key"]["generation"] != idx["key"]["generation"]
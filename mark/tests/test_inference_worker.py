@@ -0,0 +1,45 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+import infer_location as il
+from inference_worker import WorkerClient
+
+MARK_DIR = Path(__file__).resolve().parents[1]
+SAMPLES = MARK_DIR / "downloads"
+BASES = {"A01": "left_2025-07-29-12-45.jpg", "A02": "mid_2025-07-29-12-45.jpg",
+         "A03": "right_2025-07-29-12-45.jpg"}
+QUERIES = ["left.jpg", "mid.jpg"]
+
+
+@pytest.fixture
+def base_root(tmp_path):
+    if not all((SAMPLES / f).exists() for f in BASES.values()):
+        pytest.skip("缺少 mark/downloads 的樣本圖")
+    d = tmp_path / "test_base_images"
+    d.mkdir()
+    for area, f in BASES.items():
+        shutil.copy(SAMPLES / f, d / f"base_{area}.jpg")
+    return tmp_path
+
+
+@pytest.fixture
+def worker():
+    w = WorkerClient(ready_timeout=120, call_timeout=120)
+    yield w
+    w.close()
+
+
+def test_ping_and_unknown_op(worker):
+    assert worker.call("ping") == "pong"
+    with pytest.raises(RuntimeError, match="未知的 op"):
+        worker.call("no_such_op")
+    assert worker.call("ping") == "pong"   # 錯誤回應後 worker 仍可用
+
+
+def test_infer_area_matches_in_process(worker, base_root):
+    for q in QUERIES:
+        query = str(MARK_DIR / q)
+        got = worker.call("infer_area", query_path=query, base_root=str(base_root), location="test")
+        assert got in BASES and got == il.infer_area_by_kp(query, str(base_root), "test")
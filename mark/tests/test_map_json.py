@@ -0,0 +1,24 @@
+import pytest
+
+import auto_process
+
+
+class NoDatabase:
+    def table(self, name):
+        raise AssertionError(f"不該查 {name}")
+
+
+@pytest.fixture
+def written(monkeypatch):
+    log = []
+    monkeypatch.setattr(auto_process, "supabase", NoDatabase())
+    monkeypatch.setattr(auto_process, "write_map_json", lambda *a: log.append(("json", a)) or (True, "x"))
+    monkeypatch.setattr(auto_process, "commit_map_outputs", lambda changes: log.append(("manifest", changes)))
+    return log
+
+
+@pytest.mark.parametrize("area", ["", "A01", "ib-A01", "ib_"])
+def test_unparseable_area_writes_nothing(written, area):
+    auto_process.generate_json_for_location(area)
+    auto_process.generate_json_for_locations([area])
+    assert written == []
@@ -0,0 +1,69 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pytest
+
+from based_mark import DETS_SUFFIX, MATCH_GATE_PX, match_motors_plates
+
+
+def _parking_scene(rng, n):
+    """機車框 80~200px、彼此大致不重疊；每台附近一個車牌，再加少量漏偵測與誤偵測"""
+    side = 220 * np.sqrt(n)
+    m = rng.uniform(0, side, size=(n, 2))
+    wh = rng.uniform(80, 200, size=(n, 2))
+    p = m + rng.normal(0, 0.2, size=(n, 2)) * wh
+    p = np.vstack([p[rng.random(n) > 0.1], rng.uniform(0, side, size=(max(1, n // 20), 2))])
+    return m, p
+
+
+def _same(m, p, gate=MATCH_GATE_PX):
+    a = match_motors_plates(m, p, mode="dense", gate=gate)
+    b = match_motors_plates(m, p, mode="sparse", gate=gate)
+    assert a == b, f"只有 dense: {sorted(set(a) - set(b))}  只有 sparse: {sorted(set(b) - set(a))}"
+    return a
+
+
+@pytest.mark.parametrize("n", [1, 10, 50, 300, 1000])
+def test_sparse_equals_dense_parking(n):
+    rng = np.random.default_rng(n)
+    for _ in range(5):
+        m, p = _parking_scene(rng, n)
+        _same(m, p)
+
+
+@pytest.mark.parametrize("nm,npl", [(40, 40), (60, 25), (25, 60), (200, 180)])
+def test_sparse_equals_dense_cluttered(nm, npl):
+    # 均勻亂撒、門檻很小：遠處的強制配對會牽動近的配對，最能抓到剪枝不正確
+    rng = np.random.default_rng(nm * 1000 + npl)
+    for gate in (30.0, 150.0, MATCH_GATE_PX):
+        m = rng.uniform(0, 1000, size=(nm, 2))
+        p = rng.uniform(0, 1000, size=(npl, 2))
+        _same(m, p, gate)
+
+
+def test_gate_drops_far_pairs():
+    m = [(0, 0), (5000, 0)]
+    p = [(10, 0), (0, 3000)]
+    for mode in ("dense", "sparse"):
+        assert match_motors_plates(m, p, mode=mode) == [(0, 0)]
+
+
+def test_empty_inputs():
+    for mode in ("dense", "sparse", "auto"):
+        assert match_motors_plates([], [(1, 1)], mode=mode) == []
+        assert match_motors_plates([(1, 1)], [], mode=mode) == []
+
+
+DETS = sorted(glob.glob(os.path.join(os.environ.get("MATCH_DETS_DIR", ""), "*" + DETS_SUFFIX))) \
+    if os.environ.get("MATCH_DETS_DIR") else []
+
+
+@pytest.mark.skipif(not DETS, reason="MATCH_DETS_DIR 未設定（PIPELINE_DEBUG_JSON=1 時記下的 *_dets.json）")
+@pytest.mark.parametrize("path", DETS, ids=os.path.basename)
+def test_sparse_equals_dense_recorded(path):
+    d = json.load(open(path, encoding="utf-8"))
+    mid = lambda b: ((b[0] + b[2]) / 2, (b[1] + b[3]) / 2)
+    if d["motor"] and d["plate"]:
+        _same([mid(b) for b in d["motor"]], [mid(b) for b in d["plate"]])
@@ -0,0 +1,164 @@
+import random
+
+import pytest
+
+import auto_process
+from auto_process import upload_motor_records
+from projection import MOTOR_UID_TOL_PX, motor_uids
+
+TOL = MOTOR_UID_TOL_PX
+
+
+class LocalMotorRecords:
+    """client 替身：只實作 upload_motor_records 用到的 motor_records 查詢；writes 記錄寫入列數，
+    select_error 有設就讓 select 丟出這個例外"""
+    def __init__(self):
+        self.rows, self.writes, self._next_id = [], 0, 1
+        self.select_error = None
+
+    def table(self, name):
+        assert name == "motor_records"
+        return LocalMotorQuery(self)
+
+
+class LocalMotorQuery:
+    def __init__(self, db):
+        self.db, self.op, self.payload, self.filters = db, None, None, []
+
+    def select(self, cols):
+        self.op, self.payload = "select", [c.strip() for c in cols.split(",")]
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def insert(self, rows):
+        self.op, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict="id"):
+        self.op, self.payload = "upsert", rows
+        return self
+
+    def eq(self, col, val):
+        self.filters.append(lambda r: r.get(col) == val)
+        return self
+
+    def in_(self, col, vals):
+        vals = set(vals)
+        self.filters.append(lambda r: r.get(col) in vals)
+        return self
+
+    def execute(self):
+        db = self.db
+        hit = [r for r in db.rows if all(f(r) for f in self.filters)]
+        if self.op == "select":
+            if db.select_error is not None:
+                raise db.select_error
+            data = [{c: r.get(c) for c in self.payload} for r in hit]
+        elif self.op == "delete":
+            db.rows = [r for r in db.rows if r not in hit]
+            db.writes += len(hit)
+            data = hit
+        elif self.op == "insert":
+            data = []
+            for row in self.payload:
+                data.append({**row, "id": db._next_id})
+                db._next_id += 1
+            db.rows += data
+            db.writes += len(data)
+        else:
+            by_id = {r["id"]: r for r in db.rows}
+            for row in self.payload:
+                by_id[row["id"]].update(row)
+            db.writes += len(self.payload)
+            data = self.payload
+        uids = [(r["location"], r.get("motor_uid")) for r in db.rows if r.get("motor_uid")]
+        assert len(uids) == len(set(uids)), "違反 (location, motor_uid) 唯一索引"
+        return type("Res", (), {"data": data})()
+
+
+def _scene(rnd, n=40):
+    # 一半是「未知」：OCR 讀不到的車牌最常見，也最容易撞 uid；另外放兩台同車牌、相距不到一格的車
+    scene = [("未知" if k % 2 else f"ABC-{k:03d}", rnd.uniform(0, 1600), rnd.uniform(0, 900))
+             for k in range(n - 2)]
+    return scene + [("未知", 800.0, 450.0), ("未知", 800.0 + TOL * 0.3, 450.0)]
+
+
+def _shot(rnd, scene, jitter):
+    """同一個場景換一張照片：底圖座標抖動、順序打亂、motor_index / match_distance 不同"""
+    items = [(t, x + rnd.uniform(-jitter, jitter), y + rnd.uniform(-jitter, jitter)) for t, x, y in scene]
+    rnd.shuffle(items)
+    uids = motor_uids([t for t, _, _ in items], [(x, y) for _, x, y in items])
+    return [dict(motor_index=i, real_x=x, real_y=y, plate_text=t, match_distance=rnd.uniform(0, 30),
+                 location="A01", route_key="ib", motor_uid=u)
+            for i, ((t, x, y), u) in enumerate(zip(items, uids))]
+
+
+@pytest.fixture
+def setup():
+    rnd = random.Random(0)
+    scene = _scene(rnd)
+    db = LocalMotorRecords()
+    written, _ = upload_motor_records(_shot(rnd, scene, 0), "ib_A01", "first.jpg", client=db)
+    assert written == len(scene) and len(db.rows) == len(scene)
+    return rnd, scene, db
+
+
+def test_same_photo_again_writes_nothing(setup):
+    rnd, scene, db = setup
+    rows = [dict(r) for r in db.rows]
+    written, _ = upload_motor_records([
+        dict(motor_index=r["motor_index"], real_x=r["real_x"], real_y=r["real_y"], plate_text=r["plate_text"],
+             match_distance=r["match_distance"], motor_uid=r["motor_uid"]) for r in rows
+    ], "ib_A01", "first.jpg", client=db)
+    assert written == 0
+
+
+def test_jittered_photo_updates_in_place(setup):
+    rnd, scene, db = setup
+    ids = {r["id"]: r["motor_uid"] for r in db.rows}
+    for k in range(5):
+        written, _ = upload_motor_records(_shot(rnd, scene, TOL * 0.3), "ib_A01", f"jitter{k}.jpg", client=db)
+        assert written == len(scene)                                  # 全是更新，沒有刪除 / 新增
+        assert {r["id"]: r["motor_uid"] for r in db.rows} == ids      # id 與 motor_uid 沿用
+        assert {r["image_filename"] for r in db.rows} == {f"jitter{k}.jpg"}
+
+
+def test_moved_and_replated(setup):
+    rnd, scene, db = setup
+    moved = _shot(rnd, scene, TOL * 0.3)
+    moved[0]["real_x"] += TOL * 4
+    moved[1]["plate_text"] = "XYZ-999"
+    before = {r["id"] for r in db.rows}
+    upload_motor_records(moved, "ib_A01", "moved.jpg", client=db)
+    assert len(db.rows) == len(scene)
+    assert len({r["id"] for r in db.rows} - before) == 1             # 移位的那台：刪 1 + 增 1
+    assert "XYZ-999" in {r["plate_text"] for r in db.rows}
+
+
+def test_select_failure_keeps_rows(setup):
+    rnd, scene, db = setup
+    db.select_error = RuntimeError("502 Bad Gateway")
+    with pytest.raises(RuntimeError):
+        upload_motor_records(_shot(rnd, scene, 0), "ib_A01", "outage.jpg", client=db)
+    assert len(db.rows) == len(scene)
+
+
+def test_missing_uid_column_falls_back_to_replace(setup):
+    rnd, scene, db = setup
+    db.select_error = Exception({"code": "42703", "message": "column motor_records.motor_uid does not exist"})
+    written, _ = upload_motor_records(_shot(rnd, scene, 0), "ib_A01", "legacy.jpg", client=db)
+    assert written == 2 * len(scene) and len(db.rows) == len(scene)
+
+
+def test_match_existing_prefers_same_plate_then_nearest():
+    existing = [{"id": 1, "real_x": 0.0, "real_y": 0.0, "plate_text": "AAA"},
+                {"id": 2, "real_x": 3.0, "real_y": 0.0, "plate_text": "BBB"},
+                {"id": 3, "real_x": None, "real_y": None, "plate_text": "CCC"}]
+    records = [{"real_x": 2.0, "real_y": 0.0, "plate_text": "AAA"},
+               {"real_x": 1.0, "real_y": 0.0, "plate_text": "ZZZ"},
+               {"real_x": 500.0, "real_y": 0.0, "plate_text": "BBB"}]
+    matched = auto_process._match_existing(existing, records, tol=TOL)
+    assert {i: row["id"] for i, row in matched.items()} == {0: 1, 1: 2}
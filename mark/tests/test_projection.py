@@ -0,0 +1,74 @@
+import cv2
+import numpy as np
+import pytest
+
+from projection import align_points_to_centerline, image_to_base_px, pixel_to_latlng_arr, reorder_box_points
+
+# 參考實作：改成批次之前 based_mark / auto_process 的逐點寫法（benchmarks/bench_projection.py 也拿來比速度）
+
+
+def per_point_to_px(H, pts, W, H_img):
+    def to_px(xn, yn):
+        return float((xn + 1) / 2 * W), float((1 - yn) / 2 * H_img)
+    out = []
+    for cx, cy in pts:
+        xn, yn = cv2.perspectiveTransform(np.array([[[cx, cy]]], dtype=np.float32), H)[0, 0]
+        out.append(to_px(xn, yn))
+    return out
+
+
+def align_loop(points, box_points, padding_ratio=0.1, smooth_factor=0.3):
+    box_points = reorder_box_points(box_points)
+    edges = [(box_points[i], box_points[(i+1)%4]) for i in range(4)]
+    lengths = [np.linalg.norm(e[1]-e[0]) for e in edges]
+    short_idx = int(np.argmin(lengths))
+    short_edge, opp_edge = edges[short_idx], edges[(short_idx+2)%4]
+    center_start = (short_edge[0]+short_edge[1])/2
+    center_end = (opp_edge[0]+opp_edge[1])/2
+    dir_vec = center_end - center_start
+    dir_len = np.linalg.norm(dir_vec)
+    dir_vec /= dir_len
+    proj = [np.dot(pt-center_start, dir_vec) for pt in points]
+    proj = np.array(proj)[np.argsort(proj)]
+    min_proj, max_proj = proj.min(), proj.max()
+    proj_range = max_proj - min_proj if max_proj>min_proj else 1.0
+    norm_proj = (proj - min_proj) / proj_range
+    mixed = (1-smooth_factor)*np.linspace(0, 1, len(points)) + smooth_factor*norm_proj
+    start_pos = dir_len * padding_ratio
+    aligned_proj = start_pos + mixed * (dir_len * (1 - padding_ratio) - start_pos)
+    return np.array([center_start + dir_vec*p for p in aligned_proj])
+
+
+def latlng_loop(xy, cfg):
+    out = []
+    for x, y in xy:
+        x = float(x); y = float(y)
+        lng = cfg["lng_min"] + (x / cfg["img_width"]) * (cfg["lng_max"] - cfg["lng_min"])
+        lat = cfg["lat_max"] - (y / cfg["img_height"]) * (cfg["lat_max"] - cfg["lat_min"])
+        out.append((lat, lng))
+    return np.array(out)
+
+
+H = np.array([[1.2e-3, 1e-4, -1.0], [-5e-5, -1.5e-3, 1.0], [1e-6, 2e-6, 1.0]])
+CFG = {"img_width": 1600, "img_height": 900, "lat_min": 24.78, "lat_max": 24.79,
+       "lng_min": 120.99, "lng_max": 121.0}
+BOX = np.array([[100, 100], [1500, 180], [1480, 420], [90, 330]], dtype=float)
+
+
+@pytest.mark.parametrize("n", [1, 10, 1000])
+def test_image_to_base_px_matches_per_point(n):
+    pts = np.random.default_rng(n).uniform(0, [1920, 1080], size=(n, 2))
+    ref = np.asarray(per_point_to_px(H, pts, 1600, 900))
+    assert np.array_equal(ref, image_to_base_px(H, pts, 1600, 900))   # float32 逐位元相同
+
+
+def test_image_to_base_px_empty():
+    assert image_to_base_px(H, [], 1600, 900).shape == (0, 2)
+
+
+@pytest.mark.parametrize("n", [1, 2, 10, 1000])
+def test_align_and_latlng_match_loops(n):
+    pts = np.random.default_rng(n).uniform([100, 150], [1500, 350], size=(n, 2))
+    got = align_points_to_centerline(pts, BOX)
+    assert np.abs(align_loop(pts, BOX) - got).max() < 1e-9
+    assert np.abs(latlng_loop(got, CFG) - np.asarray(pixel_to_latlng_arr(got, CFG))).max() < 1e-9
@@ -0,0 +1,38 @@
+import subprocess
+import types
+
+import pytest
+
+import auto_process
+
+
+class FakeWorker:
+    def __init__(self, error=None, result=None):
+        self.error, self.result = error, result
+
+    def call(self, op, **kwargs):
+        assert op == "pipeline"
+        if self.error:
+            raise self.error
+        return self.result
+
+
+@pytest.mark.parametrize("msg", ["ImportError: paddleocr", "ModuleNotFoundError: No module named 'paddle'"])
+def test_worker_without_ocr_falls_back(msg):
+    assert auto_process.run_single_stage([["a.jpg", "cfg"]], FakeWorker(RuntimeError(msg))) is None
+
+
+def test_worker_other_failure_does_not_fall_back():
+    assert auto_process.run_single_stage([["a.jpg", "cfg"]], FakeWorker(RuntimeError("ValueError: x"))) == {}
+
+
+def test_worker_timeout_propagates():
+    with pytest.raises(TimeoutError):
+        auto_process.run_single_stage([["a.jpg", "cfg"]], FakeWorker(TimeoutError("stuck")))
+
+
+@pytest.mark.parametrize("code,expected", [(auto_process.PIPELINE_NO_OCR_EXIT, None), (1, {})])
+def test_subprocess_exit_code(tmp_path, monkeypatch, code, expected):
+    monkeypatch.setattr(auto_process, "DOWNLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(subprocess, "run", lambda *a, **k: types.SimpleNamespace(returncode=code))
+    assert auto_process.run_single_stage([["a.jpg", "cfg"]]) == expected
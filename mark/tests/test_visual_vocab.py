@@ -0,0 +1,66 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+import infer_location as il
+import visual_vocab as vv
+
+SAMPLES = Path(__file__).resolve().parents[1] / "downloads"
+BASES = {"A01": "left_2025-07-29-12-45.jpg", "A02": "mid_2025-07-29-12-45.jpg",
+         "A03": "right_2025-07-29-12-45.jpg"}
+
+
+@pytest.fixture
+def base_root(tmp_path, monkeypatch):
+    if not all((SAMPLES / f).exists() for f in BASES.values()):
+        pytest.skip("缺少 mark/downloads 的樣本圖")
+    d = tmp_path / "test_base_images"
+    d.mkdir()
+    for area, f in BASES.items():
+        shutil.copy(SAMPLES / f, d / f"base_{area}.jpg")
+    for mod, memo in ((il, "_STORES"), (il, "_INDEX_MEMO"), (il, "_KEY_MEMO"),
+                      (vv, "_VOCAB_MEMO"), (vv, "_BOW_MEMO"), (vv, "_GEN_MEMO")):
+        monkeypatch.setattr(mod, memo, {})
+    monkeypatch.setattr(vv, "VOCAB_WORDS", 32)
+    return tmp_path
+
+
+def _replace_base(base_root, area, src):
+    # 與 sift_v1.atomic_imwrite 一樣：暫存檔 + os.replace
+    tmp = base_root / "test_base_images" / f"base_{area}.jpg.tmp"
+    shutil.copy(SAMPLES / src, tmp)
+    tmp.replace(base_root / "test_base_images" / f"base_{area}.jpg")
+
+
+def test_trains_on_first_use_and_reuses(base_root):
+    assert not (base_root / vv.VOCAB_FILE).exists()
+    vocab = vv.load_vocabulary(str(base_root))
+    assert vocab is not None and (base_root / vv.VOCAB_FILE).exists()
+    assert set(vocab["generations"]) == {"test_base_images"}
+
+    vv._VOCAB_MEMO.clear()   # 別的行程：從檔案讀回同一份，不重新訓練
+    again = vv.load_vocabulary(str(base_root))
+    assert again["vocab_id"] == vocab["vocab_id"] and again["generations"] == vocab["generations"]
+
+
+def test_retrains_when_store_generation_changes(base_root, monkeypatch):
+    vocab = vv.load_vocabulary(str(base_root))
+    _replace_base(base_root, "A01", BASES["A02"])
+
+    # 間隔內：沿用舊詞彙表
+    assert vv.load_vocabulary(str(base_root))["vocab_id"] == vocab["vocab_id"]
+
+    monkeypatch.setattr(vv, "RETRAIN_MIN_SEC", 0)
+    new = vv.load_vocabulary(str(base_root))
+    assert new["generations"] != vocab["generations"]
+    assert new["trained_at"] > vocab["trained_at"]
+
+
+def test_predict_area_uses_index_sift_settings(base_root, monkeypatch):
+    seen = []
+    compute = il._compute_sift
+    monkeypatch.setattr(il, "_compute_sift", lambda img: seen.append(img.shape[1]) or compute(img))
+    il.predict_area(str(SAMPLES / BASES["A02"]), str(base_root), "test")
+    assert seen and max(seen) <= il.MAX_WIDTH
+    assert seen[-1] == il._read_gray_resized(str(SAMPLES / BASES["A02"])).shape[1]
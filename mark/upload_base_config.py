@@ -1,7 +1,9 @@
 import os
 import base64
+from datetime import datetime, timezone
 from typing import Optional, Any, Dict
 from supabase import create_client
+from pg_errors import is_missing_column
 
 # ===== Supabase 連線 =====
 SUPABASE_URL = "https://polqjhuklxclnvgpjckf.supabase.co"
@@ -70,7 +72,21 @@ def upload_config(area_id: str, route_key: Optional[str] = None, coords: Optiona
     #         "lng_max": lng_max,
     #     })
 
-    # 上傳到 Supabase
+    # 版本戳：base_config_cache 只比對這一欄決定要不要重抓
+    # 表上還沒有這一欄時照樣上傳（快取改用 BASE_CFG_MAX_AGE_SEC 時效）；要加欄位：
+    #   alter table base_configs add column if not exists updated_at timestamptz default now();
+    data["updated_at"] = datetime.now(timezone.utc).isoformat()
+
+    try:
+        _write_config(data, area_id, route_key)
+    except Exception as e:
+        if not is_missing_column(e, "updated_at"):
+            raise
+        print("⚠️ base_configs 沒有 updated_at 欄位，改為不帶版本戳上傳")
+        data.pop("updated_at")
+        _write_config(data, area_id, route_key)
+
+def _write_config(data: Dict[str, Any], area_id: str, route_key: Optional[str]):
     existing = (
         supabase.table("base_configs")
         .select("id")
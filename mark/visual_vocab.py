@@ -0,0 +1,299 @@
+# visual_vocab.py
+"""
+視覺詞袋（Bag-of-Visual-Words）粗篩：
+  - 詞彙表：從 BASE_IMAGES_ROOT 底下所有 *_base_images 的 SIFT 描述子做 k-means
+  - 每個 location 一份 TF-IDF 直方圖 + 倒排檔（word -> 候選底圖, 權重）
+  - 查詢：量化查詢描述子 → 倒排檔累加分數 → 回傳前 K 張候選
+之後只有這 K 張會進 infer_location._score_pair 的 ratio test（不再查 location 的 FLANN 索引）。
+詞彙表記下訓練時每個 location 的 store generation：load_vocabulary 發現還沒訓練過、或有底圖變了
+（generation 不同）就重新訓練；距離上次訓練不到 BOW_RETRAIN_MIN_SEC 的話先沿用舊詞彙表
+（新圖直接用既有的詞量化），避免底圖連續更新時每次都跑 k-means。
+倒排檔記下建立時該 location 的 store 版本與 vocab_id，任一個變了只重建該 location 的倒排檔。
+沒有任何底圖時 shortlist 直接回傳全部候選。
+寫檔一律暫存檔 + os.replace，詞彙表訓練以 _visual_vocab.lock 跨行程互斥。
+"""
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from atomic_io import atomic_savez, file_lock
+from descriptor_store import _stat_key
+from infer_location import _collect_candidates, _load_or_compute_sift, _store_key
+
+# -----------------------------
+# 參數
+# -----------------------------
+VOCAB_WORDS      = int(os.environ.get("BOW_WORDS",       "1000"))  # 詞彙數量
+VOCAB_SAMPLE     = int(os.environ.get("BOW_SAMPLE",      "500"))   # 訓練時每張底圖抽幾個描述子
+VOCAB_ITERS      = int(os.environ.get("BOW_KMEANS_ITER", "20"))
+RETRAIN_MIN_SEC  = float(os.environ.get("BOW_RETRAIN_MIN_SEC", "600"))  # 兩次重新訓練至少間隔幾秒
+VOCAB_FILE       = "_visual_vocab.npz"    # {base_root}/_visual_vocab.npz
+VOCAB_LOCK       = "_visual_vocab.lock"
+BOW_INDEX_FILE   = "_bow_index.npz"       # {base_dir}/_bow_index.npz
+
+_VOCAB_MEMO: dict = {}   # base_root -> vocab dict（含載入時詞彙表檔的 stat，檔案換了才重讀）
+_BOW_MEMO: dict = {}     # base_dir  -> bow index dict
+_GEN_MEMO: dict = {}     # base_dir  -> (目錄 stat, store generation)
+
+
+# -----------------------------
+# 詞彙表
+# -----------------------------
+def _base_dirs(base_root: Path) -> List[Path]:
+    return [d for d in sorted(base_root.glob("*_base_images")) if d.is_dir()]
+
+
+def _generations(root: Path) -> Dict[str, str]:
+    """每個 location 目前的 store generation；底圖目錄沒變（只 stat 目錄）就沿用上次的結果"""
+    out = {}
+    for d in _base_dirs(root):
+        stamp = _stat_key(d)
+        memo = _GEN_MEMO.get(str(d))
+        if memo is None or stamp is None or memo[0] != stamp:
+            cands = _collect_candidates(d)
+            memo = (stamp, _store_key(d, cands)["generation"] if cands else "")
+            _GEN_MEMO[str(d)] = memo
+        if memo[1]:
+            out[d.name] = memo[1]
+    return out
+
+
+def train_vocabulary(base_root: str, n_words: int = VOCAB_WORDS) -> Optional[dict]:
+    """從 base_root 底下所有底圖抽樣描述子訓練 k-means 詞彙表並存檔（不管目前的是否過期）"""
+    root = Path(base_root)
+    with file_lock(root / VOCAB_LOCK):
+        return _train_locked(root, n_words, _generations(root))
+
+
+def _train_locked(root: Path, n_words: int, generations: Dict[str, str]) -> Optional[dict]:
+    rng = np.random.default_rng(0)
+    samples = []
+    for d in _base_dirs(root):
+        for p in _collect_candidates(d):
+            try:
+                _, des = _load_or_compute_sift(p)
+            except Exception as e:
+                print(f"[vocab] 略過 {p}: {e}")
+                continue
+            if des is None or len(des) == 0:
+                continue
+            if len(des) > VOCAB_SAMPLE:
+                des = des[rng.choice(len(des), VOCAB_SAMPLE, replace=False)]
+            samples.append(np.asarray(des, dtype=np.float32))
+
+    if not samples:
+        print(f"[vocab] {root} 底下沒有可用的底圖描述子")
+        return None
+
+    data = np.ascontiguousarray(np.vstack(samples))
+    k = max(2, min(n_words, len(data) // 2))
+    t0 = time.perf_counter()
+    cv2.setRNGSeed(0)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, VOCAB_ITERS, 1e-3)
+    _, _, centers = cv2.kmeans(data, k, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+    centers = np.ascontiguousarray(centers, dtype=np.float32)
+    vocab_id = hashlib.sha1(centers.tobytes()).hexdigest()[:16]
+
+    trained_at = time.time()
+    atomic_savez(root / VOCAB_FILE, centers=centers, vocab_id=np.array(vocab_id),
+                 generations=np.array(json.dumps(generations, sort_keys=True)),
+                 trained_at=np.array(trained_at))
+    print(f"[vocab] 訓練完成：{k} 個詞，{len(data)} 個樣本，{time.perf_counter() - t0:.1f}s")
+
+    vocab = _make_vocab(centers, vocab_id, _stat_key(root / VOCAB_FILE), generations, trained_at)
+    _VOCAB_MEMO[str(root)] = vocab
+    return vocab
+
+
+def _make_vocab(centers: np.ndarray, vocab_id: str, stamp, generations: Dict[str, str],
+                trained_at: float) -> dict:
+    return {"centers": centers, "vocab_id": vocab_id, "stamp": stamp,
+            "generations": generations, "trained_at": trained_at,
+            "matcher": cv2.BFMatcher(cv2.NORM_L2, crossCheck=False)}
+
+
+def _read_vocabulary(root: Path) -> Optional[dict]:
+    """讀詞彙表檔（只 stat 一次；檔案換了才重讀）；不存在或讀不到回 None"""
+    path = root / VOCAB_FILE
+    stamp = _stat_key(path)
+    memo = _VOCAB_MEMO.get(str(root))
+    if memo is not None and memo["stamp"] == stamp:
+        return memo
+    _VOCAB_MEMO.pop(str(root), None)
+    if stamp is None:
+        return None
+    try:
+        with np.load(path) as data:
+            # 舊格式沒有 generations：視為過期，下次訓練時換掉
+            gens = json.loads(str(data["generations"])) if "generations" in data.files else {}
+            trained_at = float(data["trained_at"]) if "trained_at" in data.files else stamp[0] / 1e9
+            vocab = _make_vocab(np.ascontiguousarray(data["centers"], dtype=np.float32),
+                                str(data["vocab_id"]), stamp, gens, trained_at)
+    except Exception as e:
+        print(f"[vocab] 詞彙表讀取失敗：{e}")
+        return None
+    _VOCAB_MEMO[str(root)] = vocab
+    return vocab
+
+
+def _usable(vocab: Optional[dict], generations: Dict[str, str]) -> bool:
+    return vocab is not None and (vocab["generations"] == generations
+                                  or time.time() - vocab["trained_at"] < RETRAIN_MIN_SEC)
+
+
+def load_vocabulary(base_root: str) -> Optional[dict]:
+    """
+    取得 base_root 的詞彙表：還沒訓練過、或底圖的 store generation 與訓練時不同（且距上次訓練已超過
+    RETRAIN_MIN_SEC）就拿鎖重新訓練；拿到鎖後先重讀一次，別的行程剛訓練完就直接用。
+    沒有任何底圖時回 None（不做粗篩）
+    """
+    root = Path(base_root)
+    generations = _generations(root)
+    vocab = _read_vocabulary(root)
+    if _usable(vocab, generations) or not generations:
+        return vocab
+    with file_lock(root / VOCAB_LOCK):
+        vocab = _read_vocabulary(root)
+        if _usable(vocab, generations):
+            return vocab
+        try:
+            return _train_locked(root, VOCAB_WORDS, generations) or vocab
+        except Exception as e:
+            print(f"[vocab] 詞彙表訓練失敗，沿用舊的：{e}")
+            return vocab
+
+
+def _quantize(des, vocab: dict) -> np.ndarray:
+    """描述子 → 每個詞的出現次數"""
+    n_words = len(vocab["centers"])
+    if des is None or len(des) == 0:
+        return np.zeros(n_words, dtype=np.float32)
+    matches = vocab["matcher"].match(np.asarray(des, dtype=np.float32), vocab["centers"])
+    words = np.fromiter((m.trainIdx for m in matches), dtype=np.int64, count=len(matches))
+    return np.bincount(words, minlength=n_words).astype(np.float32)
+
+
+def _tfidf(counts: np.ndarray, idf: np.ndarray) -> np.ndarray:
+    total = counts.sum()
+    if total <= 0:
+        return np.zeros_like(idf)
+    v = (counts / total) * idf
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+
+# -----------------------------
+# 每個 location 的倒排檔
+# -----------------------------
+def _build_bow_index(base_dir: Path, candidates: List[str], key: dict, vocab: dict) -> dict:
+    n_words = len(vocab["centers"])
+    counts = np.zeros((len(candidates), n_words), dtype=np.float32)
+    for ci, p in enumerate(candidates):
+        try:
+            _, des = _load_or_compute_sift(p)
+            counts[ci] = _quantize(des, vocab)
+        except Exception as e:
+            print(f"[bow] 略過 {p}: {e}")
+
+    df = (counts > 0).sum(axis=0)
+    idf = np.where(df > 0, np.log(len(candidates) / np.maximum(df, 1)) + 1.0, 0.0).astype(np.float32)
+    hist = np.stack([_tfidf(c, idf) for c in counts]) if len(candidates) else counts
+
+    # CSR 倒排檔：indptr[w]:indptr[w+1] 是出現詞 w 的候選與權重
+    word_of, cand_of = np.nonzero(hist.T)
+    indptr = np.zeros(n_words + 1, dtype=np.int64)
+    np.add.at(indptr, word_of + 1, 1)
+    indptr = np.cumsum(indptr)
+    post_cand = cand_of.astype(np.int32)
+    post_w = hist.T[word_of, cand_of].astype(np.float32)
+
+    try:
+        atomic_savez(base_dir / BOW_INDEX_FILE, idf=idf, indptr=indptr,
+                     post_cand=post_cand, post_w=post_w,
+                     vocab_id=np.array(vocab["vocab_id"]),
+                     key=np.array(json.dumps(key)))
+    except Exception as e:
+        print(f"[bow] 無法寫入倒排檔：{e}")
+
+    print(f"[bow] 已重建 {base_dir.name}：{len(candidates)} 張，{len(post_cand)} 筆倒排")
+    return {"idf": idf, "indptr": indptr, "post_cand": post_cand, "post_w": post_w,
+            "vocab_id": vocab["vocab_id"], "key": key, "candidates": candidates}
+
+
+def load_bow_index(base_dir: Path, candidates: List[str], vocab: dict) -> dict:
+    """
+    該 location 的底圖（store generation）與詞彙表（vocab_id）都沒變就沿用既有倒排檔，否則只重建這一份；
+    store 由主行程先同步過（infer_many），這裡的 _store_key 在底圖目錄沒變時只 stat 目錄
+    """
+    memo_key = str(base_dir)
+    key = _store_key(base_dir, candidates)
+
+    memo = _BOW_MEMO.get(memo_key)
+    if memo is not None and memo["key"] == key and memo["vocab_id"] == vocab["vocab_id"]:
+        return memo
+
+    idx = None
+    path = base_dir / BOW_INDEX_FILE
+    try:
+        if path.exists():
+            with np.load(path) as data:
+                if ("key" in data.files and str(data["vocab_id"]) == vocab["vocab_id"]
+                        and json.loads(str(data["key"])) == key):
+                    idx = {k: data[k] for k in ("idf", "indptr", "post_cand", "post_w")}
+                    idx.update(vocab_id=vocab["vocab_id"], key=key, candidates=candidates)
+    except Exception as e:
+        print(f"[bow] 倒排檔讀取失敗，改為重建：{e}")
+
+    if idx is None:
+        idx = _build_bow_index(base_dir, candidates, key, vocab)
+
+    _BOW_MEMO[memo_key] = idx
+    return idx
+
+
+def score_candidates(query_des, idx: dict, vocab: dict) -> np.ndarray:
+    """查詢 TF-IDF 與每張候選的 cosine 相似度（只走查詢有出現的詞）"""
+    n_cand = len(idx["candidates"])
+    q = _tfidf(_quantize(query_des, vocab), idx["idf"])
+    words = np.nonzero(q)[0]
+    if len(words) == 0 or n_cand == 0:
+        return np.zeros(n_cand, dtype=np.float64)
+
+    indptr = idx["indptr"]
+    starts, lens = indptr[words], indptr[words + 1] - indptr[words]
+    total = int(lens.sum())
+    if total == 0:
+        return np.zeros(n_cand, dtype=np.float64)
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lens)[:-1])), lens)
+    pos = offsets + np.arange(total)
+    w = idx["post_w"][pos] * np.repeat(q[words], lens)
+    return np.bincount(idx["post_cand"][pos], weights=w, minlength=n_cand)
+
+
+def shortlist(query_des, base_root: str, base_dir: Path, candidates: List[str], top_k: int) -> List[str]:
+    """回傳 BoVW 分數最高的 top_k 張候選底圖路徑"""
+    vocab = load_vocabulary(base_root)
+    if vocab is None:   # 沒有底圖可訓練：不粗篩
+        return candidates
+
+    t0 = time.perf_counter()
+    idx = load_bow_index(base_dir, candidates, vocab)
+    scores = score_candidates(query_des, idx, vocab)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    print(f"[bow] shortlist {len(order)}/{len(candidates)}，{(time.perf_counter() - t0) * 1000:.1f} ms")
+    return [candidates[i] for i in sorted(order)]
+
+
+# 命令列：強制重新訓練詞彙表（平常由 load_vocabulary 依底圖版本自動訓練）
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) >= 3 and sys.argv[1] == "train":
+        words = int(sys.argv[3]) if len(sys.argv) >= 4 else VOCAB_WORDS
+        sys.exit(0 if train_vocabulary(sys.argv[2], words) is not None else 1)
+    print("用法: python visual_vocab.py train <base_root> [n_words]")
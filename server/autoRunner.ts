@@ -1,28 +1,42 @@
-import chokidar from "chokidar";
-import { spawn } from "child_process";
+import { spawn, type ChildProcess } from "child_process";
 import path from "path";
+import readline from "readline";
 import type { Server as IOServer } from "socket.io";
 
 const UPLOADS_DIR = path.resolve("uploads");
-const AUTO_PY = path.resolve("mark/auto_process.py");
+const DAEMON_PY = path.resolve("mark/auto_daemon.py");
+const RESTART_DELAY_MS = 3000;
 
+// auto_daemon 常駐：自己監看 uploads/、依 location 合併批次；
+// 每批完成會印一行 "@event {...}"，收到 batch 事件就通知前端更新紅點
 export function initAutoRunner(io: IOServer) {
-  let running = false;
+  let child: ChildProcess | null = null;
 
-  const runPipeline = () => {
-    if (running) return;
-    running = true;
+  const startDaemon = () => {
+    child = spawn("python", ["-u", DAEMON_PY, "--watch", UPLOADS_DIR], {
+      stdio: ["ignore", "pipe", "inherit"],
+    });
 
-    const p = spawn("python", [AUTO_PY], { stdio: "inherit" });
-    p.on("exit", (code) => {
-      running = false;
-      if (code === 0) io.emit("redPoints:updated");
+    readline.createInterface({ input: child.stdout! }).on("line", (line) => {
+      if (!line.startsWith("@event ")) {
+        console.log(line);
+        return;
+      }
+      try {
+        const ev = JSON.parse(line.slice("@event ".length));
+        if (ev.event === "batch") io.emit("redPoints:updated");
+      } catch {
+        console.log(line);
+      }
     });
-  };
 
-  chokidar
-    .watch(UPLOADS_DIR, { ignoreInitial: true })
-    .on("add", (f) => /\.(jpe?g|png)$/i.test(f) && runPipeline());
+    child.on("exit", (code) => {
+      child = null;
+      console.log(`⚠️ auto_daemon exited (${code}), restarting in ${RESTART_DELAY_MS}ms`);
+      setTimeout(startDaemon, RESTART_DELAY_MS);
+    });
+  };
 
-  console.log("👂 autoRunner watching uploads/");
-}
\ No newline at end of file
+  startDaemon();
+  console.log("👂 autoRunner: auto_daemon watching uploads/");
+}
@@ -0,0 +1,150 @@
+// server/inferenceWorker.ts
+// 常駐 Python 推論 worker（mark/inference_worker.py）的 client：
+// 一個 server 行程只啟動一次，之後每張上傳只送一行 JSON，不再付 python 啟動 + SIFT/模型載入成本。
+import { spawn, type ChildProcessWithoutNullStreams } from "child_process";
+import fs from "fs";
+import path from "path";
+import readline from "readline";
+
+type Pending = {
+  resolve: (v: unknown) => void;
+  reject: (e: Error) => void;
+};
+
+const PYTHON = process.env.PYTHON || "python";
+const WORKER_PATH =
+  process.env.INFERENCE_WORKER || path.resolve("mark", "inference_worker.py");
+// <BASE_IMAGES_ROOT>/<location>_base_images：啟動時把每個 location 的描述子庫 / 索引先載好
+const BASE_IMAGES_ROOT = process.env.BASE_IMAGES_ROOT || path.resolve(".");
+// 逾時就丟掉 worker、讓呼叫端退回單次行程（routes.ts 的 inferArea / fuseWithSift）。
+// 冷啟動 --warm 可能要重算 SIFT；逾時被砍掉也不會白做：描述子庫每張底圖各自落地，下次啟動直接認回
+const READY_TIMEOUT_MS = Number(process.env.WORKER_READY_TIMEOUT_MS || 120_000);
+const CALL_TIMEOUT_MS = Number(process.env.WORKER_CALL_TIMEOUT_MS || 120_000);
+
+let child: ChildProcessWithoutNullStreams | null = null;
+let ready: Promise<void> | null = null;
+let nextId = 0;
+const pending = new Map<number, Pending>();
+
+function failAll(err: Error) {
+  for (const p of Array.from(pending.values())) p.reject(err);
+  pending.clear();
+}
+
+function warmArgs(): string[] {
+  let locations: string[] = [];
+  try {
+    locations = fs
+      .readdirSync(BASE_IMAGES_ROOT, { withFileTypes: true })
+      .filter((d) => d.isDirectory() && d.name.endsWith("_base_images"))
+      .map((d) => d.name.slice(0, -"_base_images".length));
+  } catch {
+    return [];
+  }
+  return ["--base-root", BASE_IMAGES_ROOT, ...locations.flatMap((loc) => ["--warm", loc])];
+}
+
+// worker 掛了（EPIPE / exit）：丟掉這個行程、讓等待中的呼叫失敗；下一次 callWorker 會重新 spawn
+function discard(proc: ChildProcessWithoutNullStreams, err: Error) {
+  if (child === proc) {
+    child = null;
+    ready = null;
+    failAll(err);   // 已被換掉的舊行程晚到的 exit 不能連累新行程的呼叫
+  }
+  if (proc.exitCode === null) proc.kill();
+}
+
+function start(): Promise<void> {
+  if (ready) return ready;
+
+  ready = new Promise<void>((resolve, reject) => {
+    const markDir = path.dirname(WORKER_PATH);
+    const proc = spawn(PYTHON, ["-u", WORKER_PATH, ...warmArgs()], {
+      env: {
+        ...process.env,
+        PYTHONPATH: `${markDir}${path.delimiter}${path.resolve(markDir, "..")}`,
+        PYTHONIOENCODING: "utf-8",
+      },
+    });
+    child = proc;
+
+    const readyTimer = setTimeout(() => {
+      const err = new Error(`inference worker 啟動逾時（${READY_TIMEOUT_MS} ms）`);
+      discard(proc, err);
+      reject(err);
+    }, READY_TIMEOUT_MS);
+
+    proc.stderr.on("data", (d) => process.stderr.write(`[worker] ${d}`));
+
+    const rl = readline.createInterface({ input: proc.stdout });
+    rl.on("line", (line) => {
+      if (!line.startsWith("{")) return;
+      let msg: any;
+      try {
+        msg = JSON.parse(line);
+      } catch {
+        return;
+      }
+      if (msg.event === "ready") {
+        clearTimeout(readyTimer);
+        console.log(`🔌 inference worker 就緒（startup ${msg.startup_ms} ms）`);
+        resolve();
+        return;
+      }
+      const p = pending.get(msg.id);
+      if (!p) return;
+      pending.delete(msg.id);
+      if (msg.ok) p.resolve(msg.result);
+      else p.reject(new Error(msg.error || "worker error"));
+    });
+
+    const onExit = (why: string) => {
+      clearTimeout(readyTimer);
+      const err = new Error(`inference worker 結束：${why}`);
+      discard(proc, err);
+      reject(err);
+    };
+    proc.on("error", (e) => onExit(e.message));
+    proc.on("exit", (code) => onExit(`code=${code}`));
+    proc.stdin.on("error", (e) => onExit(`stdin ${e.message}`));
+  });
+
+  return ready;
+}
+
+export async function callWorker<T = unknown>(op: string, args: Record<string, unknown>): Promise<T> {
+  await start();
+  const proc = child;
+  if (!proc) throw new Error("inference worker 未啟動");
+
+  const id = ++nextId;
+  return new Promise<T>((resolve, reject) => {
+    // 卡住的 worker 不能讓上傳無限等：逾時就丟掉整個行程（其他等待中的呼叫一起失敗、各自退回）
+    const timer = setTimeout(() => {
+      const err = new Error(`inference worker 呼叫逾時（${op}，${CALL_TIMEOUT_MS} ms）`);
+      discard(proc, err);
+      const p = pending.get(id);   // proc 已被換掉時 discard 不會動 pending，這裡自己結束
+      if (p) {
+        pending.delete(id);
+        p.reject(err);
+      }
+    }, CALL_TIMEOUT_MS);
+    pending.set(id, {
+      resolve: (v) => {
+        clearTimeout(timer);
+        resolve(v as T);
+      },
+      reject: (e) => {
+        clearTimeout(timer);
+        reject(e);
+      },
+    });
+    if (!proc.stdin.writable) {
+      discard(proc, new Error("inference worker stdin 已關閉"));
+      return;
+    }
+    proc.stdin.write(JSON.stringify({ id, op, args }) + "\n", (err) => {
+      if (err) discard(proc, new Error(`inference worker 寫入失敗：${err.message}`));
+    });
+  });
+}
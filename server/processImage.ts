@@ -21,16 +21,17 @@ export async function processImage(location: string, safeFilename: string): Prom
     }
 
     const processedPath = path.join("processed_images", baseMap[location].output);
-    const basePath = fs.existsSync(processedPath)
-      ? processedPath
-      : path.join("base_images", baseMap[location].base);
+    const sourcePath = path.join("base_images", baseMap[location].base);
+    const basePath = fs.existsSync(processedPath) ? processedPath : sourcePath;
 
     const inputPath = path.join("uploads", safeFilename);
     const outputPath = path.join("processed_images", baseMap[location].output);
 
-    console.log(`🔧 執行融合：python sift_v1.py ${basePath} ${inputPath} ${outputPath}`);
+    console.log(`🔧 執行融合：python sift_v1.py ${basePath} ${inputPath} ${outputPath} --features ${sourcePath} --latest`);
 
-    const python = spawn("python", ["sift_v1.py", basePath, inputPath, outputPath]);
+    // --features：底圖特徵取不會被改寫的原圖，特徵快取才會命中
+    // --latest：拿到區域鎖時輸出檔已存在就疊在它上面（挑底圖之後別的融合可能剛寫完）
+    const python = spawn("python", ["sift_v1.py", basePath, inputPath, outputPath, "--features", sourcePath, "--latest"]);
 
     python.stdout.on("data", (data: Buffer) => {
       console.log(`融合 stdout: ${data.toString()}`);
@@ -16,6 +16,7 @@ import path from "path";
 import fs from "fs";
 import { registerRedPointsRoutes } from "./redPoints.js"; 
 import { processImage } from "./processImage.js";
+import { callWorker } from "./inferenceWorker.js";
 import { createClient } from "@supabase/supabase-js";
 import "dotenv/config";
 import { db } from "./db.js";  // ✅ 匯入 db
@@ -564,6 +565,7 @@ app.post("/api/uploads", requireAuth, upload.single("file"), async (req, res) =>
         const INFER_PATH = process.env.INFER_PATH || path.join(MARK_DIR, "infer_location.py");     // 絕對路徑
         const PROCESSED_IMAGES_DIR = process.env.PROCESSED_IMAGES_DIR || path.resolve(ROOT, "processed_images");
         const BASE_IMAGES_DIR = process.env.BASE_IMAGES_DIR || path.resolve(ROOT, "base_images");
+        const BASE_IMAGES_ROOT = process.env.BASE_IMAGES_ROOT || ROOT;   // 底下是 <location>_base_images
         const SIFT_SCRIPT = process.env.SIFT_SCRIPT || path.join(ROOT, "sift_v1.py");
         const PYTHON = process.env.PYTHON || "python";
 
@@ -583,14 +585,34 @@ app.post("/api/uploads", requireAuth, upload.single("file"), async (req, res) =>
             child.on("close", (code) => resolve({ stdout, stderr, code: code ?? -1 }));
           });
 
-        // 1) 推論區位：用 importlib 直接載入 infer_location.py
+        // 常駐 worker（mark/inference_worker.py），設 USE_INFERENCE_WORKER=0 可退回每次開新行程
+        const USE_WORKER = process.env.USE_INFERENCE_WORKER !== "0";
+
+        // 1) 推論區位：優先交給常駐 worker，失敗再用 importlib 直接載入 infer_location.py
         async function inferArea(uploadAbsPath: string): Promise<string> {
+          if (USE_WORKER) {
+            let area: string | null | undefined;
+            try {
+              area = await callWorker<string | null>("infer_area", {
+                query_path: uploadAbsPath,
+                base_root: BASE_IMAGES_ROOT,
+                location,
+              });
+            } catch (e) {
+              console.error("[inferArea] worker 失敗，改用單次行程：", e);
+            }
+            if (area !== undefined) {
+              if (!area) throw new Error("無法解析推論區域");
+              return area;
+            }
+          }
+
           const pySnippet = [
   'import importlib.util',
   `spec = importlib.util.spec_from_file_location("infer_location", r"${INFER_PATH}")`,
   'mod = importlib.util.module_from_spec(spec)',
   'spec.loader.exec_module(mod)',
-  `loc = mod.infer_location_clip(r"${uploadAbsPath}", processed_images_dir=r"${PROCESSED_IMAGES_DIR}")`,
+  `loc = mod.infer_area_by_kp(r"${uploadAbsPath}", r"${BASE_IMAGES_ROOT}", ${JSON.stringify(location)})`,
   'print("RESULT:", loc if loc else "")'
 ].join('\n');
 
@@ -621,10 +643,36 @@ app.post("/api/uploads", requireAuth, upload.single("file"), async (req, res) =>
           throw new Error(`找不到底圖：${processed} 或 ${base}`);
         }
 
-        // 3) 融合：sift_v1.py base upload output
-        async function fuseWithSift(basePath: string, uploadPath: string, outPath: string) {
+        // 底圖特徵一律取 base_images/base_<區位>.jpg（不會被融合改寫，特徵快取才會命中）
+        function featureSource(area: string): string | undefined {
+          const base = path.join(BASE_IMAGES_DIR, `base_${area}.jpg`);
+          return fsSync.existsSync(base) ? base : undefined;
+        }
+
+        // 3) 融合：sift_v1.py base upload output [--features base_<區位>.jpg] --latest
+        //    （--latest：拿到區域鎖時輸出檔已被別的融合寫出，就疊在它上面，不退回原圖）
+        async function fuseWithSift(basePath: string, uploadPath: string, outPath: string, source?: string) {
+          if (USE_WORKER) {
+            let out: string | null | undefined;
+            try {
+              out = await callWorker<string | null>("fuse", {
+                base_path: basePath,
+                upload_path: uploadPath,
+                out_path: outPath,
+                feature_source: source ?? null,
+                latest: true,
+              });
+            } catch (e) {
+              console.error("[sift] worker 失敗，改用單次行程：", e);
+            }
+            if (out !== undefined) {
+              if (!out) throw new Error("sift 融合失敗");
+              return;
+            }
+          }
+
           const { stdout, stderr, code: exitCode } = await runPython(
-            [SIFT_SCRIPT, basePath, uploadPath, outPath],
+            [SIFT_SCRIPT, basePath, uploadPath, outPath, ...(source ? ["--features", source] : []), "--latest"],
             { PYTHONPATH: `${MARK_DIR}:${ROOT}` }
           );
           if (exitCode !== 0) {
@@ -640,7 +688,7 @@ app.post("/api/uploads", requireAuth, upload.single("file"), async (req, res) =>
         const basePath = pickBase(inferredArea);
         const fusedPath = path.join(PROCESSED_IMAGES_DIR, `${inferredArea}_output.jpg`); // 覆蓋更新
 
-        await fuseWithSift(basePath, uploadAbsPath, fusedPath);
+        await fuseWithSift(basePath, uploadAbsPath, fusedPath, featureSource(inferredArea));
         console.log(`[uploads] ✅ 推論區位=${inferredArea}，已輸出融合：${fusedPath}`);
       } catch (e) {
         console.error("[uploads][infer+fuse] 失敗：", e);
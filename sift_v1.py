@@ -2,64 +2,439 @@ import cv2
 import numpy as np
 import sys
 import os
+from datetime import datetime
 
-def replace_region_with_visible_mask_feature_matching(base_img_path, target_img_path):
-    base_img = cv2.imread(base_img_path, cv2.IMREAD_COLOR)
-    target_img = cv2.imread(target_img_path, cv2.IMREAD_COLOR)
+# descriptor_store 在 mark/ 底下（processImage.ts 直接 python sift_v1.py，不會帶 PYTHONPATH）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mark"))
+from atomic_io import atomic_write_bytes, file_lock
+from capture_ts import filename_capture_time
+from descriptor_store import load_or_compute_by_hash
 
-    if base_img is None or target_img is None:
-        raise FileNotFoundError("讀取影像失敗，請確認檔案路徑。")
+SIFT_PARAMS = dict(nfeatures=500, nOctaveLayers=5, contrastThreshold=0.05, edgeThreshold=8)
+FEATURE_TAG = "v1_n500_l5_c005_e8"   # 底圖特徵快取的 tag，SIFT_PARAMS 改了就要跟著改
+
+# 金字塔模式：在寬度 WORK_WIDTH 的縮圖上偵測/比對/估 H，再用縮放矩陣還原到全解析度；0 = 全解析度（原行為）
+# mark/benchmarks/bench_fuse.py（A03_output.jpg 4032px + 同區 4032px 上傳）：全解析度估 H 8.9s / peak RSS 3.9GB，
+# w=1600 為 1.5s / 0.7GB，投影與全解析度的 H 差 平均 0.05 / 最大 0.13 px（w=1000 為 0.08 / 0.23 px）
+WORK_WIDTH     = int(os.environ.get("FUSE_WORK_WIDTH", "1600"))
+REFINE         = os.environ.get("FUSE_REFINE", "0") == "1"       # 全解析度局部視窗微調
+REFINE_POINTS  = int(os.environ.get("FUSE_REFINE_POINTS", "16"))
+REFINE_WIN     = int(os.environ.get("FUSE_REFINE_WIN", "24"))    # 樣板半徑（px）
+REFINE_SEARCH  = int(os.environ.get("FUSE_REFINE_SEARCH", "8"))  # 搜尋範圍（px）
+REFINE_MIN_HOLDOUT = int(os.environ.get("FUSE_REFINE_MIN_HOLDOUT", "8"))  # 驗收用的 held-out inlier 數下限
+
+# 只在上傳圖投影到底圖的範圍內做 warp / diff / 形態學 / blur / 合成
+USE_ROI        = os.environ.get("FUSE_ROI", "1") != "0"
+BLUR_KSIZE     = 35
+ROI_PAD        = BLUR_KSIZE // 2 + 1    # blur 半徑 + close 的 1px，邊界結果才會跟全圖一致
+
+_sift = None
+
+
+def _get_sift():
+    global _sift
+    if _sift is None:
+        _sift = cv2.SIFT_create(**SIFT_PARAMS)
+    return _sift
+
+
+def _scale_for(shape, work_width):
+    w = shape[1]
+    return work_width / float(w) if work_width and w > work_width else 1.0
+
+
+def _gray_at(img_bgr, scale):
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    if scale != 1.0:
+        h, w = gray.shape[:2]
+        gray = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def _detect(gray):
+    """回傳 (kp Nx3 [x, y, size], des)"""
+    kp, des = _get_sift().detectAndCompute(gray, None)
+    kparr = np.array([[k.pt[0], k.pt[1], k.size] for k in kp], dtype=np.float32).reshape(-1, 3)
+    return kparr, des
+
+
+def _detect_file(img_path, work_width=0):
+    img = cv2.imread(img_path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise FileNotFoundError(f"讀取影像失敗：{img_path}")
+    return _detect(_gray_at(img, _scale_for(img.shape, work_width)))
+
+
+_SHAPE_MEMO = {}
+
+
+def _image_shape(path):
+    """(h, w)；同一行程內檔案沒變就不重讀"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if key not in _SHAPE_MEMO:
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise FileNotFoundError(f"讀取影像失敗：{path}")
+        _SHAPE_MEMO[key] = img.shape[:2]
+    return _SHAPE_MEMO[key]
 
-    sift = cv2.SIFT_create(nfeatures=500, nOctaveLayers=5, contrastThreshold=0.05, edgeThreshold=8)
 
-    base_gray = cv2.cvtColor(base_img, cv2.COLOR_BGR2GRAY)
-    target_gray = cv2.cvtColor(target_img, cv2.COLOR_BGR2GRAY)
+def feature_source_for(base_img_path, feature_source, base_shape=None):
+    """
+    底圖特徵要從哪張圖取：
+    <area>_output.jpg 每次融合都會被改寫，內容雜湊每次都不同，拿它當快取鍵永遠不會命中；
+    融合只改局部內容、不改幾何，所以改用它的來源原圖（base_images/base_<area>.jpg，不會變）的特徵。
+    feature_source 不存在或尺寸和底圖不同時退回底圖本身。
+    """
+    if not feature_source or not os.path.exists(feature_source):
+        return base_img_path
+    if os.path.abspath(feature_source) == os.path.abspath(base_img_path):
+        return base_img_path
+    if base_shape is None:
+        base_shape = _image_shape(base_img_path)
+    if tuple(_image_shape(feature_source)) != tuple(base_shape[:2]):
+        print(f"特徵來源尺寸與底圖不同，改用底圖本身：{feature_source}")
+        return base_img_path
+    return feature_source
 
-    kp1, des1 = sift.detectAndCompute(base_gray, None)
-    kp2, des2 = sift.detectAndCompute(target_gray, None)
+
+def load_base_features(base_img_path, use_cache=True, work_width=0):
+    """
+    底圖特徵（座標在 work_width 的縮圖上）：以檔案內容 sha1 為鍵快取在
+    {底圖資料夾}/_sift_store/by_hash/（與 infer_location 的 descriptor_store 同一套格式）
+    融合時傳進來的應該是 feature_source_for() 挑出的不變來源圖
+    """
+    tag = f"{FEATURE_TAG}_w{work_width}" if work_width else FEATURE_TAG
+    compute = lambda p: _detect_file(p, work_width)
+    if use_cache:
+        return load_or_compute_by_hash(base_img_path, tag, compute)[:2]
+    return compute(base_img_path)
+
+
+def _scale_mat(s):
+    return np.array([[s, 0, 0], [0, s, 0], [0, 0, 1]], dtype=np.float64)
+
+
+def _holdout_error(H, pts_t, pts_b):
+    """target → base 重投影誤差的中位數（px）"""
+    proj = cv2.perspectiveTransform(pts_t.reshape(-1, 1, 2).astype(np.float32), H).reshape(-1, 2)
+    return float(np.median(np.linalg.norm(proj - pts_b, axis=1)))
+
+
+def _refine_homography(M, base_gray, target_gray, pts_t, pts_b,
+                       n=REFINE_POINTS, r=REFINE_WIN, search=REFINE_SEARCH):
+    """
+    在全解析度上挑少量 inlier，把 target 的小視窗依 M 投到底圖座標當樣板，
+    於底圖對應位置 ±search 內 matchTemplate 找位移，修正後重估 H（M2）。
+    pts_t / pts_b：縮圖上 RANSAC inlier 的 target / base 座標（已換回全解析度），一一對應。
+    驗收：只用「沒被挑去做樣板」的 inlier（held-out，至少 REFINE_MIN_HOLDOUT 個）比較
+    重投影誤差中位數，M2 嚴格小於 M 才採用；held-out 不夠就保留 M。
+    （在擬合 M2 的那些點上比誤差沒有意義，M2 本來就是對它們最佳化的）
+    """
+    if len(pts_t) < 4:
+        return M
+    pick = np.unique(np.linspace(0, len(pts_t) - 1, min(n, len(pts_t))).astype(int))
+    held = np.ones(len(pts_t), dtype=bool)
+    held[pick] = False
+    if held.sum() < REFINE_MIN_HOLDOUT:
+        return M
+    sel = pts_t[pick]
+    pred = cv2.perspectiveTransform(sel.reshape(-1, 1, 2).astype(np.float32), M).reshape(-1, 2)
+    bh, bw = base_gray.shape[:2]
+    size = 2 * r + 1
+
+    src, dst = [], []
+    for (tx, ty), (bx, by) in zip(sel, pred):
+        x0, y0 = int(round(bx)) - r, int(round(by)) - r
+        if x0 - search < 0 or y0 - search < 0 or x0 + size + search > bw or y0 + size + search > bh:
+            continue
+        T = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64) @ M
+        tpl = cv2.warpPerspective(target_gray, T, (size, size))
+        if tpl.std() < 2:   # 沒有紋理，比不出位移
+            continue
+        region = base_gray[y0 - search:y0 + size + search, x0 - search:x0 + size + search]
+        res = cv2.matchTemplate(region, tpl, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (mx, my) = cv2.minMaxLoc(res)
+        if score < 0.7:
+            continue
+        src.append([tx, ty])
+        dst.append([bx + (mx - search), by + (my - search)])
+
+    if len(src) < 4:
+        return M
+    src, dst = np.float32(src).reshape(-1, 1, 2), np.float32(dst).reshape(-1, 1, 2)
+    M2, _ = cv2.findHomography(src, dst, cv2.RANSAC, 2.0)
+    if M2 is None:
+        return M
+
+    e_old = _holdout_error(M, pts_t[held], pts_b[held])
+    e_new = _holdout_error(M2, pts_t[held], pts_b[held])
+    print(f"refine：held-out {int(held.sum())} 點，誤差中位數 {e_old:.2f} → {e_new:.2f} px"
+          f"（{'採用' if e_new < e_old else '保留原 H'}）")
+    return M2 if e_new < e_old else M
+
+
+def estimate_homography(base_img, target_img, base_features=None, work_width=WORK_WIDTH,
+                        refine=REFINE, base_img_path=None, use_cache=True, feature_source=None):
+    """
+    回傳把 target 投到 base（全解析度）的 M，失敗回 None。
+    work_width > 0 時在縮圖上估 H_small，再 M = S_b^-1 · H_small · S_t；
+    base_features 必須是同一個 work_width 下的特徵。
+    feature_source：底圖的不變來源圖（見 feature_source_for），特徵從它的快取取。
+    """
+    sb = _scale_for(base_img.shape, work_width)
+    st = _scale_for(target_img.shape, work_width)
+
+    if base_features is None:
+        if base_img_path is not None:
+            src = feature_source_for(base_img_path, feature_source, base_img.shape)
+            base_features = load_base_features(src, use_cache, work_width)
+        else:
+            base_features = _detect(_gray_at(base_img, sb))
+    kp1, des1 = base_features
+    if len(kp1) and isinstance(kp1[0], cv2.KeyPoint):
+        pts1 = np.float32([k.pt for k in kp1])
+    else:
+        pts1 = np.asarray(kp1, dtype=np.float32).reshape(len(kp1), -1)[:, :2]
+
+    kp2, des2 = _detect(_gray_at(target_img, st))
+
+    if des1 is None or des2 is None or len(des1) == 0 or len(des2) == 0:
+        print("匹配點不足（沒有特徵點）")
+        return None
 
     bf = cv2.BFMatcher(normType=cv2.NORM_L2, crossCheck=True)
-    matches = bf.match(des1, des2)
+    matches = bf.match(np.asarray(des1, dtype=np.float32), des2)
     good = list(matches)
 
     if len(good) < 4:
         print(f"匹配點不足（只有 {len(good)} 個）")
         return None
 
-    src_pts = np.float32([kp1[m.queryIdx].pt for m in good]).reshape(-1, 1, 2)
-    dst_pts = np.float32([kp2[m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
-    M, _ = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, 1.0)
+    src_pts = np.float32([pts1[m.queryIdx] for m in good]).reshape(-1, 1, 2)
+    dst_pts = np.float32([kp2[m.trainIdx, :2] for m in good]).reshape(-1, 1, 2)
+    M, inliers = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, 1.0)
+    if M is None:
+        print("Homography 估計失敗")
+        return None
+
+    if sb != 1.0 or st != 1.0:
+        M = np.linalg.inv(_scale_mat(sb)) @ M @ _scale_mat(st)
+        M /= M[2, 2]
+        if refine:
+            inl = inliers.ravel() > 0
+            pts_t = dst_pts.reshape(-1, 2)[inl] / st
+            pts_b = src_pts.reshape(-1, 2)[inl] / sb
+            M = _refine_homography(M, cv2.cvtColor(base_img, cv2.COLOR_BGR2GRAY),
+                                   cv2.cvtColor(target_img, cv2.COLOR_BGR2GRAY), pts_t, pts_b)
+    return M
+
+
+def _projected_roi(M, target_shape, base_shape, pad=ROI_PAD):
+    """
+    target 四角經 M 投到底圖後的外接框（加 pad、裁到底圖範圍）：(x0, y0, x1, y1)
+    完全沒重疊回 None；有角點落在地平線後方（w <= 0）時退回整張底圖
+    """
+    bh, bw = base_shape[:2]
+    th, tw = target_shape[:2]
+    corners = np.array([[0, 0, 1], [tw, 0, 1], [tw, th, 1], [0, th, 1]], dtype=np.float64)
+    proj = corners @ np.asarray(M, dtype=np.float64).T
+    if np.any(proj[:, 2] <= 1e-9):
+        return 0, 0, bw, bh
+    xy = proj[:, :2] / proj[:, 2:3]
+    x0 = max(0, int(np.floor(xy[:, 0].min())) - pad)
+    y0 = max(0, int(np.floor(xy[:, 1].min())) - pad)
+    x1 = min(bw, int(np.ceil(xy[:, 0].max())) + 1 + pad)
+    y1 = min(bh, int(np.ceil(xy[:, 1].max())) + 1 + pad)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1, y1
+
+
+def blend_into_base(base_img, target_img, M, use_roi=USE_ROI):
+    """把 target 依 M 融合進 base_img（原地修改並回傳 base_img）"""
     h, w, _ = base_img.shape
-    warped_target = cv2.warpPerspective(target_img, M, (w, h))
+    roi = _projected_roi(M, target_img.shape, base_img.shape) if use_roi else (0, 0, w, h)
+    if roi is None:
+        print("上傳圖投影後與底圖沒有重疊")
+        return base_img
+    x0, y0, x1, y1 = roi
+
+    T = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64) @ M
+    warped_target = cv2.warpPerspective(target_img, T, (x1 - x0, y1 - y0))
+    base_roi = base_img[y0:y1, x0:x1]   # view，寫回即原地更新
 
-    diff = cv2.absdiff(warped_target, base_img)
+    diff = cv2.absdiff(warped_target, base_roi)
     gray_diff = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
     _, mask = cv2.threshold(gray_diff, 1, 255, cv2.THRESH_BINARY)
     kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
     mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-    mask = cv2.blur(mask, (35, 35))
+    mask = cv2.blur(mask, (BLUR_KSIZE, BLUR_KSIZE))
 
     warped_gray = cv2.cvtColor(warped_target, cv2.COLOR_BGR2GRAY)
     black_mask = (warped_gray == 0)
-    result = base_img.copy()
     final_mask = (mask > 0) & (~black_mask)
-    result[final_mask] = warped_target[final_mask]
+    base_roi[final_mask] = warped_target[final_mask]
+
+    return base_img
+
+
+def replace_region_with_visible_mask_feature_matching(base_img_path, target_img_path,
+                                                      base_features=None, use_cache=True,
+                                                      work_width=WORK_WIDTH, refine=REFINE,
+                                                      use_roi=USE_ROI, feature_source=None):
+    """
+    base_features: 預先算好的底圖 (kp, des)；kp 可為 cv2.KeyPoint list 或 Nx2/Nx3 陣列。
+    沒給就從內容雜湊快取取（use_cache=False 則每次重算）；
+    feature_source 是底圖的不變來源圖（base_images/base_<area>.jpg），有給就用它的快取。
+    work_width: 估 H 用的工作寬度（0 = 全解析度）；warp 一律在全解析度做。
+    use_roi: 只處理上傳圖投影範圍（False = 整張底圖，舊行為）。
+    """
+    base_img = cv2.imread(base_img_path, cv2.IMREAD_COLOR)
+    target_img = cv2.imread(target_img_path, cv2.IMREAD_COLOR)
+
+    if base_img is None or target_img is None:
+        raise FileNotFoundError("讀取影像失敗，請確認檔案路徑。")
+
+    M = estimate_homography(base_img, target_img, base_features, work_width, refine,
+                            base_img_path=base_img_path, use_cache=use_cache,
+                            feature_source=feature_source)
+    if M is None:
+        return None
+
+    return blend_into_base(base_img, target_img, M, use_roi)
+
+# -----------------------------
+# 批次融合：同一張底圖 + 多張上傳，底圖只讀一次、算一次特徵、寫一次
+# -----------------------------
+# 上傳檔名：<location>_YYYY-MM-DD-HH-MM[-SS].jpg（例如 left_2025-07-29-16-59.jpg）
+def order_uploads(paths):
+    """依拍攝時間由舊到新（新的最後蓋上去）；檔名沒有時間就用檔案 mtime"""
+    def key(p):
+        ts = filename_capture_time(p)
+        if ts is None:
+            try:
+                ts = datetime.fromtimestamp(os.path.getmtime(p))
+            except OSError:
+                ts = datetime.min
+        return ts, os.path.basename(p)
+    return sorted(paths, key=key)
+
+
+def atomic_imwrite(path, img):
+    """先寫暫存檔再 os.replace，讀的人不會看到寫一半的底圖；並行寫入時最後一個完整覆蓋"""
+    ext = os.path.splitext(path)[1] or ".jpg"
+    ok, buf = cv2.imencode(ext, img)
+    if not ok:
+        raise RuntimeError(f"影像編碼失敗：{path}")
+    atomic_write_bytes(path, buf.tobytes())
+
+
+def _area_lock(output_path):
+    """同一個輸出檔（= 同一區）的讀-融合-寫跨行程互斥：routes / worker / CLI / 批次都經過這把鎖"""
+    return file_lock(f"{output_path}.lock")
+
+
+def _current_base(base_img_path, output_path, latest=False):
+    """
+    拿到鎖後再決定底圖。呼叫端明確給的底圖照用（例如從原圖重新融合）；
+    只有 latest=True、或給的底圖就是輸出檔時，才改疊在輸出檔現況上（挑底圖時別的融合可能剛寫完）
+    """
+    if latest or os.path.abspath(base_img_path) == os.path.abspath(output_path):
+        return output_path if os.path.exists(output_path) else base_img_path
+    return base_img_path
+
+
+def fuse_into(base_img_path, upload_path, output_path, feature_source=None, latest=False, **kwargs):
+    """單張融合並寫回 output_path（持有該區的鎖）；回傳是否成功。latest 見 _current_base"""
+    with _area_lock(output_path):
+        result = replace_region_with_visible_mask_feature_matching(
+            _current_base(base_img_path, output_path, latest), upload_path,
+            feature_source=feature_source, **kwargs)
+        if result is None:
+            return False
+        atomic_imwrite(output_path, result)
+        return True
+
+
+def fuse_batch(base_img_path, upload_paths, output_path, sort_by_time=True,
+               work_width=WORK_WIDTH, refine=REFINE, use_roi=USE_ROI, feature_source=None, latest=False):
+    """
+    依序把 upload_paths 融合進同一張底圖，最後只寫一次 output_path（整批持有該區的鎖）。
+    底圖特徵只取一次（幾何不變，融合只改局部內容），回傳成功融合的張數。latest 見 _current_base
+    """
+    with _area_lock(output_path):
+        return _fuse_batch_locked(_current_base(base_img_path, output_path, latest), upload_paths, output_path,
+                                  sort_by_time, work_width, refine, use_roi, feature_source)
+
+
+def _fuse_batch_locked(base_img_path, upload_paths, output_path, sort_by_time,
+                       work_width, refine, use_roi, feature_source):
+    base_img = cv2.imread(base_img_path, cv2.IMREAD_COLOR)
+    if base_img is None:
+        raise FileNotFoundError(f"讀取底圖失敗：{base_img_path}")
+    src = feature_source_for(base_img_path, feature_source, base_img.shape)
+    base_features = load_base_features(src, True, work_width)
+
+    ordered = order_uploads(upload_paths) if sort_by_time else list(upload_paths)
+    fused = 0
+    for p in ordered:
+        target_img = cv2.imread(p, cv2.IMREAD_COLOR)
+        if target_img is None:
+            print(f"略過（讀取失敗）：{p}")
+            continue
+        M = estimate_homography(base_img, target_img, base_features, work_width, refine)
+        if M is None:
+            print(f"略過（無法對齊）：{p}")
+            continue
+        blend_into_base(base_img, target_img, M, use_roi)
+        fused += 1
+        print(f"已融合 {os.path.basename(p)}")
+
+    if fused:
+        atomic_imwrite(output_path, base_img)
+        print(f"批次融合完成：{fused}/{len(ordered)} 張 → {output_path}")
+    else:
+        print("批次融合：沒有任何一張成功")
+    return fused
+
+
+def _pop_flag(argv, name):
+    if name in argv:
+        argv.remove(name)
+        return True
+    return False
+
+
+def _pop_option(argv, name):
+    if name in argv:
+        i = argv.index(name)
+        value = argv[i + 1] if i + 1 < len(argv) else None
+        del argv[i:i + 2]
+        return value
+    return None
 
-    return result
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("用法: python sift_v1.py base_img.jpg upload_img.jpg output_img.jpg")
-        sys.exit(1)
+    argv = sys.argv[1:]
+    feature_source = _pop_option(argv, "--features")   # 底圖的不變來源圖（base_images/base_<area>.jpg）
+    latest = _pop_flag(argv, "--latest")                # 輸出檔已存在就疊在它上面，不用給的底圖
 
-    base_img_path = sys.argv[1]
-    target_img_path = sys.argv[2]
-    output_img_path = sys.argv[3]
+    if len(argv) >= 4 and argv[0] == "--batch":
+        n = fuse_batch(argv[1], argv[3:], argv[2], feature_source=feature_source, latest=latest)
+        sys.exit(0 if n else 1)
+
+    if len(argv) != 3:
+        print("用法: python sift_v1.py base_img.jpg upload_img.jpg output_img.jpg [--features base_src.jpg] [--latest]")
+        print("      python sift_v1.py --batch base_img.jpg output_img.jpg upload1.jpg [upload2.jpg ...] [--features base_src.jpg] [--latest]")
+        print("      base_img 照給的用（可從原圖重新融合）；--latest：輸出檔已存在就改疊在輸出檔上")
+        print("      （底圖給的就是輸出檔時，一律以拿到區域鎖當下的輸出檔為準）")
+        sys.exit(1)
 
-    result_img = replace_region_with_visible_mask_feature_matching(base_img_path, target_img_path)
+    base_img_path, target_img_path, output_img_path = argv
 
-    if result_img is not None:
-        cv2.imwrite(output_img_path, result_img)
+    if fuse_into(base_img_path, target_img_path, output_img_path, feature_source=feature_source, latest=latest):
         print(f"處理完成：{output_img_path}")
     else:
         print("融合失敗")